@@ -1,6 +1,8 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from app.schemas.dashboards import ChartCreate, ChartUpdate, ChartResponse, DashboardCreate, DashboardUpdate, DashboardResponse
 from app.services.dashboards import chart_service, dashboard_service
+from app.services.result_format import encode_json_line, NDJSON_MEDIA_TYPE
 
 router = APIRouter()
 
@@ -63,6 +65,20 @@ async def get_dashboard(dashboard_id: int):
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
 
+# 渲染仪表盘：以NDJSON格式逐个返回组件数据，先完成的组件先返回
+@router.get("/dashboards/{dashboard_id}/render")
+async def render_dashboard(dashboard_id: int):
+    try:
+        results = await dashboard_service.render(dashboard_id)
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    async def body():
+        async for item in results:
+            yield encode_json_line(item)
+
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE)
+
 @router.put("/dashboards/{dashboard_id}", response_model=DashboardResponse)
 async def update_dashboard(dashboard_id: int, dashboard: DashboardUpdate):
     try:
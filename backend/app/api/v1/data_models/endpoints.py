@@ -1,6 +1,8 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from app.schemas.data_models import DataSetCreate, DataSetUpdate, DataSetResponse, DataModelCreate, DataModelUpdate, DataModelResponse
+from app.schemas.data_models import DataSetExtractConfig, DataSetExtractResponse, RollupCreate, RollupUpdate, RollupResponse, RollupAdvice
 from app.services.data_models import data_set_service, data_model_service
+from app.services.analytics import extract_service, rollup_service
 
 router = APIRouter()
 
@@ -41,6 +43,36 @@ async def delete_data_set(data_set_id: int):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+# 数据集抽取（本地快照）相关接口
+@router.get("/data-sets/{data_set_id}/extract", response_model=DataSetExtractResponse)
+async def get_data_set_extract(data_set_id: int):
+    try:
+        return await extract_service.get(data_set_id)
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@router.put("/data-sets/{data_set_id}/extract", response_model=DataSetExtractResponse)
+async def configure_data_set_extract(data_set_id: int, config: DataSetExtractConfig):
+    try:
+        return await extract_service.configure(data_set_id, config)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/data-sets/{data_set_id}/extract/refresh", response_model=DataSetExtractResponse)
+async def refresh_data_set_extract(data_set_id: int, full: bool = Query(False, description="是否全量刷新")):
+    try:
+        return await extract_service.refresh(data_set_id, full=full)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.delete("/data-sets/{data_set_id}/extract")
+async def delete_data_set_extract(data_set_id: int):
+    try:
+        await extract_service.delete(data_set_id)
+        return {"message": "已关闭数据集抽取模式"}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # 数据模型相关接口
 @router.post("/data-models", response_model=DataModelResponse)
 async def create_data_model(data_model: DataModelCreate):
@@ -77,3 +109,55 @@ async def delete_data_model(data_model_id: int):
         return {"message": "数据模型删除成功"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+
+
+# 汇总表相关接口
+@router.post("/data-models/{data_model_id}/rollups", response_model=RollupResponse)
+async def create_rollup(data_model_id: int, rollup: RollupCreate):
+    try:
+        return await rollup_service.create(data_model_id, rollup)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/data-models/{data_model_id}/rollups", response_model=list[RollupResponse])
+async def get_rollups(data_model_id: int):
+    try:
+        return await rollup_service.get_by_model(data_model_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/data-models/{data_model_id}/rollups/advice", response_model=list[RollupAdvice])
+async def get_rollup_advice(data_model_id: int):
+    try:
+        return await rollup_service.advise(data_model_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/data-models/{data_model_id}/rollups/advice/apply", response_model=list[RollupResponse])
+async def apply_rollup_advice(data_model_id: int, limit: int = 1):
+    try:
+        return await rollup_service.apply_advice(data_model_id, limit)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.put("/rollups/{rollup_id}", response_model=RollupResponse)
+async def update_rollup(rollup_id: int, rollup: RollupUpdate):
+    try:
+        return await rollup_service.update(rollup_id, rollup)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/rollups/{rollup_id}/build", response_model=RollupResponse)
+async def build_rollup(rollup_id: int):
+    try:
+        return await rollup_service.build(rollup_id)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.delete("/rollups/{rollup_id}")
+async def delete_rollup(rollup_id: int):
+    try:
+        await rollup_service.delete(rollup_id)
+        return {"message": "汇总表删除成功"}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,5 @@
+from fastapi import APIRouter
+from app.api.v1.scheduler import endpoints
+
+router = APIRouter()
+router.include_router(endpoints.router)
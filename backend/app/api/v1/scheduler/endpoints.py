@@ -0,0 +1,22 @@
+from fastapi import APIRouter, HTTPException
+from app.schemas.scheduler import RefreshScheduleResponse
+from app.services.scheduler import refresh_scheduler
+
+router = APIRouter()
+
+# 后台刷新调度状态：各任务的下次执行时间、上次耗时和结果
+@router.get("/status", response_model=RefreshScheduleResponse)
+async def get_scheduler_status():
+    try:
+        return refresh_scheduler.get_status()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# 立即检查并启动到期的任务
+@router.post("/run", response_model=RefreshScheduleResponse)
+async def run_scheduler():
+    try:
+        await refresh_scheduler.run_due()
+        return refresh_scheduler.get_status()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
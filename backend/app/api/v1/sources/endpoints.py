@@ -1,6 +1,9 @@
 from fastapi import APIRouter, HTTPException
-from app.schemas.sources import DataSourceCreate, DataSourceUpdate, DataSourceResponse, TestConnectionRequest, TestConnectionResponse
-from app.services.sources import data_source_service
+from app.schemas.sources import (
+    DataSourceCreate, DataSourceUpdate, DataSourceResponse, TestConnectionRequest, TestConnectionResponse,
+    TableMetadataResponse, RefreshSchemaResponse
+)
+from app.services.sources import data_source_service, engine_registry, query_executor, metadata_catalog
 
 router = APIRouter()
 
@@ -18,6 +21,18 @@ async def get_data_sources():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/pool-stats")
+async def get_pool_stats():
+    return engine_registry.get_pool_stats()
+
+@router.get("/executor-stats")
+async def get_executor_stats():
+    return query_executor.get_stats()
+
+@router.get("/metadata-stats")
+async def get_metadata_stats():
+    return metadata_catalog.get_stats()
+
 @router.get("/{source_id}", response_model=DataSourceResponse)
 async def get_data_source(source_id: int):
     try:
@@ -63,3 +78,25 @@ async def get_fields(source_id: int, table_name: str):
         return fields
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/{source_id}/tables/{table_name}/metadata", response_model=TableMetadataResponse)
+async def get_table_metadata(source_id: int, table_name: str):
+    try:
+        return await data_source_service.get_table_metadata(source_id, table_name)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/{source_id}/refresh-schema", response_model=RefreshSchemaResponse)
+async def refresh_schema(source_id: int):
+    try:
+        table_count = await data_source_service.refresh_schema(source_id)
+        return RefreshSchemaResponse(message="元数据刷新成功", table_count=table_count)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/{source_id}/probe")
+async def probe_data_source(source_id: int):
+    try:
+        return await data_source_service.probe(source_id)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -1,26 +1,108 @@
-from fastapi import APIRouter, HTTPException
-from app.schemas.visualization import PivotAnalysisRequest, PivotAnalysisResponse, AdhocQueryRequest, AdhocQueryResponse, SpreadsheetRequest, SpreadsheetResponse
+from typing import Optional
+from urllib.parse import quote
+from fastapi import APIRouter, HTTPException, Header, Response
+from fastapi.responses import StreamingResponse
+from app.schemas.visualization import PivotAnalysisRequest, PivotAnalysisResponse, PivotBatchRequest, PivotBatchResponse, DrillDownRequest, DrillDownResponse, AdhocQueryRequest, AdhocQueryResponse, AdhocStreamRequest, SpreadsheetRequest, SpreadsheetResponse
 from app.services.visualization import visualization_service
+from app.services.cache import result_cache
+from app.services.query import model_plan_cache, drill_cache
+from app.services.analytics import extract_service, rollup_service, excel_cache, api_connector
+from app.services.result_format import (
+    negotiate_format, encode_result_body, encode_ndjson_rows, encode_columnar_batch,
+    NDJSON_MEDIA_TYPE, COLUMNAR_JSON_MEDIA_TYPE
+)
 
 router = APIRouter()
 
+# 通过Accept请求头协商响应格式：默认行格式JSON，可选列式JSON、压缩列式二进制或Arrow IPC
 @router.post("/pivot-analysis", response_model=PivotAnalysisResponse)
-async def pivot_analysis(request: PivotAnalysisRequest):
+async def pivot_analysis(request: PivotAnalysisRequest, accept: Optional[str] = Header(None)):
     try:
-        return await visualization_service.pivot_analysis(request)
+        result_format = negotiate_format(accept)
+        if result_format == "rows":
+            return await visualization_service.pivot_analysis(request)
+        result = await visualization_service.pivot_query(request)
+        body, media_type = encode_result_body(result, result_format)
+        return Response(content=body, media_type=media_type)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# 批量透视分析：同一模型上筛选条件相同的查询合并为一次扫描
+@router.post("/pivot-analysis/batch", response_model=PivotBatchResponse)
+async def pivot_analysis_batch(request: PivotBatchRequest):
+    try:
+        return PivotBatchResponse(results=await visualization_service.pivot_batch(request.queries))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# 层次下钻：返回点击成员的下一层，兄弟成员和上层由已取回的结果直接回答
+@router.post("/drill-down", response_model=DrillDownResponse)
+async def drill_down(request: DrillDownRequest):
+    try:
+        return await visualization_service.drill_down(request)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/adhoc-query", response_model=AdhocQueryResponse)
-async def adhoc_query(request: AdhocQueryRequest):
+async def adhoc_query(request: AdhocQueryRequest, accept: Optional[str] = Header(None)):
     try:
-        return await visualization_service.adhoc_query(request)
+        result_format = negotiate_format(accept)
+        if result_format == "rows":
+            return await visualization_service.adhoc_query(request)
+        result = await visualization_service.adhoc_result(request)
+        body, media_type = encode_result_body(result, result_format)
+        return Response(content=body, media_type=media_type)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+# 流式即席查询：默认输出NDJSON（每行一个对象），Accept为列式JSON时按批次输出列式数据
+@router.post("/adhoc-query/stream")
+async def adhoc_query_stream(request: AdhocStreamRequest, accept: Optional[str] = Header(None)):
+    try:
+        columns, batches = await visualization_service.adhoc_stream(request)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"即席查询失败: {str(e)}")
+
+    columnar = negotiate_format(accept) == "columnar"
+    encode = encode_columnar_batch if columnar else encode_ndjson_rows
+
+    async def body():
+        try:
+            async for rows in batches:
+                yield encode(columns, rows)
+        except Exception as e:
+            # 响应已开始输出，只能在流末尾追加错误信息
+            yield encode_ndjson_rows(["error"], [(f"即席查询失败: {str(e)}",)])
+
+    return StreamingResponse(body(), media_type=COLUMNAR_JSON_MEDIA_TYPE if columnar else NDJSON_MEDIA_TYPE)
+
 @router.post("/spreadsheet", response_model=SpreadsheetResponse)
 async def spreadsheet(request: SpreadsheetRequest):
     try:
         return await visualization_service.spreadsheet(request)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+
+# 导出电子表格：以只写模式生成xlsx文件，直接返回二进制文件流
+@router.post("/spreadsheet/export")
+async def export_spreadsheet(request: SpreadsheetRequest):
+    try:
+        file_name, chunks = await visualization_service.export_spreadsheet(request)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"电子表格导出失败: {str(e)}")
+    return StreamingResponse(
+        chunks,
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(file_name)}"}
+    )
+
+@router.get("/cache-stats")
+async def cache_stats():
+    stats = result_cache.get_stats()
+    stats["model_plans"] = model_plan_cache.get_stats()
+    stats["extracts"] = extract_service.get_stats()
+    stats["rollups"] = rollup_service.get_stats()
+    stats["drill"] = drill_cache.get_stats()
+    stats["excel"] = excel_cache.get_stats()
+    stats["api"] = api_connector.get_stats()
+    return stats
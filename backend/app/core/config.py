@@ -12,6 +12,18 @@ class Settings(BaseSettings):
     
     # Redis配置
     REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_SOCKET_TIMEOUT: float = 1.0  # seconds
+
+    # 查询结果缓存配置
+    RESULT_CACHE_ENABLED: bool = True
+    RESULT_CACHE_PREFIX: str = "bi:cache"
+    RESULT_CACHE_LOCK_TIMEOUT: int = 30  # 单飞加载锁超时时间(秒)
+    RESULT_CACHE_RETRY_INTERVAL: int = 30  # Redis不可用后重试间隔(秒)
+    RESULT_CACHE_MAX_ENTRY_BYTES: int = 16 * 1024 * 1024  # 单条缓存最大字节数
+    RESULT_CACHE_L1_MAX_BYTES: int = 64 * 1024 * 1024  # 进程内缓存容量(字节)
+    RESULT_CACHE_L1_MAX_ENTRY_BYTES: int = 8 * 1024 * 1024  # 进程内缓存单条最大字节数
+    RESULT_CACHE_STALE_TTL: int = 3600  # 共享缓存过期后继续保留的时间(秒)，数据源查询失败时返回过期结果
+    CACHE_INVALIDATION_CHANNEL: str = "bi:cache:invalidate"
     
     # JWT配置
     SECRET_KEY: str = "your-secret-key"
@@ -20,7 +32,59 @@ class Settings(BaseSettings):
     
     # 数据源配置
     MAX_CONNECTION_POOL: int = 50
+    CONNECTION_POOL_TIMEOUT: int = 30  # seconds
+    CONNECTION_POOL_RECYCLE: int = 1800  # seconds
+    METADATA_CACHE_TTL: int = 3600  # 数据源元数据目录（表、字段、索引）的缓存时间(秒)
+    HEALTH_PROBE_ENABLED: bool = True  # 后台定期检查数据源的可用性
+    HEALTH_PROBE_INTERVAL: int = 30  # 数据源健康检查间隔(秒)
+    HEALTH_PROBE_TIMEOUT: int = 5  # 单次健康检查的超时时间(秒)
+    HEALTH_PROBE_CONCURRENCY: int = 4  # 同时执行的健康检查数
+    HEALTH_SLOW_THRESHOLD: float = 2.0  # 健康检查耗时超过该值(秒)时标记为降级
+    HEALTH_FAILURE_THRESHOLD: int = 2  # 连续失败该次数后标记为不可用，查询直接失败或返回过期缓存
+    QUERY_EXECUTOR_DEFAULT_WORKERS: int = 4  # 未绑定数据源的任务并发数
+    QUERY_EXECUTOR_MAX_QUEUE: int = 200  # 单个数据源允许排队的最大任务数
+    QUERY_STREAM_BUFFER: int = 4  # 流式查询缓冲的最大批次数
+    SPREADSHEET_EXPORT_BATCH_SIZE: int = 5000  # 电子表格导出每批读取的行数
+    DASHBOARD_RENDER_SOURCE_CONCURRENCY: int = 4  # 渲染仪表盘（批量透视）时单个数据源的最大并发查询数
+    QUERY_FUSION_ENABLED: bool = True  # 合并同一模型上筛选条件相同的透视查询
+    QUERY_FUSION_MAX_ROWS: int = 100000  # 融合查询在进程内再次聚合时允许的最大行数
+    PIVOT_TOP_N_MAX: int = 1000  # 透视查询前N组允许的最大N
+    PIVOT_OTHERS_LABEL: str = "其他"  # 透视查询前N组之外合并的分组名称
+    PIVOT_SAMPLE_SEED: int = 42  # 抽样透视查询的随机种子（PostgreSQL、DuckDB、MySQL可重复抽样）
+    PIVOT_SAMPLE_Z: float = 1.96  # 抽样估算误差（置信区间半宽）的置信系数，1.96对应95%
+    DRILL_CACHE_MAX_ROWS: int = 500000  # 层次下钻缓存在进程内保存的最大总行数
+    DRILL_CACHE_MAX_ENTRY_ROWS: int = 50000  # 单次下钻结果超过该行数时不保存到下钻缓存（仍使用结果缓存）
+    DRILL_PREFETCH_ENABLED: bool = True  # 下钻后在后台预取当前层级各成员的下一层
     DEFAULT_REFRESH_INTERVAL: int = 300  # seconds
+
+    # 本地分析存储配置（需要安装duckdb）
+    ANALYTICS_STORE_DIR: str = "data/analytics"  # Parquet文件存放目录
+    EXTRACT_BATCH_SIZE: int = 50000  # 抽取数据集时每批读取的行数
+    EXTRACT_QUERY_CONCURRENCY: int = 4  # 本地快照上的最大并发查询数
+    EXTRACT_REFRESH_LOCK_TIMEOUT: int = 3600  # 刷新数据集快照的跨进程锁超时时间(秒)
+    EXTRACT_MAX_PARTS: int = 32  # 增量快照的分片文件超过该数量时合并为一个文件
+    EXCEL_BATCH_SIZE: int = 10000  # 解析Excel文件时每批写入的行数
+    API_PAGE_SIZE: int = 100  # API数据源未配置 page_size 时的每页记录数
+    API_PAGE_CONCURRENCY: int = 4  # 单个API数据源并发拉取的页数，也是其HTTP连接池大小
+    API_MAX_PAGES: int = 1000  # 单个API数据源最多拉取的页数
+    API_REQUEST_TIMEOUT: int = 30  # API请求超时时间(秒)
+    API_SCHEMA_SAMPLE_ROWS: int = 100  # 推断API字段时抽样的记录数
+    JOIN_PLANNER_ENABLED: bool = True  # 透视查询只连接用到的数据集并按估计行数排序连接（假设关系满足参照完整性）
+    ROLLUP_ENABLED: bool = True  # 透视查询自动改写到覆盖它的汇总表
+    ROLLUP_BUILD_BATCH_SIZE: int = 10000  # 构建汇总表时每批读取的行数
+    ROLLUP_BUILD_LOCK_TIMEOUT: int = 3600  # 构建汇总表的跨进程锁超时时间(秒)
+    ROLLUP_MAX_STALENESS_FACTOR: float = 2.0  # 汇总表超过刷新间隔的倍数后不再使用
+    ROLLUP_ADVISOR_MIN_HITS: int = 3  # 相同粒度的透视查询出现次数达到该值时建议创建汇总表
+    SKETCH_HLL_PRECISION: int = 12  # 汇总表中近似去重计数草图（HyperLogLog）的精度，寄存器数为2的该次方，标准误差约1.6%
+    SKETCH_TDIGEST_COMPRESSION: int = 100  # 汇总表中近似分位数草图（t-digest）的压缩参数，越大越准确、草图越大
+
+    # 后台刷新调度配置（数据集快照、汇总表、仪表盘预热）
+    REFRESH_SCHEDULER_ENABLED: bool = True  # 在应用进程内运行刷新调度器
+    REFRESH_SCHEDULER_INTERVAL: int = 15  # 调度检查间隔(秒)
+    REFRESH_SCHEDULER_MAX_CONCURRENCY: int = 4  # 同时执行的刷新任务数上限
+    REFRESH_SCHEDULER_JITTER: float = 0.1  # 到期时间的随机抖动（占刷新间隔的比例）
+    REFRESH_SOURCE_RATE_LIMIT: int = 6  # 单个数据源每分钟最多启动的刷新任务数
+    DASHBOARD_WARM_WINDOW: int = 3600  # 最近该时间内访问过的仪表盘才会预热(秒)
     
     class Config:
         env_file = ".env"
@@ -1,11 +1,14 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.v1 import sources, data_models, visualization, dashboards
+from app.api.v1 import sources, data_models, visualization, dashboards, scheduler
 from app.api.v1.permissions import router as permissions_router
 from app.api.v1.advanced import router as advanced_router
 from app.core.database import engine, Base
 from app.models import permissions, advanced
 from app.services.permissions import create_default_admin
+from app.services.cache import invalidation_bus
+from app.services.scheduler import refresh_scheduler
+from app.services.sources import health_prober
 import asyncio
 
 # 创建数据库表
@@ -36,6 +39,22 @@ app.include_router(visualization.router, prefix="/api/v1/visualization", tags=["
 app.include_router(dashboards.router, prefix="/api/v1", tags=["仪表盘管理"])
 app.include_router(permissions_router, prefix="/api/v1", tags=["权限管理"])
 app.include_router(advanced_router, prefix="/api/v1", tags=["高级分析"])
+app.include_router(scheduler.router, prefix="/api/v1/scheduler", tags=["刷新调度"])
+
+@app.on_event("startup")
+async def startup():
+    # 订阅其他worker发布的缓存失效消息
+    invalidation_bus.start()
+    # 按刷新间隔刷新数据集快照、构建汇总表、预热仪表盘
+    refresh_scheduler.start()
+    # 定期检查数据源的可用性
+    health_prober.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await refresh_scheduler.stop()
+    await health_prober.stop()
+    await invalidation_bus.stop()
 
 @app.get("/")
 async def root():
@@ -43,4 +62,7 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    # 任一数据源降级或不可用时整体状态为降级，服务本身仍可用
+    sources = health_prober.get_status()
+    degraded = any(source["status"] in ("degraded", "unavailable") for source in sources)
+    return {"status": "degraded" if degraded else "healthy", "sources": sources}
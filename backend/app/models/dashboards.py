@@ -28,6 +28,7 @@ class Chart(Base):
     measures = Column(JSON, nullable=False)  # 度量配置
     filters = Column(JSON, nullable=True)  # 筛选条件
     style = Column(JSON, nullable=True)  # 样式配置
+    query_options = Column(JSON, nullable=True)  # 查询选项: top_n, top_n_by, sample_rate
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Boolean, JSON, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, Boolean, JSON, DateTime, ForeignKey, Float
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.core.database import Base
@@ -23,6 +23,32 @@ class DataSet(Base):
     # Relationships
     data_source = relationship("DataSource", backref="data_sets")
 
+class DataSetExtract(Base):
+    __tablename__ = "data_set_extracts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    data_set_id = Column(Integer, ForeignKey("data_sets.id"), nullable=False, unique=True)
+    refresh_interval = Column(Integer, nullable=True)  # seconds, defaults to the data set's refresh interval
+    incremental_key = Column(String(255), nullable=True)  # watermark column: updated_at timestamp or increasing id
+    unique_key = Column(String(255), nullable=True)  # rows fetched again with the same key replace the old ones
+    full_refresh_interval = Column(Integer, nullable=True)  # seconds between full re-pulls of an incremental extract
+    status = Column(String(50), default="pending")  # pending, refreshing, ready, failed
+    storage_path = Column(String(500), nullable=True)  # directory of the snapshot part files
+    parts = Column(JSON, nullable=True)  # part files of the current snapshot
+    watermark = Column(JSON, nullable=True)  # largest incremental_key value in the snapshot
+    definition_version = Column(String(64), nullable=True)  # data set/source definition the snapshot was taken from
+    column_types = Column(JSON, nullable=True)
+    row_count = Column(Integer, nullable=True)
+    rows_fetched = Column(Integer, nullable=True)  # rows pulled from the source by the last refresh
+    last_refresh_mode = Column(String(50), nullable=True)  # full, incremental
+    refresh_seconds = Column(Float, nullable=True)
+    refreshed_at = Column(DateTime(timezone=True), nullable=True)
+    full_refreshed_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(Text, nullable=True)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
 class DataModel(Base):
     __tablename__ = "data_models"
 
@@ -43,3 +69,25 @@ class DataModel(Base):
     # Relationships
     # 由于一个数据模型关联多个数据集，不再使用外键关系
     # 而是在 data_sets 字段中存储数据集ID和角色
+
+class Rollup(Base):
+    __tablename__ = "rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    data_model_id = Column(Integer, ForeignKey("data_models.id"), nullable=False, index=True)
+    name = Column(String(255), nullable=False)
+    dimensions = Column(JSON, nullable=False)  # list of dimension names
+    measures = Column(JSON, nullable=False)  # list of measure names
+    refresh_interval = Column(Integer, nullable=True)  # seconds, defaults to the model's refresh interval
+    origin = Column(String(50), default="manual")  # manual, advisor
+    status = Column(String(50), default="pending")  # pending, building, ready, failed
+    storage_path = Column(String(500), nullable=True)
+    plan_signature = Column(String(64), nullable=True)  # model definition the rollup was built from
+    column_types = Column(JSON, nullable=True)
+    row_count = Column(Integer, nullable=True)
+    build_seconds = Column(Float, nullable=True)
+    built_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(Text, nullable=True)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -19,6 +19,7 @@ class DataSource(Base):
     api_method = Column(String(10), nullable=True)  # get, post
     api_headers = Column(JSON, nullable=True)  # for api
     api_body = Column(JSON, nullable=True)  # for api
+    api_options = Column(JSON, nullable=True)  # records path and pagination for api
     connection_pool = Column(Integer, default=10)
     refresh_interval = Column(Integer, default=300)  # seconds
     is_active = Column(Boolean, default=True)
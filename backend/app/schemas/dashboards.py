@@ -11,6 +11,7 @@ class ChartBase(BaseModel):
     measures: List[Dict[str, Any]] = Field(..., description="度量配置")
     filters: Optional[List[Dict[str, Any]]] = Field(None, description="筛选条件")
     style: Optional[Dict[str, Any]] = Field(None, description="样式配置")
+    query_options: Optional[Dict[str, Any]] = Field(None, description="查询选项: top_n（前N组）, top_n_by（排名度量）, sample_rate（抽样比例），与透视分析请求的同名参数一致")
 
 class ChartCreate(ChartBase):
     pass
@@ -24,6 +25,7 @@ class ChartUpdate(BaseModel):
     measures: Optional[List[Dict[str, Any]]] = Field(None, description="度量配置")
     filters: Optional[List[Dict[str, Any]]] = Field(None, description="筛选条件")
     style: Optional[Dict[str, Any]] = Field(None, description="样式配置")
+    query_options: Optional[Dict[str, Any]] = Field(None, description="查询选项: top_n（前N组）, top_n_by（排名度量）, sample_rate（抽样比例），与透视分析请求的同名参数一致")
     is_active: Optional[bool] = Field(None, description="是否启用")
 
 class ChartResponse(ChartBase):
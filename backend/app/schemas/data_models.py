@@ -49,6 +49,37 @@ class DataSetResponse(DataSetBase):
     class Config:
         from_attributes = True
 
+class DataSetExtractConfig(BaseModel):
+    is_active: bool = Field(True, description="是否启用抽取模式，启用后查询在本地快照上执行")
+    refresh_interval: Optional[int] = Field(None, description="快照刷新间隔(秒)，为空时使用数据集的刷新间隔")
+    incremental_key: Optional[str] = Field(None, description="增量字段（更新时间或递增ID），设置后每次只拉取水位之后的数据")
+    unique_key: Optional[str] = Field(None, description="唯一键，设置后重新拉取的行替换快照中的旧行；按更新时间增量时建议设置")
+    full_refresh_interval: Optional[int] = Field(None, description="增量快照的全量刷新间隔(秒)，用于同步数据源中删除的行，为空时只在数据集定义变化时全量刷新")
+
+class DataSetExtractResponse(BaseModel):
+    data_set_id: int
+    is_active: bool
+    refresh_interval: Optional[int] = None
+    incremental_key: Optional[str] = None
+    unique_key: Optional[str] = None
+    full_refresh_interval: Optional[int] = None
+    status: str
+    row_count: Optional[int] = None
+    rows_fetched: Optional[int] = Field(None, description="上次刷新从数据源拉取的行数")
+    last_refresh_mode: Optional[str] = Field(None, description="上次刷新方式: full, incremental")
+    watermark: Optional[Any] = Field(None, description="快照中增量字段的最大值")
+    watermark_lag_seconds: Optional[float] = Field(None, description="增量字段为时间时，水位距今的秒数")
+    column_types: Optional[Dict[str, str]] = None
+    refresh_seconds: Optional[float] = None
+    refreshed_at: Optional[datetime] = None
+    full_refreshed_at: Optional[datetime] = None
+    age_seconds: Optional[float] = Field(None, description="快照距今的秒数")
+    is_fresh: bool = Field(False, description="快照是否在刷新间隔内")
+    last_error: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
 class DimensionConfig(BaseModel):
     name: str
     field: str
@@ -58,8 +89,9 @@ class DimensionConfig(BaseModel):
 class MeasureConfig(BaseModel):
     name: str
     field: str
-    aggregation: str
+    aggregation: str  # SUM、COUNT、AVG、MIN、MAX，或近似聚合 APPROX_COUNT_DISTINCT、APPROX_QUANTILE
     format: Optional[str] = None
+    quantile: Optional[float] = None  # APPROX_QUANTILE 的分位点(0-1)，默认0.5
 
 class HierarchyConfig(BaseModel):
     name: str
@@ -77,6 +109,7 @@ class RelationshipConfig(BaseModel):
     target_data_set: int
     target_field: str
     join_type: str = "inner"  # inner, left, right
+    referential_integrity: bool = False  # 声明连接键唯一且都能匹配后，未用到目标数据集的查询省略该连接
 
 class DataModelBase(BaseModel):
     name: str = Field(..., description="数据模型名称")
@@ -112,3 +145,41 @@ class DataModelResponse(DataModelBase):
     
     class Config:
         from_attributes = True
+
+class RollupBase(BaseModel):
+    name: str = Field(..., description="汇总表名称")
+    dimensions: List[str] = Field(..., description="汇总维度列表")
+    measures: List[str] = Field(..., description="汇总度量列表")
+    refresh_interval: Optional[int] = Field(None, description="刷新间隔(秒)，为空时使用模型数据的刷新间隔")
+
+class RollupCreate(RollupBase):
+    pass
+
+class RollupUpdate(BaseModel):
+    name: Optional[str] = Field(None, description="汇总表名称")
+    dimensions: Optional[List[str]] = Field(None, description="汇总维度列表")
+    measures: Optional[List[str]] = Field(None, description="汇总度量列表")
+    refresh_interval: Optional[int] = Field(None, description="刷新间隔(秒)")
+    is_active: Optional[bool] = Field(None, description="是否启用")
+
+class RollupResponse(RollupBase):
+    id: int
+    data_model_id: int
+    origin: str
+    status: str
+    row_count: Optional[int] = None
+    build_seconds: Optional[float] = None
+    built_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+    is_active: bool
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class RollupAdvice(BaseModel):
+    dimensions: List[str] = Field(..., description="建议的汇总维度")
+    measures: List[str] = Field(..., description="建议的汇总度量")
+    hits: int = Field(..., description="可由该汇总表回答的透视查询次数")
+    total_seconds: float = Field(..., description="这些查询在数据源上的累计耗时(秒)")
@@ -0,0 +1,24 @@
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List
+from datetime import datetime
+
+class RefreshJobResponse(BaseModel):
+    kind: str = Field(..., description="任务类型: extract(数据集快照), rollup(汇总表), dashboard(仪表盘预热)")
+    id: int = Field(..., description="数据集、汇总表或仪表盘ID")
+    name: Optional[str] = None
+    source_ids: List[Any] = Field([], description="任务访问的数据源ID，extract表示本地快照")
+    interval: Optional[int] = Field(None, description="刷新间隔(秒)")
+    last_run: Optional[datetime] = Field(None, description="上次完成时间(UTC)")
+    next_run: Optional[datetime] = Field(None, description="下次执行时间(UTC)")
+    last_duration: Optional[float] = Field(None, description="上次执行耗时(秒)")
+    last_status: Optional[str] = Field(None, description="上次执行结果: succeeded, skipped, failed")
+    last_error: Optional[str] = None
+    runs: int = 0
+    failures: int = 0
+    last_viewed: Optional[datetime] = Field(None, description="仪表盘最后访问时间(UTC)")
+    running: bool = False
+
+class RefreshScheduleResponse(BaseModel):
+    enabled: bool = Field(..., description="调度器是否在当前进程中运行")
+    stats: Dict[str, int]
+    jobs: List[RefreshJobResponse]
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 
 class DataSourceBase(BaseModel):
@@ -16,6 +16,7 @@ class DataSourceBase(BaseModel):
     api_method: Optional[str] = Field(None, description="API请求方法: get, post")
     api_headers: Optional[Dict[str, Any]] = Field(None, description="API请求头")
     api_body: Optional[Dict[str, Any]] = Field(None, description="API请求体")
+    api_options: Optional[Dict[str, Any]] = Field(None, description="API数据路径与分页配置: records_path, pagination(none, offset, page, cursor), page_size 等")
     connection_pool: Optional[int] = Field(10, description="连接池大小")
     refresh_interval: Optional[int] = Field(300, description="数据刷新间隔(秒)")
 
@@ -36,6 +37,7 @@ class DataSourceUpdate(BaseModel):
     api_method: Optional[str] = Field(None, description="API请求方法: get, post")
     api_headers: Optional[Dict[str, Any]] = Field(None, description="API请求头")
     api_body: Optional[Dict[str, Any]] = Field(None, description="API请求体")
+    api_options: Optional[Dict[str, Any]] = Field(None, description="API数据路径与分页配置: records_path, pagination(none, offset, page, cursor), page_size 等")
     connection_pool: Optional[int] = Field(None, description="连接池大小")
     refresh_interval: Optional[int] = Field(None, description="数据刷新间隔(秒)")
     is_active: Optional[bool] = Field(None, description="是否启用")
@@ -62,7 +64,28 @@ class TestConnectionRequest(BaseModel):
     api_method: Optional[str] = Field(None, description="API请求方法: get, post")
     api_headers: Optional[Dict[str, Any]] = Field(None, description="API请求头")
     api_body: Optional[Dict[str, Any]] = Field(None, description="API请求体")
+    api_options: Optional[Dict[str, Any]] = Field(None, description="API数据路径与分页配置: records_path, pagination(none, offset, page, cursor), page_size 等")
 
 class TestConnectionResponse(BaseModel):
     success: bool
     message: str
+
+class ColumnMetadata(BaseModel):
+    name: str = Field(..., description="字段名")
+    type: Optional[str] = Field(None, description="字段类型")
+    nullable: bool = Field(True, description="是否可为空")
+
+class IndexMetadata(BaseModel):
+    name: str = Field(..., description="索引名")
+    columns: List[str] = Field(..., description="索引字段")
+    unique: bool = Field(False, description="是否唯一索引")
+
+class TableMetadataResponse(BaseModel):
+    name: str = Field(..., description="表名")
+    row_estimate: Optional[int] = Field(None, description="行数估计")
+    columns: List[ColumnMetadata] = Field(..., description="字段")
+    indexes: List[IndexMetadata] = Field(default_factory=list, description="索引")
+
+class RefreshSchemaResponse(BaseModel):
+    message: str
+    table_count: int
@@ -8,15 +8,40 @@ class PivotAnalysisRequest(BaseModel):
     filters: Optional[List[Dict[str, Any]]] = Field(None, description="筛选条件列表")
     sort_by: Optional[str] = Field(None, description="排序字段")
     sort_order: Optional[str] = Field("asc", description="排序顺序: asc, desc")
+    top_n: Optional[int] = Field(None, description="前N组：最后一个维度在其余维度的每组中只保留排名度量最大的N个值，其余合并为“其他”")
+    top_n_by: Optional[str] = Field(None, description="前N组的排名度量，默认为第一个度量")
+    sample_rate: Optional[float] = Field(None, description="抽样比例(0, 1]：按比例抽样主数据集返回近似结果，每个度量增加 pivot_<度量>_error 误差列（95%置信区间半宽）")
 
 class PivotAnalysisResponse(BaseModel):
     success: bool
     data: List[Dict[str, Any]]
     columns: List[str]
     sql: Optional[str] = Field(None, description="生成的SQL查询语句")
-    model_sql: Optional[str] = Field(None, description="通过模型解析的SQL查询语句")
+    model_sql: Optional[str] = Field(None, description="通过模型解析的三层嵌套SQL查询语句，用于调试，实际执行的是等价的单层SQL")
     message: Optional[str] = None
 
+class DrillDownRequest(BaseModel):
+    data_model_id: int = Field(..., description="数据模型ID")
+    hierarchy: str = Field(..., description="层次结构名称")
+    path: List[Any] = Field([], description="点击的成员路径，依次为各层级的值；为空时返回第一层")
+    measures: List[str] = Field(..., description="度量字段列表")
+    filters: Optional[List[Dict[str, Any]]] = Field(None, description="筛选条件列表")
+    sort_by: Optional[str] = Field(None, description="排序字段，默认按当前层级排序")
+    sort_order: Optional[str] = Field("asc", description="排序顺序: asc, desc")
+    refresh: bool = Field(False, description="跳过下钻缓存和结果缓存重新查询")
+
+class DrillDownResponse(PivotAnalysisResponse):
+    level: str = Field(..., description="返回的层级（维度名称）")
+    depth: int = Field(..., description="返回的层级序号，从1开始")
+    has_next: bool = Field(..., description="是否还可以继续下钻")
+    cached: bool = Field(False, description="是否由已取回的结果在进程内计算，未访问数据源")
+
+class PivotBatchRequest(BaseModel):
+    queries: List[PivotAnalysisRequest] = Field(..., description="透视分析请求列表")
+
+class PivotBatchResponse(BaseModel):
+    results: List[PivotAnalysisResponse] = Field(..., description="透视分析结果列表，顺序与请求一致")
+
 class AdhocQueryRequest(BaseModel):
     data_set_id: int = Field(..., description="数据集ID")
     fields: List[str] = Field(..., description="查询字段列表")
@@ -25,11 +50,19 @@ class AdhocQueryRequest(BaseModel):
     sort_order: Optional[str] = Field("asc", description="排序顺序: asc, desc")
     limit: Optional[int] = Field(1000, description="返回数据行数限制")
     offset: Optional[int] = Field(0, description="分页偏移量")
+    pagination: Optional[str] = Field("offset", description="分页方式: offset(偏移量分页), keyset(键集分页)")
+    cursor: Optional[str] = Field(None, description="键集分页游标，取上一页响应中的next_cursor，为空时返回第一页")
+    key_field: Optional[str] = Field(None, description="键集分页的唯一键字段（键集分页时必填），与排序字段一起确定翻页位置")
+
+class AdhocStreamRequest(AdhocQueryRequest):
+    limit: Optional[int] = Field(None, description="返回数据行数限制，为空时返回全部数据")
+    batch_size: int = Field(1000, description="每批返回的行数")
 
 class AdhocQueryResponse(BaseModel):
     success: bool
     data: List[Dict[str, Any]]
     total: int
+    next_cursor: Optional[str] = Field(None, description="下一页游标（键集分页），为空时表示已到最后一页")
     message: Optional[str] = None
 
 class SpreadsheetRequest(BaseModel):
@@ -0,0 +1,19 @@
+from app.services.analytics.store import AnalyticsStore, LocalSource, analytics_store
+from app.services.analytics.excel import ExcelCache, ExcelSource, excel_cache
+from app.services.analytics.api import API_TABLE, ApiConnector, ApiSource, api_connector
+from app.services.analytics.extracts import ExtractSource, ExtractService, extract_service
+from app.services.analytics.rollups import RollupService, rollup_service
+from app.services.cache import invalidation_bus
+
+# 数据集或快照变化时重新加载快照信息
+invalidation_bus.subscribe(extract_service.invalidate)
+# 汇总表或模型变化时重新加载已构建的汇总表
+invalidation_bus.subscribe(rollup_service.invalidate)
+
+__all__ = [
+    "AnalyticsStore", "LocalSource", "analytics_store",
+    "ExcelCache", "ExcelSource", "excel_cache",
+    "API_TABLE", "ApiConnector", "ApiSource", "api_connector",
+    "ExtractSource", "ExtractService", "extract_service",
+    "RollupService", "rollup_service"
+]
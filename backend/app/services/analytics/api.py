@@ -0,0 +1,412 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from app.core.config import settings
+from app.services.analytics.store import LocalSource, analytics_store
+
+# API数据源的数据在本地分析存储中的表名，SQL模式的数据集使用该表名查询
+API_TABLE = "api_data"
+
+_PAGINATION_MODES = ("none", "offset", "page", "cursor")
+
+
+def api_config(source) -> Dict[str, Any]:
+    """数据源（或连接测试请求）中与API请求相关的配置"""
+    return {
+        "url": source.api_url,
+        "method": (source.api_method or "get").lower(),
+        "headers": source.api_headers or {},
+        "body": source.api_body or {},
+        "options": getattr(source, "api_options", None) or {}
+    }
+
+
+def _get_path(data: Any, path: Optional[str]) -> Any:
+    """按点分隔的路径取值，如 data.items"""
+    for key in (path.split(".") if path else []):
+        if isinstance(data, dict):
+            data = data.get(key)
+        elif isinstance(data, list) and key.isdigit() and int(key) < len(data):
+            data = data[int(key)]
+        else:
+            return None
+    return data
+
+
+def _records(body: Any, records_path: Optional[str]) -> List[Dict[str, Any]]:
+    """从响应中取出记录列表；未配置路径时使用响应本身或其中第一个对象列表"""
+    data = _get_path(body, records_path)
+    if data is None:
+        return []
+    if isinstance(data, dict) and not records_path:
+        data = next((value for value in data.values() if isinstance(value, list) and value and isinstance(value[0], dict)), [data])
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list):
+        raise Exception(f"API响应中的记录不是列表: {records_path}")
+    return [record if isinstance(record, dict) else {"value": record} for record in data]
+
+
+def flatten_record(record: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """嵌套对象展开为 父字段_子字段 形式的列，数组序列化为JSON字符串"""
+    flat = {}
+    for key, value in record.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_record(value, f"{name}_"))
+        elif isinstance(value, list):
+            flat[name] = json.dumps(value, ensure_ascii=False)
+        else:
+            flat[name] = value
+    return flat
+
+
+def _flat_names(record: Dict[str, Any], prefix: str = "") -> Iterator[str]:
+    """记录展开后的列名，与 flatten_record 一致但不生成展开后的值"""
+    for key, value in record.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _flat_names(value, f"{name}_")
+        else:
+            yield name
+
+
+def _page_rows(results: List[List[Dict[str, Any]]], columns: List[str]) -> Iterator[List[tuple]]:
+    """逐页展开记录并按列顺序产出，同时只有一页展开后的数据在内存中"""
+    for records in results:
+        yield [tuple(flat.get(name) for name in columns) for flat in map(flatten_record, records)]
+
+
+def _union_columns(records: List[Dict[str, Any]]) -> List[str]:
+    columns = {}
+    for record in records:
+        for name in record:
+            columns.setdefault(name, None)
+    return list(columns)
+
+
+class ApiConnector:
+    """API数据源连接器：每个数据源复用一个保持长连接的HTTP会话，并发拉取分页数据，
+    展开后的JSON记录写入本地分析存储的列式文件并推断列类型。
+    每页响应连同ETag/Last-Modified缓存在磁盘上，再次拉取时发送条件请求，所有页都未变化时直接使用已有的列式文件"""
+
+    def __init__(self):
+        # 配置指纹 -> HTTP会话
+        self._sessions: Dict[str, requests.Session] = {}
+        # 数据源ID -> 配置指纹
+        self._source_fingerprints: Dict[Any, str] = {}
+        # 配置指纹 -> 缓存清单
+        self._manifests: Dict[str, Dict[str, Any]] = {}
+        # 配置指纹 -> 拉取锁，同一配置同时只拉取一次
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "loads": 0, "rebuilds": 0, "requests": 0, "not_modified": 0, "stale": 0, "load_seconds": 0.0}
+
+    @staticmethod
+    def fingerprint(config: Dict[str, Any]) -> str:
+        raw = json.dumps(config, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+    def _session(self, fingerprint: str) -> requests.Session:
+        with self._lock:
+            session = self._sessions.get(fingerprint)
+            if session is None:
+                session = requests.Session()
+                # 连接池大小与分页并发数一致，并发请求复用长连接
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.API_PAGE_CONCURRENCY)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[fingerprint] = session
+            return session
+
+    def dispose(self, source_id: Any) -> None:
+        """数据源配置变化或删除后关闭其HTTP会话，下次查询时重新拉取"""
+        with self._lock:
+            fingerprint = self._source_fingerprints.pop(source_id, None)
+            if fingerprint is None:
+                return
+            session = self._sessions.pop(fingerprint, None)
+            self._manifests.pop(fingerprint, None)
+        if session is not None:
+            session.close()
+
+    def _request(self, session: requests.Session, config: Dict[str, Any], params: Dict[str, Any],
+                 validators: Optional[Dict[str, str]] = None, unconditional: bool = False) -> requests.Response:
+        """发送一次请求；分页参数在GET请求中作为查询参数，其他请求合并到请求体中。
+        unconditional 为True时去掉配置中的条件请求头并要求不使用缓存"""
+        headers = dict(config["headers"])
+        if unconditional:
+            headers = {name: value for name, value in headers.items()
+                       if name.lower() not in ("if-none-match", "if-modified-since")}
+            headers["Cache-Control"] = "no-cache"
+        if validators:
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        payload = {**config["body"], **params}
+        self._stats["requests"] += 1
+        if config["method"] == "get":
+            response = session.get(config["url"], headers=headers, params=payload, timeout=settings.API_REQUEST_TIMEOUT)
+        else:
+            response = session.request(config["method"].upper(), config["url"], headers=headers, json=payload,
+                                       timeout=settings.API_REQUEST_TIMEOUT)
+        if response.status_code != 304:
+            response.raise_for_status()
+        return response
+
+    def _page_params(self, options: Dict[str, Any], index: int) -> Dict[str, Any]:
+        mode = options.get("pagination") or "none"
+        page_size = int(options.get("page_size") or settings.API_PAGE_SIZE)
+        if mode == "offset":
+            return {options.get("page_size_param") or "limit": page_size,
+                    options.get("offset_param") or "offset": index * page_size}
+        if mode == "page":
+            return {options.get("page_size_param") or "limit": page_size,
+                    options.get("page_param") or "page": int(options.get("start_page", 1)) + index}
+        return {}
+
+    def _fetch_page(self, session: requests.Session, config: Dict[str, Any], params: Dict[str, Any],
+                    pages: Dict[str, Any], directory: str) -> Tuple[Any, Dict[str, Any]]:
+        """拉取一页，返回响应内容和页缓存信息；已缓存的页发送条件请求，未变化时读取磁盘上的响应"""
+        key = json.dumps(params, sort_keys=True, default=str)
+        cached = pages.get(key)
+        if cached and not os.path.exists(os.path.join(directory, cached["file"])):
+            cached = None
+        response = self._request(session, config, params, cached)
+        if response.status_code == 304 and cached is None:
+            # 没有可用的页缓存时不能使用304响应，重新发送不带校验头的请求
+            response = self._request(session, config, params, unconditional=True)
+            if response.status_code == 304:
+                raise Exception(f"API返回304但没有缓存的响应: {config['url']}")
+        if response.status_code == 304:
+            self._stats["not_modified"] += 1
+            with open(os.path.join(directory, cached["file"]), encoding="utf-8") as f:
+                return json.load(f), cached
+        body = response.json()
+        content = response.content
+        page = {
+            "file": f"page_{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}.json",
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "digest": hashlib.sha256(content).hexdigest()[:16]
+        }
+        # 没有校验头的响应也缓存，按内容摘要判断是否变化
+        path = os.path.join(directory, page["file"])
+        with open(f"{path}.{os.getpid()}.tmp", "wb") as f:
+            f.write(content)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+        return body, page
+
+    def _fetch_all(self, session: requests.Session, config: Dict[str, Any], pages: Dict[str, Any],
+                   directory: str) -> Tuple[List[List[Dict[str, Any]]], Dict[str, Any]]:
+        """按分页方式拉取全部数据，返回每页的记录和本次的页缓存信息"""
+        options = config["options"]
+        mode = options.get("pagination") or "none"
+        if mode not in _PAGINATION_MODES:
+            raise Exception(f"不支持的分页方式: {mode}")
+        records_path = options.get("records_path")
+        max_pages = int(options.get("max_pages") or settings.API_MAX_PAGES)
+        fetched: Dict[str, Any] = {}
+
+        def fetch(params):
+            body, page = self._fetch_page(session, config, params, pages, directory)
+            fetched[json.dumps(params, sort_keys=True, default=str)] = page
+            return body
+
+        if mode == "none":
+            return [_records(fetch({}), records_path)], fetched
+
+        if mode == "cursor":
+            # 游标分页只能依次拉取
+            results, params, seen = [], {}, set()
+            while len(results) < max_pages:
+                body = fetch(params)
+                results.append(_records(body, records_path))
+                cursor = _get_path(body, options.get("cursor_path") or "next_cursor")
+                if cursor in (None, "") or cursor in seen:
+                    break
+                seen.add(cursor)
+                params = {options.get("cursor_param") or "cursor": cursor}
+            return results, fetched
+
+        page_size = int(options.get("page_size") or settings.API_PAGE_SIZE)
+        first = fetch(self._page_params(options, 0))
+        results = [_records(first, records_path)]
+        total = _get_path(first, options.get("total_path")) if options.get("total_path") else None
+        with ThreadPoolExecutor(max_workers=settings.API_PAGE_CONCURRENCY) as pool:
+            if total is not None:
+                # 已知总数时一次性并发拉取剩余的页
+                count = min(max_pages, -(-int(total) // page_size))
+                results += pool.map(lambda i: _records(fetch(self._page_params(options, i)), records_path), range(1, count))
+                return results, fetched
+            # 未知总数时按并发数分批拉取，直到出现不满一页的结果
+            while len(results[-1]) >= page_size and len(results) < max_pages:
+                start = len(results)
+                batch = list(pool.map(
+                    lambda i: _records(fetch(self._page_params(options, i)), records_path),
+                    range(start, min(start + settings.API_PAGE_CONCURRENCY, max_pages))
+                ))
+                for records in batch:
+                    results.append(records)
+                    if len(records) < page_size:
+                        break
+        return results, fetched
+
+    def _directory(self, fingerprint: str) -> str:
+        return analytics_store.directory("api", fingerprint)
+
+    def _read_manifest(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        # 其他worker拉取过的数据直接使用磁盘上的缓存
+        manifest_path = os.path.join(self._directory(fingerprint), "manifest.json")
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_manifest(self, fingerprint: str, manifest: Dict[str, Any]) -> None:
+        manifest_path = os.path.join(self._directory(fingerprint), "manifest.json")
+        with open(f"{manifest_path}.{os.getpid()}.tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(f"{manifest_path}.{os.getpid()}.tmp", manifest_path)
+
+    def load(self, config: Dict[str, Any], refresh_interval: Optional[int] = None, source_id: Any = None) -> Dict[str, Any]:
+        """返回API数据的缓存清单（列式文件、列名、列类型和行数）。
+        距上次拉取不超过 refresh_interval 秒时直接使用缓存，否则发送条件请求重新验证"""
+        if not analytics_store.available:
+            raise Exception("未安装duckdb，无法缓存API数据")
+        if not config["url"]:
+            raise Exception("API地址不能为空")
+        fingerprint = self.fingerprint(config)
+        if source_id is not None:
+            self._source_fingerprints[source_id] = fingerprint
+        manifest = self._fresh(self._manifests.get(fingerprint), refresh_interval)
+        if manifest is not None:
+            self._stats["hits"] += 1
+            return manifest
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(fingerprint, threading.Lock())
+        with load_lock:
+            cached = self._manifests.get(fingerprint) or self._read_manifest(fingerprint)
+            manifest = self._fresh(cached, refresh_interval)
+            if manifest is None:
+                try:
+                    manifest = self._load(fingerprint, config, cached)
+                except Exception as e:
+                    if cached is None or not os.path.exists(cached["path"]):
+                        raise
+                    # API不可用时继续使用上次拉取的数据，到下一个刷新间隔再重试
+                    print(f"API数据拉取失败，使用上次拉取的数据: {e}")
+                    manifest = dict(cached, fetched_at=time.time())
+                    self._stats["stale"] += 1
+            else:
+                self._stats["hits"] += 1
+            self._manifests[fingerprint] = manifest
+            return manifest
+
+    @staticmethod
+    def _fresh(manifest: Optional[Dict[str, Any]], refresh_interval: Optional[int]) -> Optional[Dict[str, Any]]:
+        if manifest is None or not os.path.exists(manifest["path"]):
+            return None
+        if time.time() - manifest["fetched_at"] > (refresh_interval or settings.DEFAULT_REFRESH_INTERVAL):
+            return None
+        return manifest
+
+    def _load(self, fingerprint: str, config: Dict[str, Any], cached: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        directory = self._directory(fingerprint)
+        pages = (cached or {}).get("pages", {})
+        results, fetched = self._fetch_all(self._session(fingerprint), config, pages, directory)
+
+        # 所有页的内容都未变化时沿用已有的列式文件
+        version = hashlib.sha256(json.dumps([fetched[key]["digest"] for key in sorted(fetched)]).encode("utf-8")).hexdigest()[:16]
+        if cached and cached["version"] == version and os.path.exists(cached["path"]):
+            manifest = dict(cached, pages=fetched, fetched_at=time.time())
+        else:
+            columns = list(dict.fromkeys(name for records in results for record in records for name in _flat_names(record)))
+            path = os.path.join(directory, f"data_{version}.parquet")
+            row_count, column_types = (0, {})
+            if columns:
+                row_count, column_types = analytics_store.write_parquet(path, columns, _page_rows(results, columns))
+            else:
+                # 没有任何记录时生成只有一列的空表，查询仍然可以执行
+                columns = ["value"]
+                row_count, column_types = analytics_store.write_parquet(path, columns, [])
+            manifest = {"version": version, "path": path, "columns": columns, "column_types": column_types,
+                        "row_count": row_count, "pages": fetched, "fetched_at": time.time()}
+            self._stats["rebuilds"] += 1
+
+        self._write_manifest(fingerprint, manifest)
+        # 删除旧版本的列式文件和不再使用的页缓存
+        keep = {os.path.basename(manifest["path"]), "manifest.json"} | {page["file"] for page in fetched.values()}
+        for name in os.listdir(directory):
+            if name not in keep and not name.endswith(".tmp"):
+                path = os.path.join(directory, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+        self._stats["loads"] += 1
+        self._stats["load_seconds"] += time.perf_counter() - start
+        return manifest
+
+    def sample_fields(self, config: Dict[str, Any]) -> Tuple[List[str], int]:
+        """只请求第一页，根据其中的前若干条记录推断字段，返回字段和第一页的记录数"""
+        if not config["url"]:
+            raise Exception("API地址不能为空")
+        options = config["options"]
+        mode = options.get("pagination") or "none"
+        if mode not in _PAGINATION_MODES:
+            raise Exception(f"不支持的分页方式: {mode}")
+        with requests.Session() as session:
+            body = self._request(session, config, self._page_params(options, 0)).json()
+        records = _records(body, options.get("records_path"))
+        sample = [flatten_record(record) for record in records[:settings.API_SCHEMA_SAMPLE_ROWS]]
+        return _union_columns(sample), len(records)
+
+    def fields(self, data_source) -> List[str]:
+        """数据源的字段：已缓存时使用缓存的列名，否则抽样推断"""
+        manifest = self._manifests.get(self.fingerprint(api_config(data_source)))
+        if manifest is not None:
+            return list(manifest["columns"])
+        return self.sample_fields(api_config(data_source))[0]
+
+    def tables(self, config: Dict[str, Any], views: List[str], refresh_interval: Optional[int] = None,
+               source_id: Any = None) -> Dict[str, str]:
+        """返回视图名到列式文件的映射，API数据同时以 API_TABLE 注册"""
+        path = self.load(config, refresh_interval, source_id)["path"]
+        return {name: path for name in [API_TABLE] + list(views)}
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["sources"] = len(self._manifests)
+        stats["sessions"] = len(self._sessions)
+        return stats
+
+
+class ApiSource(LocalSource):
+    """API数据源作为查询目标：拉取的数据在本地分析存储上查询，首次查询或超过刷新间隔时在执行器线程中重新验证"""
+
+    def __init__(self, data_source, data_set_ids):
+        self.id = data_source.id
+        self.connection_pool = data_source.connection_pool
+        self.refresh_interval = data_source.refresh_interval
+        self.config = api_config(data_source)
+        self.data_set_views = {data_set_id: f"data_set_{data_set_id}" for data_set_id in data_set_ids}
+
+    def table_for(self, data_set_id: Any) -> str:
+        return self.data_set_views[data_set_id]
+
+    def resolve_tables(self) -> Dict[str, str]:
+        return api_connector.tables(self.config, self.data_set_views.values(), self.refresh_interval, self.id)
+
+
+api_connector = ApiConnector()
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+import openpyxl
+import pandas as pd
+from app.core.config import settings
+from app.services.analytics.store import LocalSource, analytics_store
+
+# openpyxl 可以流式读取的格式，其他格式（如xls）使用pandas读取
+_STREAMING_SUFFIXES = (".xlsx", ".xlsm")
+
+
+def _column_names(header) -> List[str]:
+    """以首行作为列名：空列名按位置命名，重复的列名加序号"""
+    names = []
+    for index, value in enumerate(header or ()):
+        name = str(value).strip() if value is not None and str(value).strip() else f"column_{index + 1}"
+        base, suffix = name, 1
+        while name in names:
+            suffix += 1
+            name = f"{base}_{suffix}"
+        names.append(name)
+    return names
+
+
+def _row_batches(rows: Iterator[tuple], width: int, batch_size: int) -> Iterator[List[tuple]]:
+    """按列数对齐每一行并分批产出，跳过空行"""
+    batch = []
+    for row in rows:
+        row = tuple(row[:width]) + (None,) * (width - len(row))
+        if all(value is None or value == "" for value in row):
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ExcelCache:
+    """Excel文件的列式缓存：工作簿以只读流式模式解析一次，每个工作表转换为一个Parquet文件并推断列类型。
+    缓存按文件路径、修改时间和大小区分，文件变化后重新解析；多个worker进程共享磁盘上的缓存"""
+
+    def __init__(self):
+        # 文件版本 -> 缓存清单
+        self._manifests: Dict[str, Dict[str, Any]] = {}
+        # 文件路径 -> 解析锁，同一文件同时只解析一次
+        self._parse_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "parses": 0, "parse_seconds": 0.0}
+
+    def _directory(self, file_path: str) -> str:
+        return os.path.join("excel", hashlib.sha256(os.path.abspath(file_path).encode("utf-8")).hexdigest()[:16])
+
+    def version(self, file_path: str) -> str:
+        """文件版本：由路径、修改时间和大小决定"""
+        if not file_path or not os.path.exists(file_path):
+            raise Exception(f"文件不存在: {file_path}")
+        stat = os.stat(file_path)
+        raw = f"{os.path.abspath(file_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+    def load(self, file_path: str) -> Dict[str, Any]:
+        """返回文件的缓存清单（各工作表的Parquet文件、列名、列类型和行数），未缓存时解析文件"""
+        version = self.version(file_path)
+        manifest = self._manifests.get(version)
+        if manifest is not None:
+            self._stats["hits"] += 1
+            return manifest
+
+        with self._lock:
+            parse_lock = self._parse_locks.setdefault(os.path.abspath(file_path), threading.Lock())
+        with parse_lock:
+            manifest = self._manifests.get(version) or self._read_manifest(file_path, version)
+            if manifest is None:
+                manifest = self._parse(file_path, version)
+            else:
+                self._stats["hits"] += 1
+            with self._lock:
+                self._manifests = {key: value for key, value in self._manifests.items() if value["path"] != manifest["path"]}
+                self._manifests[version] = manifest
+            return manifest
+
+    def _read_manifest(self, file_path: str, version: str) -> Optional[Dict[str, Any]]:
+        # 其他worker已经解析过的文件直接使用磁盘上的缓存
+        manifest_path = os.path.join(analytics_store.root, self._directory(file_path), version, "manifest.json")
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _parse(self, file_path: str, version: str) -> Dict[str, Any]:
+        if not analytics_store.available:
+            raise Exception("未安装duckdb，无法缓存Excel文件")
+        start = time.perf_counter()
+        parent = analytics_store.directory(self._directory(file_path))
+        directory = analytics_store.directory(self._directory(file_path), version)
+
+        sheets = []
+        for index, (name, rows) in enumerate(self._read_sheets(file_path)):
+            header = next(rows, None)
+            columns = _column_names(header)
+            sheet = {"name": name, "path": os.path.join(directory, f"sheet_{index}.parquet"),
+                     "columns": columns, "column_types": {}, "row_count": 0}
+            if columns:
+                sheet["row_count"], sheet["column_types"] = analytics_store.write_parquet(
+                    sheet["path"], columns, _row_batches(rows, len(columns), settings.EXCEL_BATCH_SIZE)
+                )
+            else:
+                # 空工作表没有列，不生成缓存文件
+                sheet["path"] = None
+            sheets.append(sheet)
+
+        manifest = {"path": os.path.abspath(file_path), "version": version, "sheets": sheets}
+        manifest_path = os.path.join(directory, "manifest.json")
+        with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+
+        # 删除同一文件旧版本的缓存
+        for name in os.listdir(parent):
+            if name != version:
+                shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
+        self._stats["parses"] += 1
+        self._stats["parse_seconds"] += time.perf_counter() - start
+        return manifest
+
+    def _read_sheets(self, file_path: str) -> Iterator[tuple]:
+        """逐个产出 (工作表名, 行迭代器)"""
+        if file_path.lower().endswith(_STREAMING_SUFFIXES):
+            # 只读模式按行流式读取，内存占用与文件大小无关
+            workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+            try:
+                for worksheet in workbook.worksheets:
+                    yield worksheet.title, worksheet.iter_rows(values_only=True)
+            finally:
+                workbook.close()
+            return
+        for name, frame in pd.read_excel(file_path, sheet_name=None, header=None, dtype=object).items():
+            frame = frame.astype(object).where(frame.notna(), None)
+            yield str(name), iter(frame.itertuples(index=False, name=None))
+
+    def _sheet(self, manifest: Dict[str, Any], sheet_name: str) -> Dict[str, Any]:
+        sheet = next((sheet for sheet in manifest["sheets"] if sheet["name"] == sheet_name), None)
+        if sheet is None:
+            raise Exception(f"工作表不存在: {sheet_name}")
+        if sheet["path"] is None:
+            raise Exception(f"工作表为空: {sheet_name}")
+        return sheet
+
+    def sheet(self, file_path: str, sheet_name: str) -> Dict[str, Any]:
+        """工作表的缓存信息：列名、列类型和行数"""
+        return self._sheet(self.load(file_path), sheet_name)
+
+    def sheet_names(self, file_path: str) -> List[str]:
+        return [sheet["name"] for sheet in self.load(file_path)["sheets"]]
+
+    def columns(self, file_path: str, sheet_name: str) -> List[str]:
+        return list(self._sheet(self.load(file_path), sheet_name)["columns"])
+
+    def tables(self, file_path: str, views: Dict[str, str]) -> Dict[str, str]:
+        """返回视图名到工作表缓存文件的映射；每个工作表同时以工作表名注册，供SQL模式的数据集使用"""
+        manifest = self.load(file_path)
+        tables = {sheet["name"]: sheet["path"] for sheet in manifest["sheets"] if sheet["path"]}
+        for view, sheet_name in views.items():
+            tables[view] = self._sheet(manifest, sheet_name)["path"]
+        return tables
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["files"] = len(self._manifests)
+        return stats
+
+
+class ExcelSource(LocalSource):
+    """Excel数据源作为查询目标：工作表的列式缓存在本地分析存储上查询，首次查询或文件变化时在执行器线程中解析"""
+
+    def __init__(self, data_source, sheets: Dict[Any, str]):
+        self.id = data_source.id
+        self.connection_pool = data_source.connection_pool
+        self.refresh_interval = data_source.refresh_interval
+        self.file_path = data_source.file_path
+        # 视图名包含文件版本：文件变化后查询SQL随之变化，旧的结果缓存不再命中
+        version = excel_cache.version(self.file_path)[:8]
+        self.data_set_views = {data_set_id: f"data_set_{data_set_id}_{version}" for data_set_id in sheets}
+        # 视图名 -> 工作表名
+        self.views = {self.data_set_views[data_set_id]: sheet_name for data_set_id, sheet_name in sheets.items()}
+
+    def table_for(self, data_set_id: Any) -> str:
+        return self.data_set_views[data_set_id]
+
+    def resolve_tables(self) -> Dict[str, str]:
+        return excel_cache.tables(self.file_path, self.views)
+
+
+excel_cache = ExcelCache()
@@ -0,0 +1,482 @@
+import datetime
+import os
+import threading
+import time
+import uuid
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+from sqlalchemy import text
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.data_models import DataSet, DataSetExtract
+from app.models.sources import DataSource
+from app.schemas.data_models import DataSetExtractConfig
+from app.services.cache import result_cache, invalidation_bus
+from app.services.query import BoundPivot, CompiledModel
+from app.services.query.model_plan import data_set_table, definition_version
+from app.services.query.sql_utils import check_identifier
+from app.services.sources.engine_registry import engine_registry
+from app.services.sources.query_executor import query_executor
+from app.services.analytics.store import LocalSource, analytics_store, quote_identifier
+from app.services.analytics.freshness import utcnow, age_seconds
+from app.services.analytics.excel import ExcelSource
+from app.services.analytics.api import ApiSource
+
+# 数据直接缓存在本地分析存储中的数据源类型，不需要抽取模式
+_CACHED_SOURCE_TYPES = ("excel", "api")
+# 写入分片时的临时文件（Parquet临时文件、DuckDB临时数据库及其日志）
+_STAGING_SUFFIXES = (".tmp", ".duckdb", ".duckdb.wal")
+
+
+def extract_table(data_set_id: Any) -> str:
+    """数据集快照在本地分析存储中的视图名"""
+    return f"data_set_{data_set_id}"
+
+
+def _watermark_value(value: Any) -> Any:
+    """水位保存为JSON值，时间使用ISO格式，作为绑定参数传回数据源"""
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _track_max(batches, index: int, state: Dict[str, Any]):
+    """逐批传递数据，同时记录增量字段的最大值"""
+    for rows in batches:
+        values = [row[index] for row in rows if row[index] is not None]
+        if values:
+            batch_max = max(values)
+            state["max"] = batch_max if state["max"] is None else max(state["max"], batch_max)
+        yield rows
+
+
+class ExtractSource(LocalSource):
+    """本地数据集快照作为查询目标"""
+
+    id = "extract"
+
+    def __init__(self, tables: Dict[str, Any]):
+        # 视图名 -> Parquet文件列表
+        self.tables = tables
+        self.connection_pool = settings.EXTRACT_QUERY_CONCURRENCY
+        self.refresh_interval = None
+
+    def table_for(self, data_set_id: Any) -> str:
+        return extract_table(data_set_id)
+
+    def resolve_tables(self) -> Dict[str, Any]:
+        return self.tables
+
+
+class ExtractService:
+    """数据集抽取模式：按刷新间隔把数据集拉取为本地列式快照，透视分析和即席查询在快照上执行。
+    快照由若干不可变的分片文件组成，刷新时写入新分片，提交新的分片列表即完成原子替换"""
+
+    def __init__(self):
+        # 各数据集已生成的快照，快照或数据集变化时失效
+        self._extracts: Dict[Any, Optional[DataSetExtract]] = {}
+        # 刷新失败的快照在一个刷新间隔内不再重试
+        self._attempts: Dict[Any, float] = {}
+        self._lock = threading.Lock()
+        self._stats = {"local_queries": 0, "refreshes": 0, "full_refreshes": 0, "incremental_refreshes": 0, "refresh_errors": 0}
+
+    def _describe(self, extract: DataSetExtract, data_set: DataSet) -> DataSetExtract:
+        # 附加快照的新鲜度信息
+        extract.age_seconds = age_seconds(extract.refreshed_at)
+        extract.is_fresh = extract.age_seconds is not None and extract.age_seconds <= self._refresh_interval(extract, data_set)
+        extract.watermark_lag_seconds = None
+        if isinstance(extract.watermark, str):
+            try:
+                extract.watermark_lag_seconds = age_seconds(datetime.datetime.fromisoformat(extract.watermark))
+            except ValueError:
+                pass
+        return extract
+
+    def _refresh_interval(self, extract: DataSetExtract, data_set: DataSet) -> int:
+        return extract.refresh_interval or data_set.refresh_interval or settings.DEFAULT_REFRESH_INTERVAL
+
+    async def get(self, data_set_id: int) -> DataSetExtract:
+        db = SessionLocal()
+        try:
+            data_set = db.query(DataSet).filter(DataSet.id == data_set_id).first()
+            if not data_set:
+                raise Exception(f"数据集不存在: {data_set_id}")
+            extract = db.query(DataSetExtract).filter(DataSetExtract.data_set_id == data_set_id).first()
+            if not extract:
+                raise Exception(f"数据集未启用抽取模式: {data_set_id}")
+            return self._describe(extract, data_set)
+        finally:
+            db.close()
+
+    async def configure(self, data_set_id: int, config: DataSetExtractConfig) -> DataSetExtract:
+        """启用或修改数据集的抽取模式，快照由调度器在下一轮生成"""
+        db = SessionLocal()
+        try:
+            data_set = db.query(DataSet).filter(DataSet.id == data_set_id).first()
+            if not data_set:
+                raise Exception(f"数据集不存在: {data_set_id}")
+            data_source = db.query(DataSource).filter(DataSource.id == data_set.data_source_id).first()
+            if data_source and data_source.type in _CACHED_SOURCE_TYPES:
+                raise Exception("Excel和API数据源已自动缓存为列式文件，无需启用抽取模式")
+            for key in (config.incremental_key, config.unique_key):
+                if key:
+                    check_identifier(key)
+            extract = db.query(DataSetExtract).filter(DataSetExtract.data_set_id == data_set_id).first()
+            if not extract:
+                extract = DataSetExtract(
+                    data_set_id=data_set_id,
+                    storage_path=analytics_store.directory("extracts", extract_table(data_set_id))
+                )
+                db.add(extract)
+            if (config.incremental_key, config.unique_key) != (extract.incremental_key, extract.unique_key):
+                # 增量字段或唯一键变化后，下次刷新时全量拉取
+                extract.watermark = None
+            for field, value in config.model_dump().items():
+                setattr(extract, field, value)
+            db.commit()
+            db.refresh(extract)
+            await invalidation_bus.publish("data_set", data_set_id)
+            return self._describe(extract, data_set)
+        finally:
+            db.close()
+
+    async def delete(self, data_set_id: int) -> None:
+        """关闭抽取模式并删除快照，查询恢复为直接访问数据源"""
+        db = SessionLocal()
+        try:
+            extract = db.query(DataSetExtract).filter(DataSetExtract.data_set_id == data_set_id).first()
+            if not extract:
+                raise Exception(f"数据集未启用抽取模式: {data_set_id}")
+            self.delete_for_data_set(db, data_set_id)
+            db.commit()
+            await invalidation_bus.publish("data_set", data_set_id)
+        finally:
+            db.close()
+
+    def delete_for_data_set(self, db, data_set_id: int) -> None:
+        """删除数据集前删除它的快照（在调用方的事务中执行）"""
+        for extract in db.query(DataSetExtract).filter(DataSetExtract.data_set_id == data_set_id).all():
+            if extract.storage_path:
+                analytics_store.remove_directory(extract.storage_path)
+            db.delete(extract)
+
+    def invalidate(self, kind: str, object_id: Any) -> None:
+        """数据集或快照变化时重新加载快照信息"""
+        with self._lock:
+            if kind in ("*", "source"):
+                self._extracts.clear()
+            elif kind == "data_set":
+                self._extracts.pop(object_id, None)
+
+    def _snapshot(self, data_set_id: Any) -> Optional[DataSetExtract]:
+        if data_set_id in self._extracts:
+            return self._extracts[data_set_id]
+        db = SessionLocal()
+        try:
+            extract = db.query(DataSetExtract).filter(
+                DataSetExtract.data_set_id == data_set_id,
+                DataSetExtract.is_active == True,
+                DataSetExtract.refreshed_at.isnot(None)
+            ).first()
+        finally:
+            db.close()
+        with self._lock:
+            self._extracts[data_set_id] = extract
+        return extract
+
+    def ready(self, data_set_id: Any, version: str) -> Optional[DataSetExtract]:
+        """返回可用的快照：已生成且与当前数据集定义一致；未生成完成时查询仍访问数据源"""
+        if not analytics_store.available:
+            return None
+        extract = self._snapshot(data_set_id)
+        if extract is not None and extract.parts and not all(os.path.exists(path) for path in self._files(extract)):
+            # 缓存的快照信息已过期（失效消息没有送达时分片可能已被其他worker的刷新删除），重新读取
+            with self._lock:
+                self._extracts.pop(data_set_id, None)
+            extract = self._snapshot(data_set_id)
+            if extract is not None and extract.parts and not all(os.path.exists(path) for path in self._files(extract)):
+                return None
+        if extract is None or extract.definition_version != version or not extract.parts:
+            return None
+        return extract
+
+    @staticmethod
+    def _files(extract: DataSetExtract, parts: Optional[List[str]] = None) -> List[str]:
+        return [os.path.join(extract.storage_path, part) for part in (extract.parts if parts is None else parts)]
+
+    @staticmethod
+    def _cached_source(data_source: DataSource, sheets: Dict[Any, str]) -> LocalSource:
+        """Excel、API数据源的本地查询目标；sheets 为数据集ID到工作表名的映射，API数据源只使用其中的数据集ID"""
+        if data_source.type == "api":
+            return ApiSource(data_source, list(sheets))
+        return ExcelSource(data_source, sheets)
+
+    def source_for(self, data_set: DataSet, data_source: DataSource) -> Optional[LocalSource]:
+        """数据集有可用快照时返回本地查询目标；Excel、API数据源的数据集始终在本地的列式缓存上查询"""
+        if data_source.type in _CACHED_SOURCE_TYPES:
+            if not analytics_store.available:
+                return None
+            # SQL模式的数据集直接按工作表名（API数据源为 api_data）查询
+            return self._cached_source(data_source, {} if data_set.creation_mode == 'sql' else {data_set.id: data_set_table(data_set)})
+        extract = self.ready(data_set.id, definition_version(data_set, data_source))
+        if extract is None:
+            return None
+        self._stats["local_queries"] += 1
+        return ExtractSource({extract_table(data_set.id): self._files(extract)})
+
+    def localize_plan(self, plan: CompiledModel) -> CompiledModel:
+        """模型涉及的数据集都有可用快照时，返回在快照上执行的编译结果，否则返回原编译结果"""
+        if isinstance(plan.data_source, LocalSource):
+            return plan
+        if plan.data_source.type in _CACHED_SOURCE_TYPES:
+            # 模型的数据集都来自同一个Excel文件或API时在本地的列式缓存上执行
+            if not analytics_store.available or len(plan.source_ids) > 1:
+                return plan
+            source = self._cached_source(plan.data_source, dict(plan.data_set_tables))
+            return plan.with_tables({data_set_id: source.table_for(data_set_id) for data_set_id in plan.data_set_ids}, source)
+        tables = {}
+        for data_set_id in plan.data_set_ids:
+            extract = self.ready(data_set_id, plan.data_set_versions[data_set_id])
+            if extract is None:
+                return plan
+            tables[extract_table(data_set_id)] = self._files(extract)
+        return plan.with_tables(
+            {data_set_id: extract_table(data_set_id) for data_set_id in plan.data_set_ids},
+            ExtractSource(tables)
+        )
+
+    def localize(self, pivot: BoundPivot) -> BoundPivot:
+        plan = self.localize_plan(pivot.plan)
+        if plan is pivot.plan:
+            return pivot
+        self._stats["local_queries"] += 1
+        return pivot.rebind(plan)
+
+    def _extract_sql(self, data_set: DataSet, incremental_key: Optional[str] = None, inclusive: bool = False) -> str:
+        """拉取数据集的SQL；指定增量字段时只拉取水位之后的数据"""
+        if not incremental_key:
+            if data_set.creation_mode == 'sql':
+                return data_set.sql_query
+            return f"SELECT * FROM {data_set_table(data_set)}"
+        condition = f"{check_identifier(incremental_key)} {'>=' if inclusive else '>'} :watermark"
+        if data_set.creation_mode == 'sql':
+            return f"SELECT * FROM ({data_set.sql_query}) AS extract_query WHERE {condition}"
+        # 直接筛选原表，数据源可以使用增量字段上的索引
+        return f"SELECT * FROM {data_set_table(data_set)} WHERE {condition}"
+
+    def _pull(self, data_set: DataSet, data_source: DataSource, state: Dict[str, Any], full: bool) -> Dict[str, Any]:
+        """在数据源执行器线程中拉取数据并写入新的分片文件。全量刷新时新分片即为完整快照；
+        增量刷新时只拉取水位之后的数据追加为新分片，设置了唯一键时改写包含旧版本行的分片。
+        已有文件不会被修改，新的分片列表提交到数据库后才对查询可见"""
+        directory = state["directory"]
+        key = state["incremental_key"]
+        incremental = not full
+        sql = self._extract_sql(data_set, key if incremental else None, inclusive=bool(state["unique_key"]))
+        params = {"watermark": state["watermark"]} if incremental else {}
+        part = f"part-{uuid.uuid4().hex}.parquet"
+        tracker = {"max": None}
+
+        batch_size = settings.EXTRACT_BATCH_SIZE
+        with engine_registry.connect(data_source) as conn:
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(text(sql), params)
+            try:
+                columns = list(result.keys())
+                batches = result.partitions(batch_size)
+                if key:
+                    if key not in columns:
+                        raise Exception(f"增量字段不存在: {key}")
+                    batches = _track_max(batches, columns.index(key), tracker)
+                fetched, column_types = analytics_store.write_parquet(
+                    os.path.join(directory, part), columns, batches, None if full else state["column_types"]
+                )
+            finally:
+                result.close()
+
+        parts = [part] if full else list(state["parts"])
+        if incremental:
+            if not fetched:
+                analytics_store.remove(os.path.join(directory, part))
+                column_types = state["column_types"]
+            else:
+                if state["unique_key"]:
+                    parts = self._replace_updated(directory, parts, part, state["unique_key"])
+                parts.append(part)
+        if len(parts) > settings.EXTRACT_MAX_PARTS:
+            parts = [self._compact(directory, parts)]
+
+        files = [os.path.join(directory, name) for name in parts]
+        row_count = analytics_store.query("SELECT COUNT(*) FROM snapshot", tables={"snapshot": files})[1][0][0]
+        watermark = _watermark_value(tracker["max"]) if tracker["max"] is not None else state["watermark"]
+        return {"parts": parts, "watermark": watermark, "row_count": row_count,
+                "rows_fetched": fetched, "column_types": column_types}
+
+    def _replace_updated(self, directory: str, parts: List[str], delta: str, unique_key: str) -> List[str]:
+        """改写包含新拉取行旧版本的分片，去掉这些旧行；未受影响的分片保持不变"""
+        key = quote_identifier(unique_key)
+        tables = {"delta": os.path.join(directory, delta)}
+        replaced = []
+        for name in parts:
+            tables["part"] = os.path.join(directory, name)
+            stale_filter = f"{key} IN (SELECT {key} FROM delta WHERE {key} IS NOT NULL)"
+            affected = analytics_store.query(f"SELECT COUNT(*) FROM part WHERE {stale_filter}", tables=tables)[1][0][0]
+            if not affected:
+                replaced.append(name)
+                continue
+            rewritten = f"part-{uuid.uuid4().hex}.parquet"
+            analytics_store.copy_query(
+                f"SELECT * FROM part WHERE {key} IS NULL OR NOT ({stale_filter})", os.path.join(directory, rewritten), tables
+            )
+            replaced.append(rewritten)
+        return replaced
+
+    def _compact(self, directory: str, parts: List[str]) -> str:
+        """把多个分片合并为一个文件"""
+        compacted = f"part-{uuid.uuid4().hex}.parquet"
+        files = [os.path.join(directory, name) for name in parts]
+        analytics_store.copy_query("SELECT * FROM snapshot", os.path.join(directory, compacted), {"snapshot": files})
+        return compacted
+
+    def _cleanup(self, directory: str, keep: List[str]) -> None:
+        """删除不再使用的分片；上一版本的分片保留到下次刷新，其他worker在收到失效消息前仍可能读取。
+        临时文件（.tmp、.duckdb）可能属于同时进行的另一次刷新（Redis不可用时锁不生效），不删除"""
+        if not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            if name not in keep and not name.endswith(_STAGING_SUFFIXES):
+                analytics_store.remove(os.path.join(directory, name))
+
+    def _needs_full_refresh(self, extract: DataSetExtract, version: str) -> bool:
+        if not extract.incremental_key or extract.watermark is None or not extract.parts:
+            return True
+        if extract.definition_version != version:
+            return True
+        if extract.full_refresh_interval:
+            last_full = age_seconds(extract.full_refreshed_at)
+            return last_full is None or last_full >= extract.full_refresh_interval
+        return False
+
+    def _is_due(self, extract: DataSetExtract, data_set: DataSet, data_source: DataSource) -> bool:
+        if not extract.is_active:
+            return False
+        interval = self._refresh_interval(extract, data_set)
+        attempted = self._attempts.get(extract.id)
+        if attempted is not None and time.monotonic() - attempted < interval:
+            return False
+        if extract.refreshed_at is None or extract.definition_version != definition_version(data_set, data_source):
+            return True
+        return age_seconds(extract.refreshed_at) >= interval
+
+    async def refresh(self, data_set_id: int, only_if_due: bool = False, full: bool = False) -> Optional[DataSetExtract]:
+        """刷新数据集快照：设置了增量字段时只拉取水位之后的数据，否则全量拉取；
+        多个worker之间通过锁保证同一数据集只有一个在刷新"""
+        if not analytics_store.available:
+            raise Exception("未安装duckdb，无法生成数据集快照")
+        lock_name = f"extract:{data_set_id}"
+        token = await result_cache.try_lock(lock_name, settings.EXTRACT_REFRESH_LOCK_TIMEOUT)
+        if token is None:
+            if only_if_due:
+                return None
+            raise Exception(f"数据集快照正在刷新: {data_set_id}")
+
+        db = SessionLocal()
+        try:
+            extract = db.query(DataSetExtract).filter(DataSetExtract.data_set_id == data_set_id).first()
+            if not extract:
+                raise Exception(f"数据集未启用抽取模式: {data_set_id}")
+            data_set = db.query(DataSet).filter(DataSet.id == data_set_id).first()
+            data_source = db.query(DataSource).filter(DataSource.id == data_set.data_source_id).first()
+            if not data_source:
+                raise Exception(f"数据源不存在: {data_set.data_source_id}")
+            # 获取锁期间其他worker可能已经完成了刷新
+            if only_if_due and not self._is_due(extract, data_set, data_source):
+                return extract
+
+            self._attempts[extract.id] = time.monotonic()
+            version = definition_version(data_set, data_source)
+            full = full or self._needs_full_refresh(extract, version)
+            previous_parts = list(extract.parts or [])
+            state = {
+                "directory": extract.storage_path or analytics_store.directory("extracts", extract_table(data_set_id)),
+                "incremental_key": extract.incremental_key,
+                "unique_key": extract.unique_key,
+                "watermark": extract.watermark,
+                "parts": previous_parts,
+                "column_types": extract.column_types
+            }
+            extract.status = "refreshing"
+            db.commit()
+
+            start = time.perf_counter()
+            try:
+                os.makedirs(state["directory"], exist_ok=True)
+                pulled = await query_executor.run(data_source, self._pull, data_set, data_source, state, full)
+            except Exception as e:
+                self._stats["refresh_errors"] += 1
+                # 刷新失败时保留原快照
+                extract.status = "failed"
+                extract.last_error = str(e)
+                db.commit()
+                raise Exception(f"刷新数据集快照失败: {str(e)}")
+
+            self._stats["refreshes"] += 1
+            self._stats["incremental_refreshes" if not full else "full_refreshes"] += 1
+            self._attempts.pop(extract.id, None)
+            extract.status = "ready"
+            extract.storage_path = state["directory"]
+            extract.parts = pulled["parts"]
+            extract.watermark = pulled["watermark"]
+            extract.row_count = pulled["row_count"]
+            extract.rows_fetched = pulled["rows_fetched"]
+            extract.column_types = pulled["column_types"]
+            extract.definition_version = version
+            extract.last_refresh_mode = "full" if full else "incremental"
+            extract.refresh_seconds = round(time.perf_counter() - start, 3)
+            extract.refreshed_at = utcnow()
+            if full:
+                extract.full_refreshed_at = extract.refreshed_at
+            extract.last_error = None
+            db.commit()
+            db.refresh(extract)
+            # 快照更新后，基于该数据集的查询缓存失效
+            await invalidation_bus.publish("data_set", data_set_id)
+            self._cleanup(state["directory"], previous_parts + pulled["parts"])
+            return self._describe(extract, data_set)
+        finally:
+            db.close()
+            await result_cache.unlock(lock_name, token)
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        """供刷新调度器使用的任务列表：每个启用的快照一个任务。
+        due 表示已超过刷新间隔，pending 表示快照从未生成或数据集定义已变化，需要立即刷新"""
+        db = SessionLocal()
+        try:
+            jobs = []
+            for extract in db.query(DataSetExtract).filter(DataSetExtract.is_active == True).all():
+                data_set = db.query(DataSet).filter(DataSet.id == extract.data_set_id).first()
+                data_source = data_set and db.query(DataSource).filter(DataSource.id == data_set.data_source_id).first()
+                if not data_source:
+                    continue
+                jobs.append({
+                    "id": extract.data_set_id,
+                    "name": data_set.name,
+                    "source_ids": [data_source.id],
+                    "interval": self._refresh_interval(extract, data_set),
+                    "last_run": extract.refreshed_at,
+                    "due": self._is_due(extract, data_set, data_source),
+                    "pending": extract.refreshed_at is None or extract.definition_version != definition_version(data_set, data_source)
+                })
+            return jobs
+        finally:
+            db.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["available"] = analytics_store.available
+        return stats
+
+
+extract_service = ExtractService()
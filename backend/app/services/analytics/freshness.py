@@ -0,0 +1,16 @@
+import datetime
+from typing import Optional
+
+
+def utcnow() -> datetime.datetime:
+    """当前UTC时间（不带时区），与数据库中保存的时间一致"""
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def age_seconds(moment: Optional[datetime.datetime]) -> Optional[float]:
+    """距今的秒数，带时区的时间先转换为UTC"""
+    if moment is None:
+        return None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (utcnow() - moment).total_seconds()
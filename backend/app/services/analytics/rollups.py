@@ -0,0 +1,514 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import text
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.data_models import Rollup
+from app.schemas.data_models import RollupCreate, RollupUpdate
+from app.services.cache import result_cache, invalidation_bus
+from app.services.query import BoundPivot, CompiledModel, model_plan_cache
+from app.services.query.fusion import REAGGREGATABLE_AGGREGATIONS
+from app.services.query.sql_utils import FILTER_OPERATORS, check_sort_order
+from app.services.result_format import QueryResult
+from app.services.sources.engine_registry import engine_registry
+from app.services.sources.query_executor import query_executor
+from app.services.analytics.store import LocalSource, analytics_store, quote_identifier, parquet_source
+from app.services.analytics.freshness import utcnow, age_seconds
+from app.services.analytics.extracts import extract_service
+from app.services.analytics.sketches import SKETCH_AGGREGATIONS, new_sketch, merge_estimate
+
+# 顾问最多记录的查询粒度数
+_MAX_OBSERVATIONS = 1000
+# 汇总表可以保存的聚合：可以再次聚合的聚合，以及保存为可合并草图的近似聚合
+ROLLUP_AGGREGATIONS = REAGGREGATABLE_AGGREGATIONS | SKETCH_AGGREGATIONS
+
+
+class RollupService:
+    """数据模型上的物化汇总表：按维度、度量预先聚合并保存到本地分析存储，
+    透视查询被覆盖时改写为查询行数最少的汇总表，否则仍在数据源上执行"""
+
+    def __init__(self):
+        # 各模型已构建的汇总表，汇总表或模型变化时失效
+        self._definitions: Dict[Any, List[Rollup]] = {}
+        # 顾问记录的查询粒度：(模型ID, 维度) -> {"hits", "seconds", "measures"}
+        self._observations: Dict[Tuple[Any, Tuple[str, ...]], Dict[str, Any]] = {}
+        # 构建失败的汇总表在一个刷新间隔内不再重试
+        self._attempts: Dict[Any, float] = {}
+        self._lock = threading.Lock()
+        self._stats = {"rewrites": 0, "fallbacks": 0, "builds": 0, "build_errors": 0}
+
+    def _validate(self, plan: CompiledModel, dimensions: List[str], measures: List[str]) -> None:
+        plan.validate(dimensions, measures)
+        if not measures:
+            raise Exception("汇总表至少需要一个度量")
+        for meas in measures:
+            if plan.aggregations[meas].upper() not in ROLLUP_AGGREGATIONS:
+                raise Exception(f"度量的聚合方式不支持汇总: {meas}({plan.aggregations[meas]})")
+
+    async def create(self, data_model_id: int, rollup: RollupCreate, origin: str = "manual") -> Rollup:
+        db = SessionLocal()
+        try:
+            plan = model_plan_cache.get(db, data_model_id)
+            self._validate(plan, rollup.dimensions, rollup.measures)
+
+            db_rollup = Rollup(data_model_id=data_model_id, origin=origin, **rollup.model_dump())
+            db.add(db_rollup)
+            db.commit()
+            db.refresh(db_rollup)
+            db_rollup.storage_path = analytics_store.path("rollups", f"rollup_{db_rollup.id}.parquet")
+            db.commit()
+            db.refresh(db_rollup)
+            return db_rollup
+        finally:
+            db.close()
+
+    async def get_by_model(self, data_model_id: int) -> List[Rollup]:
+        db = SessionLocal()
+        try:
+            return db.query(Rollup).filter(Rollup.data_model_id == data_model_id).all()
+        finally:
+            db.close()
+
+    async def update(self, rollup_id: int, rollup_update: RollupUpdate) -> Rollup:
+        db = SessionLocal()
+        try:
+            db_rollup = db.query(Rollup).filter(Rollup.id == rollup_id).first()
+            if not db_rollup:
+                raise Exception(f"汇总表不存在: {rollup_id}")
+
+            update_data = rollup_update.model_dump(exclude_unset=True)
+            if "dimensions" in update_data or "measures" in update_data:
+                plan = model_plan_cache.get(db, db_rollup.data_model_id)
+                dimensions = update_data.get("dimensions", db_rollup.dimensions)
+                measures = update_data.get("measures", db_rollup.measures)
+                self._validate(plan, dimensions, measures)
+                # 粒度变化后原有数据不再可用，等待重新构建
+                db_rollup.built_at = None
+                db_rollup.status = "pending"
+
+            for field, value in update_data.items():
+                setattr(db_rollup, field, value)
+            db.commit()
+            db.refresh(db_rollup)
+            await invalidation_bus.publish("rollup", db_rollup.data_model_id)
+            return db_rollup
+        finally:
+            db.close()
+
+    async def delete(self, rollup_id: int) -> None:
+        db = SessionLocal()
+        try:
+            db_rollup = db.query(Rollup).filter(Rollup.id == rollup_id).first()
+            if not db_rollup:
+                raise Exception(f"汇总表不存在: {rollup_id}")
+
+            data_model_id, storage_path = db_rollup.data_model_id, db_rollup.storage_path
+            db.delete(db_rollup)
+            db.commit()
+            await invalidation_bus.publish("rollup", data_model_id)
+            if storage_path:
+                analytics_store.remove(storage_path)
+        finally:
+            db.close()
+
+    def delete_for_model(self, db, data_model_id: int) -> None:
+        """删除数据模型前删除它的汇总表（在调用方的事务中执行）"""
+        for db_rollup in db.query(Rollup).filter(Rollup.data_model_id == data_model_id).all():
+            if db_rollup.storage_path:
+                analytics_store.remove(db_rollup.storage_path)
+            db.delete(db_rollup)
+
+    def invalidate(self, kind: str, object_id: Any) -> None:
+        """汇总表或模型变化时重新加载已构建的汇总表"""
+        with self._lock:
+            if kind == "*":
+                self._definitions.clear()
+            elif kind in ("rollup", "model"):
+                self._definitions.pop(object_id, None)
+
+    def _built_rollups(self, data_model_id: Any) -> List[Rollup]:
+        rollups = self._definitions.get(data_model_id)
+        if rollups is None:
+            db = SessionLocal()
+            try:
+                rollups = db.query(Rollup).filter(
+                    Rollup.data_model_id == data_model_id,
+                    Rollup.is_active == True,
+                    Rollup.built_at.isnot(None)
+                ).all()
+            finally:
+                db.close()
+            with self._lock:
+                self._definitions[data_model_id] = rollups
+        return rollups
+
+    @staticmethod
+    def _layout(plan: CompiledModel, dimensions: List[str], measures: List[str]):
+        """汇总表的列：维度依次为 d0, d1...；平均值拆分为求和与计数两列，以便再次聚合；
+        近似去重计数、分位数保存为每组一个序列化的草图，查询时合并"""
+        dimension_columns = {dim: f"d{i}" for i, dim in enumerate(dimensions)}
+        measure_columns: Dict[str, List[Tuple[str, str]]] = {}
+        for j, meas in enumerate(measures):
+            aggregation = plan.aggregations[meas].upper()
+            if aggregation == "AVG":
+                measure_columns[meas] = [(f"m{j}_sum", "SUM"), (f"m{j}_count", "COUNT")]
+            elif aggregation in SKETCH_AGGREGATIONS:
+                measure_columns[meas] = [(f"m{j}_sketch", aggregation)]
+            else:
+                measure_columns[meas] = [(f"m{j}", aggregation)]
+        return dimension_columns, measure_columns
+
+    def _refresh_interval(self, rollup: Rollup, plan: CompiledModel) -> int:
+        if rollup.refresh_interval:
+            return rollup.refresh_interval
+        intervals = [interval for interval in plan.refresh_intervals if interval]
+        return min(intervals) if intervals else settings.DEFAULT_REFRESH_INTERVAL
+
+    def _stream(self, plan: CompiledModel, sql: str, params: Dict[str, Any]):
+        """分批读取查询结果；模型的数据集都有本地快照（或来自Excel文件）时在本地执行，不访问数据源"""
+        batch_size = settings.ROLLUP_BUILD_BATCH_SIZE
+        if isinstance(plan.data_source, LocalSource):
+            batches = plan.data_source.stream(sql, params, batch_size)
+            next(batches)
+            yield from batches
+            return
+        with engine_registry.connect(plan.data_source) as conn:
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(text(sql), params)
+            try:
+                yield from result.partitions(batch_size)
+            finally:
+                result.close()
+
+    def _build_sketches(self, plan: CompiledModel, dimensions: List[str], meas: str) -> Dict[tuple, bytes]:
+        """按汇总粒度构建度量的草图：数据源按维度和度量值分组计数，只传输去重后的值，在进程内加入每组的草图"""
+        sql, params = plan.bind_values(dimensions, meas)
+        aggregation = plan.aggregations[meas]
+        sketches: Dict[tuple, Any] = {}
+        for rows in self._stream(plan, sql, params):
+            for row in rows:
+                key = tuple(row[:len(dimensions)])
+                sketch = sketches.get(key)
+                if sketch is None:
+                    sketch = sketches[key] = new_sketch(aggregation)
+                sketch.add(row[len(dimensions)], row[len(dimensions) + 1])
+        return {key: sketch.to_bytes() for key, sketch in sketches.items()}
+
+    def _build_file(self, plan: CompiledModel, rollup: Rollup, path: str) -> Tuple[int, Dict[str, str]]:
+        """在数据源执行器线程中按汇总粒度查询，结果分批写入Parquet文件；草图列按组与聚合结果合并"""
+        dimensions = list(rollup.dimensions)
+        dimension_columns, measure_columns = self._layout(plan, dimensions, rollup.measures)
+        aggregates, sketch_columns = [], []
+        for meas, parts in measure_columns.items():
+            for column, aggregation in parts:
+                if aggregation in SKETCH_AGGREGATIONS:
+                    sketch_columns.append((column, meas))
+                else:
+                    aggregates.append((column, aggregation, meas))
+        columns = list(dimension_columns.values()) + [column for column, _, _ in aggregates] + [column for column, _ in sketch_columns]
+        column_types = {column: "BLOB" for column, _ in sketch_columns}
+        if not sketch_columns:
+            sql, params = plan.bind_fused(dimensions, aggregates)
+            return analytics_store.write_parquet(path, columns, self._stream(plan, sql, params), column_types)
+
+        sketches = [self._build_sketches(plan, dimensions, meas) for _, meas in sketch_columns]
+        if not aggregates:
+            keys = list(dict.fromkeys(key for groups in sketches for key in groups))
+            rows = [key + tuple(groups.get(key) for groups in sketches) for key in keys]
+            return analytics_store.write_parquet(path, columns, [rows], column_types)
+
+        sql, params = plan.bind_fused(dimensions, aggregates)
+
+        def with_sketches():
+            for rows in self._stream(plan, sql, params):
+                yield [tuple(row) + tuple(groups.get(tuple(row[:len(dimensions)])) for groups in sketches) for row in rows]
+
+        return analytics_store.write_parquet(path, columns, with_sketches(), column_types)
+
+    def _is_due(self, rollup: Rollup, plan: CompiledModel) -> bool:
+        if not rollup.is_active:
+            return False
+        interval = self._refresh_interval(rollup, plan)
+        attempted = self._attempts.get(rollup.id)
+        if attempted is not None and time.monotonic() - attempted < interval:
+            return False
+        if rollup.built_at is None or rollup.plan_signature != plan.signature:
+            return True
+        return age_seconds(rollup.built_at) >= interval
+
+    async def build(self, rollup_id: int, only_if_due: bool = False) -> Optional[Rollup]:
+        """构建或刷新汇总表；多个worker之间通过锁保证同一汇总表只有一个在构建"""
+        if not analytics_store.available:
+            raise Exception("未安装duckdb，无法构建汇总表")
+        lock_name = f"rollup:{rollup_id}"
+        token = await result_cache.try_lock(lock_name, settings.ROLLUP_BUILD_LOCK_TIMEOUT)
+        if token is None:
+            if only_if_due:
+                return None
+            raise Exception(f"汇总表正在构建: {rollup_id}")
+
+        db = SessionLocal()
+        try:
+            db_rollup = db.query(Rollup).filter(Rollup.id == rollup_id).first()
+            if not db_rollup:
+                raise Exception(f"汇总表不存在: {rollup_id}")
+            plan = extract_service.localize_plan(model_plan_cache.get(db, db_rollup.data_model_id))
+            # 获取锁期间其他worker可能已经完成了刷新
+            if only_if_due and not self._is_due(db_rollup, plan):
+                return db_rollup
+
+            self._attempts[rollup_id] = time.monotonic()
+            db_rollup.status = "building"
+            db.commit()
+
+            start = time.perf_counter()
+            try:
+                self._validate(plan, db_rollup.dimensions, db_rollup.measures)
+                path = db_rollup.storage_path or analytics_store.path("rollups", f"rollup_{rollup_id}.parquet")
+                row_count, column_types = await query_executor.run(plan.data_source, self._build_file, plan, db_rollup, path)
+            except Exception as e:
+                self._stats["build_errors"] += 1
+                # 之前构建的数据仍在有效期内时继续使用
+                db_rollup.status = "failed"
+                db_rollup.last_error = str(e)
+                db.commit()
+                db.refresh(db_rollup)
+                raise Exception(f"构建汇总表失败: {str(e)}")
+
+            self._stats["builds"] += 1
+            self._attempts.pop(rollup_id, None)
+            db_rollup.status = "ready"
+            db_rollup.storage_path = path
+            db_rollup.row_count = row_count
+            db_rollup.column_types = column_types
+            db_rollup.plan_signature = plan.signature
+            db_rollup.build_seconds = round(time.perf_counter() - start, 3)
+            db_rollup.built_at = utcnow()
+            db_rollup.last_error = None
+            db.commit()
+            db.refresh(db_rollup)
+            await invalidation_bus.publish("rollup", db_rollup.data_model_id)
+            return db_rollup
+        finally:
+            db.close()
+            await result_cache.unlock(lock_name, token)
+
+    def _filter_dimensions(self, plan: CompiledModel, filters: Optional[List[Dict[str, Any]]]) -> Optional[List[Tuple[int, Dict[str, Any], str]]]:
+        """把筛选字段对应到模型维度，返回 [(筛选下标, 筛选条件, 维度)]；有筛选字段不是维度时返回None"""
+        matched = []
+        for index, filter_item in enumerate(filters or []):
+            if filter_item.get('operator', '=') not in FILTER_OPERATORS:
+                continue
+            # 按筛选字段所属的数据集和字段定位维度，避免不同表的同名字段（如 product.id 与 region.id）被当作同一维度
+            owner, field = plan._filter_owner(filter_item.get('field', ''))
+            dim = next((name for name in plan.dimension_names
+                        if owner is not None and (plan.dimension_owners[name], plan.dimension_fields[name]) == (owner, field)), None)
+            if dim is None:
+                return None
+            matched.append((index, filter_item, dim))
+        return matched
+
+    def _is_fresh(self, rollup: Rollup, plan: CompiledModel) -> bool:
+        age = age_seconds(rollup.built_at)
+        return (
+            rollup.plan_signature == plan.signature
+            and age is not None
+            and age <= self._refresh_interval(rollup, plan) * settings.ROLLUP_MAX_STALENESS_FACTOR
+        )
+
+    def match(self, pivot: BoundPivot) -> Optional[Rollup]:
+        """查找覆盖透视查询的维度、度量和筛选条件且行数最少的汇总表"""
+        if not settings.ROLLUP_ENABLED or not analytics_store.available or pivot.is_exploratory:
+            return None
+        if pivot.sort_by and pivot.sort_by not in pivot.dimensions + pivot.measures:
+            return None
+        filters = self._filter_dimensions(pivot.plan, pivot.filters)
+        if filters is None:
+            return None
+
+        needed = set(pivot.dimensions) | {dim for _, _, dim in filters}
+        candidates = [
+            rollup for rollup in self._built_rollups(pivot.plan.model_id)
+            if needed <= set(rollup.dimensions) and set(pivot.measures) <= set(rollup.measures)
+            and self._is_fresh(rollup, pivot.plan)
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda rollup: rollup.row_count or 0)
+
+    def rewrite(self, pivot: BoundPivot, rollup: Rollup) -> Tuple[str, Dict[str, Any]]:
+        """生成在汇总表上再次聚合的DuckDB查询，结果列与数据源上的透视查询一致"""
+        plan = pivot.plan
+        dimension_columns, measure_columns = self._layout(plan, rollup.dimensions, rollup.measures)
+
+        select_fields = [
+            f"{quote_identifier(dimension_columns[dim])} AS pivot_{dim.replace('.', '_')}" for dim in pivot.dimensions
+        ]
+        for meas in pivot.measures:
+            parts = [quote_identifier(column) for column, _ in measure_columns[meas]]
+            aggregation = plan.aggregations[meas].upper()
+            if aggregation in SKETCH_AGGREGATIONS:
+                # 草图在进程内合并（见 run）
+                expr = f"LIST({parts[0]})"
+            elif aggregation == "AVG":
+                expr = f"SUM({parts[0]}) / NULLIF(SUM({parts[1]}), 0)"
+            elif aggregation == "COUNT":
+                expr = f"COALESCE(SUM({parts[0]}), 0)"
+            elif aggregation == "SUM":
+                expr = f"SUM({parts[0]})"
+            else:
+                expr = f"{aggregation}({parts[0]})"
+            select_fields.append(f"{expr} AS pivot_{meas.replace('.', '_')}")
+
+        where_conditions = []
+        params = {}
+        for index, filter_item, dim in self._filter_dimensions(plan, pivot.filters):
+            column = quote_identifier(dimension_columns[dim])
+            param = f"filter_{index}"
+            operator = filter_item.get('operator', '=')
+            if operator == 'is null':
+                where_conditions.append(f"{column} IS NULL")
+                continue
+            if operator == 'like':
+                where_conditions.append(f"CAST({column} AS VARCHAR) LIKE ${param}")
+            else:
+                column_type = (rollup.column_types or {}).get(dimension_columns[dim], "VARCHAR")
+                where_conditions.append(f"{column} {operator} TRY_CAST(${param} AS {column_type})")
+            params[param] = pivot.params[param]
+
+        sql_parts = [f"SELECT {', '.join(select_fields)}", f"FROM {parquet_source(rollup.storage_path)}"]
+        if where_conditions:
+            sql_parts.append("WHERE " + " AND ".join(where_conditions))
+        if pivot.dimensions:
+            sql_parts.append("GROUP BY " + ", ".join(quote_identifier(dimension_columns[dim]) for dim in pivot.dimensions))
+        if pivot.sort_by and not self._sketch_positions(pivot):
+            sql_parts.append(f"ORDER BY pivot_{pivot.sort_by.replace('.', '_')} {check_sort_order(pivot.sort_order)}")
+        return " ".join(sql_parts), params
+
+    @staticmethod
+    def _sketch_positions(pivot: BoundPivot) -> List[Tuple[int, str]]:
+        """透视查询中近似度量的结果列下标和度量"""
+        return [(len(pivot.dimensions) + k, meas) for k, meas in enumerate(pivot.measures)
+                if pivot.plan.aggregations[meas].upper() in SKETCH_AGGREGATIONS]
+
+    def _merge_sketches(self, pivot: BoundPivot, rows: List[tuple]) -> List[tuple]:
+        """合并每组的草图（如按天的草图合并为按月）得到估算值，再在进程内排序"""
+        positions = self._sketch_positions(pivot)
+        if not positions:
+            return rows
+        merged = []
+        for row in rows:
+            values = list(row)
+            for index, meas in positions:
+                values[index] = merge_estimate(pivot.plan.aggregations[meas], values[index] or [], pivot.plan.quantiles.get(meas))
+            merged.append(tuple(values))
+        return pivot.sort_rows(merged)
+
+    def _query(self, pivot: BoundPivot, sql: str, params: Dict[str, Any]) -> Tuple[List[str], List[tuple]]:
+        columns, rows = analytics_store.query(sql, params)
+        return columns, self._merge_sketches(pivot, rows)
+
+    async def run(self, pivot: BoundPivot, rollup: Rollup) -> Optional[QueryResult]:
+        """在汇总表上执行透视查询，汇总表文件不可用时返回None，由调用方回退到数据源"""
+        sql, params = self.rewrite(pivot, rollup)
+        try:
+            columns, rows = await query_executor.run(None, self._query, pivot, sql, params)
+        except Exception as e:
+            self._stats["fallbacks"] += 1
+            print(f"汇总表查询失败，回退到数据源: {e}")
+            return None
+        self._stats["rewrites"] += 1
+        return QueryResult(columns, rows, sql=pivot.sql, model_sql=pivot.model_sql, message="透视分析成功")
+
+    def observe(self, pivot: BoundPivot, seconds: float) -> None:
+        """记录在数据源上执行的透视查询粒度，供顾问建议汇总表"""
+        plan = pivot.plan
+        # 抽样查询的耗时不代表该粒度的查询成本
+        if pivot.sample_rate is not None:
+            return
+        if any(plan.aggregations[meas].upper() not in ROLLUP_AGGREGATIONS for meas in pivot.measures):
+            return
+        filters = self._filter_dimensions(plan, pivot.filters)
+        if filters is None:
+            return
+        dimensions = tuple(sorted(set(pivot.dimensions) | {dim for _, _, dim in filters}))
+        key = (plan.model_id, dimensions)
+        with self._lock:
+            observation = self._observations.get(key)
+            if observation is None:
+                if len(self._observations) >= _MAX_OBSERVATIONS:
+                    return
+                observation = self._observations[key] = {"hits": 0, "seconds": 0.0, "measures": set()}
+            observation["hits"] += 1
+            observation["seconds"] += seconds
+            observation["measures"].update(pivot.measures)
+
+    async def advise(self, data_model_id: int) -> List[Dict[str, Any]]:
+        """根据记录的透视查询建议汇总表：现有汇总表无法覆盖、且出现次数达到阈值的粒度，按可节省的耗时排序"""
+        existing = [rollup for rollup in await self.get_by_model(data_model_id) if rollup.is_active]
+        with self._lock:
+            observations = [(dims, dict(obs, measures=set(obs["measures"])))
+                            for (model_id, dims), obs in self._observations.items() if model_id == data_model_id]
+
+        def covers(dimensions, measures, other_dimensions, other_measures) -> bool:
+            return set(other_dimensions) <= set(dimensions) and set(other_measures) <= set(measures)
+
+        advice = []
+        for dims, obs in observations:
+            if any(covers(rollup.dimensions, rollup.measures, dims, obs["measures"]) for rollup in existing):
+                continue
+            # 同一汇总表还能回答维度更少的查询
+            measures = set()
+            hits, seconds = 0, 0.0
+            for other_dims, other in observations:
+                if set(other_dims) <= set(dims):
+                    measures |= other["measures"]
+                    hits += other["hits"]
+                    seconds += other["seconds"]
+            if hits >= settings.ROLLUP_ADVISOR_MIN_HITS:
+                advice.append({"dimensions": list(dims), "measures": sorted(measures), "hits": hits, "total_seconds": round(seconds, 3)})
+        advice.sort(key=lambda item: (item["total_seconds"], item["hits"]), reverse=True)
+        return advice
+
+    async def apply_advice(self, data_model_id: int, limit: int = 1) -> List[Rollup]:
+        """按建议创建汇总表，由调度器在下一轮构建"""
+        created = []
+        for item in (await self.advise(data_model_id))[:limit]:
+            name = f"auto_{'_'.join(item['dimensions']) or 'total'}"
+            rollup = RollupCreate(name=name, dimensions=item["dimensions"], measures=item["measures"])
+            created.append(await self.create(data_model_id, rollup, origin="advisor"))
+        return created
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        """供刷新调度器使用的任务列表：每个启用的汇总表一个任务。
+        due 表示已超过刷新间隔，pending 表示从未构建或模型定义已变化，需要立即构建"""
+        db = SessionLocal()
+        try:
+            jobs = []
+            for rollup in db.query(Rollup).filter(Rollup.is_active == True).all():
+                try:
+                    plan = extract_service.localize_plan(model_plan_cache.get(db, rollup.data_model_id))
+                except Exception:
+                    continue
+                jobs.append({
+                    "id": rollup.id,
+                    "name": rollup.name,
+                    # 模型的数据集都有本地快照时从快照构建，不占用数据源
+                    "source_ids": [plan.data_source.id],
+                    "interval": self._refresh_interval(rollup, plan),
+                    "last_run": rollup.built_at,
+                    "due": self._is_due(rollup, plan),
+                    "pending": rollup.built_at is None or rollup.plan_signature != plan.signature
+                })
+            return jobs
+        finally:
+            db.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats["available"] = analytics_store.available
+        stats["observations"] = len(self._observations)
+        return stats
+
+
+rollup_service = RollupService()
@@ -0,0 +1,244 @@
+import datetime
+import hashlib
+import math
+import struct
+import zlib
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional
+import numpy as np
+from app.core.config import settings
+
+# 近似去重计数（HyperLogLog）、近似分位数（t-digest）
+APPROX_COUNT_DISTINCT = "APPROX_COUNT_DISTINCT"
+APPROX_QUANTILE = "APPROX_QUANTILE"
+SKETCH_AGGREGATIONS = {APPROX_COUNT_DISTINCT, APPROX_QUANTILE}
+
+_HLL_MAGIC = b"H"
+_TDIGEST_MAGIC = b"T"
+
+
+def _hash(value: Any) -> int:
+    """值的64位哈希；数值按值哈希（1、1.0、Decimal('1')相同），保证不同数据源、不同批次构建的草图可以合并"""
+    if isinstance(value, bool):
+        value = int(value)
+    elif isinstance(value, Decimal):
+        value = int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        value = value.isoformat()
+    data = value if isinstance(value, bytes) else str(value).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """HyperLogLog 去重计数草图：2^precision 个寄存器记录哈希值的最大前导零数，
+    合并为逐个寄存器取最大值，与合并前的数据顺序、分区方式无关。标准误差约为 1.04/sqrt(2^precision)"""
+
+    def __init__(self, precision: Optional[int] = None):
+        self.precision = precision or settings.SKETCH_HLL_PRECISION
+        if not 4 <= self.precision <= 16:
+            raise Exception(f"HyperLogLog精度无效: {self.precision}，应为4到16之间的整数")
+        self._size = 1 << self.precision
+        # 构建时大多数分组的值很少，先按 寄存器 -> 值 稀疏保存，超过寄存器数的1/8时转为数组
+        self._sparse: Optional[Dict[int, int]] = {}
+        self._registers: Optional[np.ndarray] = None
+
+    def add(self, value: Any, weight: int = 1) -> None:
+        """加入一个值；重复的值不影响结果，weight 只为与分位数草图的接口一致"""
+        if value is None:
+            return
+        hashed = _hash(value)
+        width = 64 - self.precision
+        index = hashed >> width
+        rank = width - (hashed & ((1 << width) - 1)).bit_length() + 1
+        if self._sparse is not None:
+            if rank > self._sparse.get(index, 0):
+                self._sparse[index] = rank
+                if len(self._sparse) > self._size // 8:
+                    self._densify()
+        elif rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def _densify(self) -> None:
+        registers = np.zeros(self._size, dtype=np.uint8)
+        for index, rank in self._sparse.items():
+            registers[index] = rank
+        self._registers, self._sparse = registers, None
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.precision != self.precision:
+            raise Exception(f"HyperLogLog精度不一致，无法合并: {self.precision}, {other.precision}")
+        if self._sparse is not None:
+            self._densify()
+        if other._sparse is not None:
+            for index, rank in other._sparse.items():
+                if rank > self._registers[index]:
+                    self._registers[index] = rank
+        else:
+            np.maximum(self._registers, other._registers, out=self._registers)
+        return self
+
+    def estimate(self) -> int:
+        if self._sparse is not None:
+            self._densify()
+        size = self._size
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / float(np.sum(np.exp2(-self._registers.astype(np.float64))))
+        zeros = int(np.count_nonzero(self._registers == 0))
+        if estimate <= 2.5 * size and zeros:
+            # 小基数时使用线性计数修正
+            estimate = size * math.log(size / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        if self._sparse is not None:
+            self._densify()
+        return _HLL_MAGIC + bytes([self.precision]) + zlib.compress(self._registers.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        sketch = cls(data[1])
+        sketch._registers = np.frombuffer(zlib.decompress(data[2:]), dtype=np.uint8).copy()
+        sketch._sparse = None
+        return sketch
+
+
+class TDigest:
+    """t-digest 分位数草图：把数据压缩为按均值排序的若干质心，两端的质心更小，因此极端分位数更准确。
+    合并为把质心重新压缩，可以跨分区、跨时间段合并；compression 越大越准确，质心数约为其数倍"""
+
+    def __init__(self, compression: Optional[int] = None):
+        self.compression = compression or settings.SKETCH_TDIGEST_COMPRESSION
+        if not 10 <= self.compression <= 10000:
+            raise Exception(f"t-digest压缩参数无效: {self.compression}，应为10到10000之间的整数")
+        # [[均值, 权重]]，按均值排序
+        self._centroids: List[List[float]] = []
+        self._buffer: List[List[float]] = []
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: Any, weight: int = 1) -> None:
+        """加入一个值，weight 为该值出现的次数（构建时数据源按值预先计数）"""
+        if value is None or not weight:
+            return
+        value = float(value)
+        if math.isnan(value):
+            return
+        self._buffer.append([value, float(weight)])
+        self.total += weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self._buffer) >= self.compression * 10:
+            self._compress()
+
+    def merge(self, other: "TDigest") -> "TDigest":
+        if not other.total:
+            return self
+        self._buffer.extend([mean, weight] for mean, weight in other._centroids + other._buffer)
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if len(self._buffer) >= self.compression * 10:
+            self._compress()
+        return self
+
+    def _scale(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+    def _compress(self) -> None:
+        if not self._buffer:
+            return
+        points = sorted(self._centroids + self._buffer, key=lambda point: point[0])
+        self._buffer = []
+        total = sum(weight for _, weight in points)
+        merged = []
+        mean, weight = points[0]
+        before = 0.0
+        lower = self._scale(0.0)
+        for value, value_weight in points[1:]:
+            # 合并后质心跨越的尺度不超过1时合并到当前质心
+            if self._scale((before + weight + value_weight) / total) - lower <= 1:
+                weight += value_weight
+                mean += (value - mean) * value_weight / weight
+            else:
+                merged.append([mean, weight])
+                before += weight
+                lower = self._scale(before / total)
+                mean, weight = value, value_weight
+        merged.append([mean, weight])
+        self._centroids = merged
+
+    def quantile(self, q: float) -> Optional[float]:
+        """估算分位数，在相邻质心的中心之间线性插值，两端使用最小值、最大值"""
+        self._compress()
+        if not self._centroids:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        target = q * self.total
+        previous_mean, previous_center = self.min, 0.0
+        cumulative = 0.0
+        for mean, weight in self._centroids:
+            center = cumulative + weight / 2
+            if target < center:
+                if center == previous_center:
+                    return mean
+                return previous_mean + (mean - previous_mean) * (target - previous_center) / (center - previous_center)
+            previous_mean, previous_center = mean, center
+            cumulative += weight
+        if self.total == previous_center:
+            return self.max
+        return previous_mean + (self.max - previous_mean) * (target - previous_center) / (self.total - previous_center)
+
+    def to_bytes(self) -> bytes:
+        self._compress()
+        values = [number for centroid in self._centroids for number in centroid]
+        header = struct.pack("<Hddd", self.compression, self.min, self.max, self.total)
+        return _TDIGEST_MAGIC + header + struct.pack(f"<{len(values)}d", *values)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "TDigest":
+        compression, minimum, maximum, total = struct.unpack_from("<Hddd", data, 1)
+        offset = 1 + struct.calcsize("<Hddd")
+        values = struct.unpack_from(f"<{(len(data) - offset) // 8}d", data, offset)
+        sketch = cls(compression)
+        sketch.min, sketch.max, sketch.total = minimum, maximum, total
+        sketch._centroids = [[values[i], values[i + 1]] for i in range(0, len(values), 2)]
+        return sketch
+
+
+def new_sketch(aggregation: str):
+    """聚合方式对应的空草图"""
+    aggregation = aggregation.upper()
+    if aggregation == APPROX_COUNT_DISTINCT:
+        return HyperLogLog()
+    if aggregation == APPROX_QUANTILE:
+        return TDigest()
+    raise Exception(f"聚合方式没有对应的草图: {aggregation}")
+
+
+def load_sketch(data: bytes):
+    if data[:1] == _HLL_MAGIC:
+        return HyperLogLog.from_bytes(data)
+    if data[:1] == _TDIGEST_MAGIC:
+        return TDigest.from_bytes(data)
+    raise Exception("无法识别的草图数据")
+
+
+def merge_estimate(aggregation: str, blobs: Iterable[Optional[bytes]], quantile: Optional[float] = None) -> Any:
+    """合并多个序列化的草图（如按天构建的草图合并为按月）并返回估算值：去重计数或 quantile 分位数"""
+    merged = None
+    for data in blobs:
+        if data is None:
+            continue
+        sketch = load_sketch(bytes(data))
+        merged = sketch if merged is None else merged.merge(sketch)
+    if aggregation.upper() == APPROX_COUNT_DISTINCT:
+        return merged.estimate() if merged is not None else 0
+    if merged is None:
+        return None
+    return merged.quantile(0.5 if quantile is None else quantile)
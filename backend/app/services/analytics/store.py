@@ -0,0 +1,244 @@
+import abc
+import datetime
+import os
+import re
+import shutil
+import tempfile
+import threading
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from app.core.config import settings
+
+try:
+    import duckdb
+except ImportError:  # duckdb 为可选依赖，未安装时不启用本地分析存储（汇总表、数据抽取）
+    duckdb = None
+
+import pandas as pd
+
+# SQLAlchemy 风格的绑定参数（跳过 :: 类型转换）
+_PARAM_PATTERN = re.compile(r"(?<![:\w]):(\w+)")
+
+# 同一列出现不同类型时按以下顺序放宽，无法放宽时使用VARCHAR
+_WIDENING = {
+    ("BOOLEAN", "BIGINT"): "BIGINT",
+    ("BOOLEAN", "DOUBLE"): "DOUBLE",
+    ("BIGINT", "DOUBLE"): "DOUBLE",
+    ("DATE", "TIMESTAMP"): "TIMESTAMP",
+}
+
+
+def _duckdb_type(values: Sequence[Any]) -> Optional[str]:
+    """根据一批值推断列类型，全部为空时返回None"""
+    kinds = {type(value) for value in values if value is not None}
+    if not kinds:
+        return None
+    if kinds <= {bool}:
+        return "BOOLEAN"
+    if kinds <= {int, bool}:
+        return "BIGINT"
+    if kinds <= {int, float, Decimal, bool}:
+        return "DOUBLE"
+    if kinds <= {datetime.date}:
+        return "DATE"
+    if kinds <= {datetime.date, datetime.datetime}:
+        return "TIMESTAMP"
+    if kinds <= {datetime.time}:
+        return "TIME"
+    if kinds <= {bytes}:
+        # 如汇总表中序列化的草图
+        return "BLOB"
+    return "VARCHAR"
+
+
+def _widen(current: Optional[str], incoming: Optional[str]) -> Optional[str]:
+    if current is None or current == incoming:
+        return incoming or current
+    if incoming is None:
+        return current
+    return _WIDENING.get((current, incoming)) or _WIDENING.get((incoming, current)) or "VARCHAR"
+
+
+def _convert(value: Any, column_type: str) -> Any:
+    if value is None:
+        return None
+    if column_type == "DOUBLE" and isinstance(value, Decimal):
+        return float(value)
+    if column_type == "VARCHAR" and not isinstance(value, str):
+        return value.decode("utf-8", errors="replace") if isinstance(value, bytes) else str(value)
+    return value
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def parquet_source(paths) -> str:
+    """读取一个或多个Parquet文件的表达式，多个文件按列名合并"""
+    if isinstance(paths, str):
+        return f"read_parquet({quote_literal(paths)})"
+    return f"read_parquet([{', '.join(quote_literal(path) for path in paths)}], union_by_name = true)"
+
+
+class AnalyticsStore:
+    """本地分析存储：数据以Parquet文件保存，写入临时文件后原子替换，多个worker进程可以同时读取"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._local = threading.local()
+
+    @property
+    def available(self) -> bool:
+        return duckdb is not None
+
+    def path(self, *parts: str) -> str:
+        path = os.path.join(self.root, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _connection(self):
+        # 每个线程使用独立的内存连接，只用于读取Parquet文件
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = duckdb.connect()
+            self._local.con = con
+        return con
+
+    def _prepare(self, sql: str, tables: Optional[Dict[str, str]]):
+        """把Parquet文件注册为临时视图，并把 :name 形式的绑定参数转换为DuckDB的 $name 形式"""
+        if duckdb is None:
+            raise Exception("未安装duckdb，本地分析存储不可用")
+        con = self._connection()
+        for name, paths in (tables or {}).items():
+            con.execute(f"CREATE OR REPLACE TEMP VIEW {quote_identifier(name)} AS SELECT * FROM {parquet_source(paths)}")
+        return con, _PARAM_PATTERN.sub(r"$\1", sql)
+
+    def query(self, sql: str, params: Optional[Dict[str, Any]] = None,
+              tables: Optional[Dict[str, str]] = None) -> Tuple[List[str], List[tuple]]:
+        """执行查询，返回列名和结果行；tables 为查询中使用的视图名到Parquet文件（或文件列表）的映射"""
+        con, sql = self._prepare(sql, tables)
+        con.execute(sql, params or {})
+        columns = [d[0] for d in con.description]
+        return columns, con.fetchall()
+
+    def stream(self, sql: str, params: Optional[Dict[str, Any]], tables: Optional[Dict[str, str]], batch_size: int):
+        """流式查询：先产出列名，再逐批产出结果行"""
+        con, sql = self._prepare(sql, tables)
+        con.execute(sql, params or {})
+        yield [d[0] for d in con.description]
+        while True:
+            rows = con.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+    def copy_query(self, sql: str, path: str, tables: Optional[Dict[str, Any]] = None) -> int:
+        """把DuckDB查询结果写入Parquet文件，完成后原子替换目标文件，返回行数"""
+        con, sql = self._prepare(sql, tables)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            con.execute(f"COPY ({sql}) TO {quote_literal(tmp_path)} (FORMAT PARQUET)")
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return self.query(f"SELECT COUNT(*) FROM {parquet_source(path)}")[1][0][0]
+
+    def write_parquet(
+        self,
+        path: str,
+        columns: List[str],
+        batches: Iterable[Sequence[Sequence[Any]]],
+        column_types: Optional[Dict[str, str]] = None
+    ) -> Tuple[int, Dict[str, str]]:
+        """将分批产出的数据写入Parquet文件，完成后原子替换目标文件，返回行数和列类型。
+        数据先写入磁盘上的临时DuckDB数据库，内存占用与数据量无关；column_types 为已知的列类型（如已有快照的类型）"""
+        if duckdb is None:
+            raise Exception("未安装duckdb，本地分析存储不可用")
+
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, db_path = tempfile.mkstemp(suffix=".duckdb", dir=directory)
+        os.close(fd)
+        os.remove(db_path)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        con = duckdb.connect(db_path)
+        try:
+            table = "staging"
+            # 列类型随数据放宽，全部为空的列暂不确定类型（建表时使用VARCHAR）
+            known = column_types or {}
+            column_types: Dict[str, Optional[str]] = {name: known.get(name) for name in columns}
+            definitions = ", ".join(f"{quote_identifier(name)} {column_types[name] or 'VARCHAR'}" for name in columns)
+            con.execute(f"CREATE TABLE {table} ({definitions})")
+
+            for rows in batches:
+                if not rows:
+                    continue
+                for i, name in enumerate(columns):
+                    widened = _widen(column_types[name], _duckdb_type([row[i] for row in rows]))
+                    if widened is not None and widened != (column_types[name] or "VARCHAR"):
+                        con.execute(f"ALTER TABLE {table} ALTER {quote_identifier(name)} TYPE {widened}")
+                    column_types[name] = widened
+                self._append(con, table, columns, column_types, rows)
+
+            column_types = {name: column_type or "VARCHAR" for name, column_type in column_types.items()}
+            row_count = con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            con.execute(f"COPY {table} TO {quote_literal(tmp_path)} (FORMAT PARQUET)")
+            os.replace(tmp_path, path)
+            return row_count, column_types
+        finally:
+            con.close()
+            for leftover in (db_path, db_path + ".wal", tmp_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+    def _append(self, con, table: str, columns: List[str], column_types: Dict[str, Optional[str]], rows) -> None:
+        # 整批注册为DataFrame后一次插入，避免逐行执行
+        converted = [[_convert(value, column_types[name] or "VARCHAR") for name, value in zip(columns, row)] for row in rows]
+        frame = pd.DataFrame(converted, columns=[f"c{i}" for i in range(len(columns))], dtype=object)
+        casts = ", ".join(f"CAST(c{i} AS {column_types[name] or 'VARCHAR'})" for i, name in enumerate(columns))
+        con.register("incoming_batch", frame)
+        try:
+            con.execute(f"INSERT INTO {table} SELECT {casts} FROM incoming_batch")
+        finally:
+            con.unregister("incoming_batch")
+
+    def directory(self, *parts: str) -> str:
+        path = os.path.join(self.root, *parts)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def remove(self, path: str) -> None:
+        if os.path.exists(path):
+            os.remove(path)
+
+    def remove_directory(self, path: str) -> None:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class LocalSource(abc.ABC):
+    """在本地分析存储上执行查询的目标（数据集快照、Excel缓存）：提供与数据源一致的
+    id、db_type、connection_pool、refresh_interval，查询不访问数据源"""
+
+    db_type = "duckdb"
+
+    @abc.abstractmethod
+    def table_for(self, data_set_id: Any) -> str:
+        """数据集在本地分析存储中的视图名"""
+
+    @abc.abstractmethod
+    def resolve_tables(self) -> Dict[str, Any]:
+        """查询中使用的视图名到Parquet文件（或文件列表）的映射，在执行器线程中调用"""
+
+    def execute(self, sql: str, params: Optional[Dict[str, Any]] = None) -> Tuple[List[str], List[tuple]]:
+        return analytics_store.query(sql, params, self.resolve_tables())
+
+    def stream(self, sql: str, params: Optional[Dict[str, Any]], batch_size: int):
+        return analytics_store.stream(sql, params, self.resolve_tables(), batch_size)
+
+
+analytics_store = AnalyticsStore(settings.ANALYTICS_STORE_DIR)
@@ -0,0 +1,2 @@
+from app.services.cache.result_cache import result_cache, CachedResult
+from app.services.cache.invalidation import invalidation_bus
@@ -0,0 +1,96 @@
+import asyncio
+import inspect
+import json
+import uuid
+from typing import Any, Callable, List, Optional
+import redis.asyncio as redis
+from app.core.config import settings
+from app.services.cache.result_cache import result_cache
+
+
+class InvalidationBus:
+    """缓存失效消息总线：本进程立即失效，并通过Redis发布订阅通知其他worker"""
+
+    def __init__(self):
+        # 当前进程标识，用于忽略自己发布的消息
+        self.origin = uuid.uuid4().hex
+        self._listeners: List[Callable[[str, Any], Any]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._client: Optional[redis.Redis] = None
+
+    def subscribe(self, listener: Callable[[str, Any], Any]) -> None:
+        """注册失效监听函数，参数为对象类型(source, data_set, model)和对象ID；类型为 * 时表示全部失效"""
+        self._listeners.append(listener)
+
+    async def _dispatch(self, kind: str, object_id: Any) -> None:
+        for listener in self._listeners:
+            try:
+                result = listener(kind, object_id)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"缓存失效处理失败: {e}")
+
+    async def publish(self, kind: str, object_id: Any) -> None:
+        """发布失效消息：清理本进程和共享的结果缓存，通知本进程和其他worker的监听函数"""
+        await result_cache.invalidate(kind, object_id)
+        await self._dispatch(kind, object_id)
+        try:
+            if self._client is None:
+                self._client = redis.from_url(
+                    settings.REDIS_URL,
+                    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                    socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT
+                )
+            message = json.dumps({"origin": self.origin, "kind": kind, "id": object_id})
+            await self._client.publish(settings.CACHE_INVALIDATION_CHANNEL, message)
+        except Exception as e:
+            print(f"发布缓存失效消息失败: {e}")
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                # 订阅连接需要长时间阻塞读取，不设置读超时
+                client = redis.from_url(settings.REDIS_URL, socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT)
+                pubsub = client.pubsub()
+                await pubsub.subscribe(settings.CACHE_INVALIDATION_CHANNEL)
+                # 断线期间可能错过失效消息，重新订阅后清空进程内缓存
+                result_cache.local.clear()
+                await self._dispatch("*", None)
+                try:
+                    while True:
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                        if not message:
+                            continue
+                        payload = json.loads(message["data"])
+                        if payload.get("origin") == self.origin:
+                            continue
+                        # 共享缓存已由发布方清理，这里只处理本进程内的缓存
+                        result_cache.invalidate_local(payload["kind"], payload["id"])
+                        await self._dispatch(payload["kind"], payload["id"])
+                finally:
+                    await pubsub.close()
+                    await client.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"缓存失效订阅中断，稍后重试: {e}")
+                await asyncio.sleep(settings.RESULT_CACHE_RETRY_INTERVAL)
+
+    def start(self) -> None:
+        """启动订阅任务"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        """停止订阅任务"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+invalidation_bus = InvalidationBus()
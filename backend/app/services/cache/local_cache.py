@@ -0,0 +1,82 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+
+class LocalResultCache:
+    """进程内结果缓存，按字节数限制容量，使用LRU淘汰"""
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        # 缓存键 -> (列式二进制数据, 过期时间, 标签)
+        self._entries: "OrderedDict[str, Tuple[bytes, float, Tuple[Tuple[str, Any], ...]]]" = OrderedDict()
+        self._tags: Dict[Tuple[str, Any], Set[str]] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if entry[1] <= time.monotonic():
+                self._remove(key)
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def set(self, key: str, blob: bytes, ttl: float, tags: Iterable[Tuple[str, Any]] = ()) -> None:
+        if ttl <= 0 or len(blob) > self.max_entry_bytes:
+            return
+        tags = tuple(tags)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (blob, time.monotonic() + ttl, tags)
+            self._size += len(blob)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            # 超出容量时从最久未使用的条目开始淘汰
+            while self._size > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+
+    def _remove(self, key: str) -> None:
+        blob, _, tags = self._entries.pop(key)
+        self._size -= len(blob)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, kind: str, object_id: Any) -> None:
+        """删除带有指定标签的条目"""
+        with self._lock:
+            self._stats["invalidations"] += 1
+            for key in list(self._tags.get((kind, object_id), ())):
+                if key in self._entries:
+                    self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._size = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["size_bytes"] = self._size
+            stats["max_bytes"] = self.max_bytes
+        return stats
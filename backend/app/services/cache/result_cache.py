@@ -0,0 +1,275 @@
+import asyncio
+import hashlib
+import json
+import re
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+import redis.asyncio as redis
+from app.core.config import settings
+from app.services.cache.serialization import encode_result, decode_result
+from app.services.cache.local_cache import LocalResultCache
+
+# 加载函数返回值：列名、结果行、附加信息（如分页总数）
+CachedResult = Tuple[List[str], List[tuple], Dict[str, Any]]
+
+# 释放分布式锁时校验持有者，避免误删其他进程重新获取的锁
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def normalize_sql(sql: str) -> str:
+    """归一化SQL文本：合并空白字符，去掉首尾空白和末尾分号"""
+    return re.sub(r"\s+", " ", sql).strip().rstrip(";").strip()
+
+
+class ResultCache:
+    """两级查询结果缓存：进程内L1缓存 + Redis共享缓存，支持单飞加载、标签失效和命中统计"""
+
+    def __init__(self):
+        self._client: Optional[redis.Redis] = None
+        self.local = LocalResultCache(settings.RESULT_CACHE_L1_MAX_BYTES, settings.RESULT_CACHE_L1_MAX_ENTRY_BYTES)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Redis不可用时暂停访问的截止时间，避免每个请求都等待连接超时
+        self._disabled_until = 0.0
+        self._stats = {"hits": 0, "misses": 0, "loads": 0, "coalesced": 0, "errors": 0, "invalidations": 0, "stale": 0}
+
+    def _redis(self) -> Optional[redis.Redis]:
+        if not settings.RESULT_CACHE_ENABLED or time.monotonic() < self._disabled_until:
+            return None
+        if self._client is None:
+            self._client = redis.from_url(
+                settings.REDIS_URL,
+                socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT
+            )
+        return self._client
+
+    def _on_error(self, e: Exception) -> None:
+        self._stats["errors"] += 1
+        now = time.monotonic()
+        if now >= self._disabled_until:
+            print(f"结果缓存不可用: {e}")
+        self._disabled_until = now + settings.RESULT_CACHE_RETRY_INTERVAL
+
+    def _key(self, name: str) -> str:
+        return f"{settings.RESULT_CACHE_PREFIX}:{name}"
+
+    def _tag_key(self, kind: str, object_id: Any) -> str:
+        return self._key(f"tag:{kind}:{object_id}")
+
+    def build_key(self, source_id: Any, sql: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """根据数据源和归一化后的SQL生成缓存键"""
+        raw = json.dumps(
+            {"source": source_id, "sql": normalize_sql(sql), "params": params or {}},
+            sort_keys=True, default=str, ensure_ascii=False
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str, tags: Iterable[Tuple[str, Any]] = ()) -> Optional[CachedResult]:
+        if not settings.RESULT_CACHE_ENABLED:
+            return None
+        # 优先读取进程内缓存，命中时无需访问网络
+        blob = self.local.get(key)
+        if blob is not None:
+            return decode_result(blob)
+
+        client = self._redis()
+        if client is None:
+            return None
+        try:
+            pipe = client.pipeline(transaction=False)
+            pipe.get(self._key(f"result:{key}"))
+            pipe.pttl(self._key(f"result:{key}"))
+            blob, pttl = await pipe.execute()
+        except Exception as e:
+            self._on_error(e)
+            return None
+        if not blob:
+            return None
+        # 共享缓存在有效期之后继续保留一段时间，这段时间内的结果只在数据源不可用时使用
+        if pttl and pttl > 0:
+            pttl -= settings.RESULT_CACHE_STALE_TTL * 1000
+            if pttl <= 0:
+                return None
+            # 回填进程内缓存，有效期与共享缓存剩余时间一致
+            self.local.set(key, blob, pttl / 1000.0, tags)
+        return decode_result(blob)
+
+    async def get_stale(self, key: str) -> Optional[CachedResult]:
+        """读取共享缓存中的结果，包括已过期但仍在保留期内的结果"""
+        client = self._redis()
+        if client is None:
+            return None
+        try:
+            blob = await client.get(self._key(f"result:{key}"))
+        except Exception as e:
+            self._on_error(e)
+            return None
+        return decode_result(blob) if blob else None
+
+    async def set(self, key: str, result: CachedResult, ttl: int, tags: Iterable[Tuple[str, Any]] = ()) -> None:
+        if ttl <= 0 or not settings.RESULT_CACHE_ENABLED:
+            return
+        client = self._redis()
+        columns, rows, extra = result
+        blob = encode_result(columns, rows, extra)
+        tags = list(tags)
+        self.local.set(key, blob, ttl, tags)
+        if client is None or len(blob) > settings.RESULT_CACHE_MAX_ENTRY_BYTES:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            pipe.set(self._key(f"result:{key}"), blob, ex=ttl + settings.RESULT_CACHE_STALE_TTL)
+            # 记录标签到缓存键的映射，用于数据集、模型、数据源更新时批量失效
+            for kind, object_id in tags:
+                tag_key = self._tag_key(kind, object_id)
+                pipe.sadd(tag_key, key)
+                pipe.expire(tag_key, max(ttl + settings.RESULT_CACHE_STALE_TTL, settings.DEFAULT_REFRESH_INTERVAL) * 2)
+            await pipe.execute()
+        except Exception as e:
+            self._on_error(e)
+
+    async def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[CachedResult]],
+        ttl: int,
+        tags: Iterable[Tuple[str, Any]] = (),
+        refresh: bool = False
+    ) -> CachedResult:
+        """读取缓存，未命中时加载；同一个键同时只有一个加载任务访问数据源，加载失败时返回保留期内的过期结果。
+        refresh 为True时跳过缓存重新加载并覆盖原缓存（用于后台预热，加载失败时直接抛出异常）"""
+        tags = list(tags)
+        if not refresh:
+            cached = await self.get(key, tags)
+            if cached is not None:
+                self._stats["hits"] += 1
+                return cached
+            self._stats["misses"] += 1
+
+        # 进程内单飞：同一个键的并发请求等待同一个加载任务
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._stats["coalesced"] += 1
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            try:
+                result = await self._load_with_lock(key, loader, ttl, tags)
+            except Exception:
+                stale = None if refresh else await self.get_stale(key)
+                if stale is None:
+                    raise
+                self._stats["stale"] += 1
+                result = stale
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时取出异常，避免未处理异常的警告
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+            if not future.done():
+                # 加载任务被取消（如客户端断开）时通知等待者，不让它们一直等待
+                future.set_exception(Exception("查询已取消，请重试"))
+                future.exception()
+
+    async def try_lock(self, name: str, timeout: int) -> Optional[str]:
+        """获取跨进程互斥锁，成功时返回锁标识，已被其他进程持有时返回None；Redis不可用时视为获取成功"""
+        token = uuid.uuid4().hex
+        client = self._redis()
+        if client is None:
+            return token
+        try:
+            acquired = await client.set(self._key(f"lock:{name}"), token, nx=True, px=timeout * 1000)
+            return token if acquired else None
+        except Exception as e:
+            self._on_error(e)
+            return token
+
+    async def is_locked(self, name: str) -> bool:
+        """try_lock 获取的锁是否仍被持有；Redis不可用时返回False"""
+        client = self._redis()
+        if client is None:
+            return False
+        try:
+            return bool(await client.exists(self._key(f"lock:{name}")))
+        except Exception as e:
+            self._on_error(e)
+            return False
+
+    async def unlock(self, name: str, token: str) -> None:
+        """释放 try_lock 获取的锁"""
+        client = self._redis()
+        if client is None:
+            return
+        try:
+            await client.eval(_RELEASE_LOCK_SCRIPT, 1, self._key(f"lock:{name}"), token)
+        except Exception as e:
+            self._on_error(e)
+
+    async def _load_with_lock(self, key: str, loader, ttl: int, tags: List[Tuple[str, Any]]) -> CachedResult:
+        # 跨进程单飞：通过Redis锁保证多个worker中只有一个执行查询，其他worker等待结果写入
+        token = await self.try_lock(key, settings.RESULT_CACHE_LOCK_TIMEOUT)
+        if token is None:
+            deadline = time.monotonic() + settings.RESULT_CACHE_LOCK_TIMEOUT
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+                # 先检查锁再读取结果：持有者写入结果后才释放锁，锁已释放而仍没有结果说明
+                # 持有者加载失败或结果没有写入共享缓存（超过大小上限、不缓存），不再等待而是自行加载
+                locked = await self.is_locked(key)
+                cached = await self.get(key, tags)
+                if cached is not None:
+                    self._stats["coalesced"] += 1
+                    return cached
+                if not locked or self._redis() is None:
+                    break
+
+        try:
+            self._stats["loads"] += 1
+            result = await loader()
+            await self.set(key, result, ttl, tags)
+            return result
+        finally:
+            if token is not None:
+                await self.unlock(key, token)
+
+    def invalidate_local(self, kind: str, object_id: Any) -> None:
+        """使进程内缓存中相关的条目失效"""
+        self.local.invalidate(kind, object_id)
+
+    async def invalidate(self, kind: str, object_id: Any) -> None:
+        """使某个数据源、数据集或数据模型相关的缓存失效（包括进程内缓存和共享缓存）"""
+        self._stats["invalidations"] += 1
+        self.invalidate_local(kind, object_id)
+        client = self._redis()
+        if client is None:
+            return
+        try:
+            tag_key = self._tag_key(kind, object_id)
+            keys = await client.smembers(tag_key)
+            result_keys = [self._key(f"result:{k.decode() if isinstance(k, bytes) else k}") for k in keys]
+            await client.delete(tag_key, *result_keys)
+        except Exception as e:
+            self._on_error(e)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存命中统计"""
+        stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["available"] = settings.RESULT_CACHE_ENABLED and time.monotonic() >= self._disabled_until
+        stats["local"] = self.local.get_stats()
+        return stats
+
+
+result_cache = ResultCache()
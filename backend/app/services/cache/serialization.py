@@ -0,0 +1,86 @@
+import base64
+import datetime
+import json
+import zlib
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# 序列化格式版本，格式变化时递增，旧版本的缓存数据直接视为未命中
+FORMAT_VERSION = 1
+
+# 列类型编码：JSON原生类型之外的值按列统一编码，避免逐值携带类型标记
+_ENCODERS = {
+    "d": (Decimal, str),
+    "t": (datetime.datetime, lambda v: v.isoformat()),
+    "D": (datetime.date, lambda v: v.isoformat()),
+    "T": (datetime.time, lambda v: v.isoformat()),
+    "b": (bytes, lambda v: base64.b64encode(v).decode("ascii")),
+}
+
+_DECODERS = {
+    "d": Decimal,
+    "t": datetime.datetime.fromisoformat,
+    "D": datetime.date.fromisoformat,
+    "T": datetime.time.fromisoformat,
+    "b": base64.b64decode,
+}
+
+
+def _column_type(values: Sequence[Any]) -> str:
+    """推断列的编码类型，所有非空值类型一致时按列编码，否则按JSON处理"""
+    column_type = None
+    for value in values:
+        if value is None:
+            continue
+        value_type = "j"
+        # datetime 是 date 的子类，需要先判断 datetime
+        for code, (python_type, _) in _ENCODERS.items():
+            if type(value) is python_type:
+                value_type = code
+                break
+        if column_type is None:
+            column_type = value_type
+        elif column_type != value_type:
+            return "j"
+    return column_type or "j"
+
+
+def encode_result(columns: Sequence[str], rows: Sequence[Sequence[Any]], extra: Optional[Dict[str, Any]] = None) -> bytes:
+    """将查询结果编码为压缩的列式二进制数据"""
+    column_values = [list(values) for values in zip(*rows)] if rows else [[] for _ in columns]
+    types = []
+    for index, values in enumerate(column_values):
+        column_type = _column_type(values)
+        types.append(column_type)
+        if column_type != "j":
+            encode = _ENCODERS[column_type][1]
+            column_values[index] = [encode(v) if v is not None else None for v in values]
+
+    payload = {
+        "columns": list(columns),
+        "types": types,
+        "values": column_values,
+        "row_count": len(rows),
+        "extra": extra or {}
+    }
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    return bytes([FORMAT_VERSION]) + zlib.compress(body, 6)
+
+
+def decode_result(blob: bytes) -> Optional[Tuple[List[str], List[tuple], Dict[str, Any]]]:
+    """解码列式二进制数据，返回列名、结果行和附加信息；格式不兼容时返回None"""
+    if not blob or blob[0] != FORMAT_VERSION:
+        return None
+
+    payload = json.loads(zlib.decompress(blob[1:]).decode("utf-8"))
+    column_values = payload["values"]
+    for index, column_type in enumerate(payload["types"]):
+        if column_type != "j":
+            decode = _DECODERS[column_type]
+            column_values[index] = [decode(v) if v is not None else None for v in column_values[index]]
+
+    if column_values:
+        rows = list(zip(*column_values))
+    else:
+        rows = [()] * payload["row_count"]
+    return payload["columns"], rows, payload.get("extra") or {}
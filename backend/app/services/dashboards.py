@@ -1,8 +1,11 @@
-from typing import List, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 from sqlalchemy.orm import Session
 from app.models.dashboards import Chart, Dashboard
 from app.schemas.dashboards import ChartCreate, ChartUpdate, DashboardCreate, DashboardUpdate
 from app.core.database import SessionLocal
+from app.services.query import BoundPivot, model_plan_cache
+from app.services.visualization import visualization_service
+from app.services.analytics.freshness import utcnow, age_seconds
 
 class ChartService:
     def __init__(self):
@@ -83,7 +86,8 @@ class ChartService:
 
 class DashboardService:
     def __init__(self):
-        pass
+        # 仪表盘ID -> 最后访问时间（进程内）
+        self._views: Dict[int, Any] = {}
 
     async def create(self, dashboard: DashboardCreate) -> Dashboard:
         db = SessionLocal()
@@ -175,8 +179,92 @@ class DashboardService:
 
             db.delete(db_dashboard)
             db.commit()
+            self._views.pop(dashboard_id, None)
         finally:
             db.close()
 
+    def _chart_fields(self, configs) -> List[str]:
+        # 图表的维度/度量配置与前端一致，取配置中的名称
+        return [config.get('name') or config.get('field') if isinstance(config, dict) else str(config) for config in configs or []]
+
+    def _bind_widgets(self, dashboard_id: int) -> Tuple[List[BoundPivot], List[Tuple[Any, int]], List[Dict[str, Any]]]:
+        """解析仪表盘全部组件的查询，返回绑定的透视查询、对应的 (组件ID, 图表ID) 和解析失败的组件"""
+        db = SessionLocal()
+        try:
+            dashboard = db.query(Dashboard).filter(Dashboard.id == dashboard_id).first()
+            if not dashboard:
+                raise Exception(f"仪表盘不存在: {dashboard_id}")
+
+            widgets = [widget for widget in dashboard.widgets or []
+                       if widget.get('type') == 'chart' and widget.get('chart_id')]
+            chart_ids = {widget['chart_id'] for widget in widgets}
+            charts = {chart.id: chart for chart in db.query(Chart).filter(Chart.id.in_(chart_ids)).all()} if chart_ids else {}
+
+            # 解析每个组件的查询
+            pivots: List[BoundPivot] = []
+            pivot_widgets: List[Tuple[Any, int]] = []
+            failed: List[Dict[str, Any]] = []
+            plans = {}
+            for widget in widgets:
+                chart = charts.get(widget['chart_id'])
+                try:
+                    if not chart:
+                        raise Exception(f"图表不存在: {widget['chart_id']}")
+                    if chart.data_model_id not in plans:
+                        plans[chart.data_model_id] = model_plan_cache.get(db, chart.data_model_id)
+                    options = chart.query_options or {}
+                    pivots.append(BoundPivot(
+                        plans[chart.data_model_id],
+                        self._chart_fields(chart.dimensions), self._chart_fields(chart.measures), chart.filters,
+                        top_n=options.get('top_n'), top_n_by=options.get('top_n_by'), sample_rate=options.get('sample_rate')
+                    ))
+                    pivot_widgets.append((widget.get('id'), chart.id))
+                except Exception as e:
+                    failed.append({"widget_id": widget.get('id'), "chart_id": widget['chart_id'], "success": False, "message": str(e)})
+        finally:
+            db.close()
+        return pivots, pivot_widgets, failed
+
+    async def render(self, dashboard_id: int) -> AsyncIterator[Dict[str, Any]]:
+        """渲染仪表盘：一次性解析全部组件，合并相同的查询，按数据源限制并发执行，每个组件完成后立即返回结果"""
+        pivots, pivot_widgets, failed = self._bind_widgets(dashboard_id)
+        # 记录访问时间，后台调度器优先预热最近访问过的仪表盘
+        self._views[dashboard_id] = utcnow()
+        return self._render_widgets(pivots, pivot_widgets, failed)
+
+    async def warm(self, dashboard_id: int) -> Dict[str, int]:
+        """预热仪表盘：跳过结果缓存重新执行全部组件的查询并写入缓存，返回成功和失败的组件数"""
+        pivots, _, failed = self._bind_widgets(dashboard_id)
+        counts = {"succeeded": 0, "failed": len(failed)}
+        async for _, _, error in visualization_service.run_pivots(pivots, refresh=True):
+            counts["failed" if error is not None else "succeeded"] += 1
+        return counts
+
+    def recent_views(self, window: int) -> Dict[int, Any]:
+        """返回最近 window 秒内访问过的仪表盘及最后访问时间"""
+        return {dashboard_id: viewed_at for dashboard_id, viewed_at in list(self._views.items())
+                if age_seconds(viewed_at) <= window}
+
+    async def _render_widgets(self, pivots, pivot_widgets, failed) -> AsyncIterator[Dict[str, Any]]:
+        for item in failed:
+            yield item
+
+        # 相同的查询只执行一次，可以融合的查询合并为一次扫描，按数据源限制并发
+        async for index, result, error in visualization_service.run_pivots(pivots):
+            widget_id, chart_id = pivot_widgets[index]
+            if error is not None:
+                yield {"widget_id": widget_id, "chart_id": chart_id, "success": False, "message": str(error)}
+                continue
+            yield {
+                "widget_id": widget_id,
+                "chart_id": chart_id,
+                "success": True,
+                "data": result.records(),
+                "columns": result.columns,
+                "sql": result.sql,
+                "model_sql": result.model_sql,
+                "message": result.message
+            }
+
 chart_service = ChartService()
 dashboard_service = DashboardService()
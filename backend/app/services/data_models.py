@@ -3,6 +3,8 @@ from sqlalchemy.orm import Session
 from app.models.data_models import DataSet, DataModel
 from app.schemas.data_models import DataSetCreate, DataSetUpdate, DataModelCreate, DataModelUpdate
 from app.core.database import SessionLocal
+from app.services.cache import invalidation_bus
+from app.services.analytics import rollup_service, extract_service
 
 class DataSetService:
     def __init__(self):
@@ -65,6 +67,9 @@ class DataSetService:
 
             db.commit()
             db.refresh(db_data_set)
+
+            # 数据集变化后，依赖该数据集的查询结果缓存失效
+            await invalidation_bus.publish("data_set", data_set_id)
             return db_data_set
         finally:
             db.close()
@@ -76,8 +81,11 @@ class DataSetService:
             if not db_data_set:
                 raise Exception(f"数据集不存在: {data_set_id}")
 
+            # 先删除数据集的本地快照
+            extract_service.delete_for_data_set(db, data_set_id)
             db.delete(db_data_set)
             db.commit()
+            await invalidation_bus.publish("data_set", data_set_id)
         finally:
             db.close()
 
@@ -142,6 +150,9 @@ class DataModelService:
 
             db.commit()
             db.refresh(db_data_model)
+
+            # 数据模型变化后，基于该模型的透视分析缓存失效
+            await invalidation_bus.publish("model", data_model_id)
             return db_data_model
         finally:
             db.close()
@@ -153,8 +164,11 @@ class DataModelService:
             if not db_data_model:
                 raise Exception(f"数据模型不存在: {data_model_id}")
 
+            # 先删除模型上的汇总表
+            rollup_service.delete_for_model(db, data_model_id)
             db.delete(db_data_model)
             db.commit()
+            await invalidation_bus.publish("model", data_model_id)
         finally:
             db.close()
 
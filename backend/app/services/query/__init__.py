@@ -0,0 +1,16 @@
+from app.services.query.pagination import SelectQuery, TOTAL_COUNT_COLUMN, encode_cursor, decode_cursor, split_page_columns
+from app.services.query.model_plan import CompiledModel, ModelPlanCache, model_plan_cache
+from app.services.query.fusion import BoundPivot, FusedQuery, plan_fusion
+from app.services.query.drill import DrillCache, drill_cache
+from app.services.cache import invalidation_bus
+
+# 模型、数据集、数据源变化时移除相关的编译结果
+invalidation_bus.subscribe(model_plan_cache.invalidate)
+invalidation_bus.subscribe(drill_cache.invalidate)
+
+__all__ = [
+    "SelectQuery", "TOTAL_COUNT_COLUMN", "encode_cursor", "decode_cursor", "split_page_columns",
+    "CompiledModel", "ModelPlanCache", "model_plan_cache",
+    "BoundPivot", "FusedQuery", "plan_fusion",
+    "DrillCache", "drill_cache"
+]
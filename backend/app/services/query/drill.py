@@ -0,0 +1,153 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+from app.core.config import settings
+from app.services.query.model_plan import CompiledModel
+
+# 可以由更细层级的结果在进程内再次聚合的聚合方式 -> 再次聚合方式
+_REAGGREGATIONS = {"SUM": "SUM", "COUNT": "SUM", "MIN": "MIN", "MAX": "MAX"}
+
+
+def _same(value: Any, member: Any) -> bool:
+    # 路径中的成员来自JSON，与数据库返回的值（如整数、日期）按字符串比较
+    return value == member or (value is not None and member is not None and str(value) == str(member))
+
+
+class DrillCache:
+    """层次下钻的结果缓存。每次下钻取回的是点击成员及其兄弟成员的下一层（缓存项的限定路径为点击成员的上级路径），
+    之后点击兄弟成员、返回上层时从缓存项中筛选；缓存项的层级比请求更细时在进程内再次聚合，不再访问数据源"""
+
+    def __init__(self):
+        # (模型ID, 模型定义版本, 层次结构, 度量, 筛选条件) -> [缓存项]，按最近使用排序
+        self._entries: "OrderedDict[tuple, List[Dict[str, Any]]]" = OrderedDict()
+        self._rows = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "reaggregations": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def key(plan: CompiledModel, hierarchy: str, measures: List[str], filters: Optional[List[Dict[str, Any]]]) -> tuple:
+        filters = json.dumps(filters or [], sort_keys=True, ensure_ascii=False, default=str)
+        return plan.model_id, plan.signature, hierarchy, tuple(measures), filters
+
+    @staticmethod
+    def _usable(entry: Dict[str, Any], plan: CompiledModel, measures: Sequence[str], depth: int, path: Sequence[Any]) -> bool:
+        """缓存项能否回答：层级不粗于请求、限定路径是请求路径的前缀，需要再次聚合时度量都可以再次聚合"""
+        restriction = entry["restriction"]
+        if entry["expires"] < time.monotonic() or entry["depth"] < depth or len(restriction) > len(path):
+            return False
+        if not all(_same(value, member) for value, member in zip(restriction, path)):
+            return False
+        return entry["depth"] == depth or all(plan.aggregations[meas].upper() in _REAGGREGATIONS for meas in measures)
+
+    def _candidates(self, key: tuple, plan: CompiledModel, depth: int, path: Sequence[Any]) -> List[Dict[str, Any]]:
+        return [entry for entry in self._entries.get(key) or [] if self._usable(entry, plan, key[3], depth, path)]
+
+    def covers(self, key: tuple, plan: CompiledModel, depth: int, path: Sequence[Any]) -> bool:
+        """是否已缓存能回答该层级的结果，用于决定是否需要预取"""
+        with self._lock:
+            return bool(self._candidates(key, plan, depth, path))
+
+    def lookup(self, key: tuple, plan: CompiledModel, depth: int, path: Sequence[Any]) -> Optional[List[tuple]]:
+        """返回层级 depth（前 depth 个层级为维度）在路径 path 下的结果行，没有可用的缓存项时返回None"""
+        with self._lock:
+            candidates = self._candidates(key, plan, depth, path)
+            if not candidates:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            entry = min(candidates, key=lambda entry: len(entry["rows"]))
+            self._stats["hits"] += 1
+            if entry["depth"] > depth:
+                self._stats["reaggregations"] += 1
+
+        rows = self.restrict(entry["rows"], len(entry["restriction"]), path)
+        if entry["depth"] > depth:
+            rows = self._reaggregate(plan, key[3], depth, rows)
+        return rows
+
+    @staticmethod
+    def restrict(rows: List[tuple], start: int, path: Sequence[Any]) -> List[tuple]:
+        """筛选从第 start 个层级起与路径 path 一致的行"""
+        return [row for row in rows if all(_same(row[i], path[i]) for i in range(start, len(path)))]
+
+    @staticmethod
+    def _reaggregate(plan: CompiledModel, measures: Sequence[str], depth: int, rows: List[tuple]) -> List[tuple]:
+        """把更细层级的结果按前 depth 个层级再次聚合"""
+        reaggregations = [_REAGGREGATIONS[plan.aggregations[meas].upper()] for meas in measures]
+        groups: Dict[tuple, List[Any]] = {}
+        for row in rows:
+            values = row[len(row) - len(measures):]
+            accumulators = groups.get(row[:depth])
+            if accumulators is None:
+                groups[row[:depth]] = list(values)
+                continue
+            for k, value in enumerate(values):
+                if value is None:
+                    continue
+                if accumulators[k] is None:
+                    accumulators[k] = value
+                elif reaggregations[k] == "MIN":
+                    accumulators[k] = min(accumulators[k], value)
+                elif reaggregations[k] == "MAX":
+                    accumulators[k] = max(accumulators[k], value)
+                else:
+                    accumulators[k] += value
+        return [key + tuple(accumulators) for key, accumulators in groups.items()]
+
+    def store(self, key: tuple, plan: CompiledModel, depth: int, restriction: Sequence[Any], rows: List[tuple], ttl: int) -> None:
+        """保存层级 depth 在限定路径 restriction 下的结果；超过单项行数上限的结果不缓存"""
+        if len(rows) > settings.DRILL_CACHE_MAX_ENTRY_ROWS:
+            return
+        entry = {
+            "depth": depth,
+            "restriction": tuple(restriction),
+            "rows": [tuple(row) for row in rows],
+            "expires": time.monotonic() + ttl,
+            "data_set_ids": plan.data_set_ids,
+            "source_ids": plan.source_ids
+        }
+        with self._lock:
+            entries = self._entries.setdefault(key, [])
+            # 同一层级、同一限定路径的旧结果被替换
+            for old in [old for old in entries if old["depth"] == depth and old["restriction"] == entry["restriction"]]:
+                entries.remove(old)
+                self._rows -= len(old["rows"])
+            entries.append(entry)
+            self._rows += len(entry["rows"])
+            self._entries.move_to_end(key)
+            self._stats["stores"] += 1
+            # 超出总行数上限时淘汰最久未使用的查询
+            while self._rows > settings.DRILL_CACHE_MAX_ROWS and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._rows -= sum(len(old["rows"]) for old in evicted)
+                self._stats["evictions"] += len(evicted)
+
+    def invalidate(self, kind: str, object_id: Any) -> None:
+        """模型、数据集或数据源变化时移除相关的缓存项"""
+        with self._lock:
+            if kind not in ("*", "model", "data_set", "source"):
+                return
+            self._stats["invalidations"] += 1
+            for key, entries in list(self._entries.items()):
+                if kind == "*" or kind == "model":
+                    kept = [] if kind == "*" or key[0] == object_id else entries
+                else:
+                    field = "data_set_ids" if kind == "data_set" else "source_ids"
+                    kept = [entry for entry in entries if object_id not in entry[field]]
+                self._rows -= sum(len(entry["rows"]) for entry in entries) - sum(len(entry["rows"]) for entry in kept)
+                if kept:
+                    entries[:] = kept
+                else:
+                    del self._entries[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = sum(len(entries) for entries in self._entries.values())
+            stats["rows"] = self._rows
+        return stats
+
+
+drill_cache = DrillCache()
@@ -0,0 +1,290 @@
+import json
+import math
+from typing import Any, Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.services.query.model_plan import CompiledModel
+from app.services.query.sql_builder import OTHERS_COLUMN
+from app.services.query.sql_utils import check_sort_order
+
+# 可以由最细粒度的聚合结果在进程内再次聚合得到的聚合函数
+REAGGREGATABLE_AGGREGATIONS = {"SUM", "COUNT", "MIN", "MAX", "AVG"}
+# 支持 GROUPING SETS 的数据库
+GROUPING_SETS_DB_TYPES = {"postgresql", "oracle", "duckdb"}
+
+
+class BoundPivot:
+    """已绑定维度、度量和筛选条件的透视查询。
+    top_n 指定时每组只返回排名度量（top_n_by，默认第一个度量）最大的前N个最后维度的值，其余合并为“其他”；
+    sample_rate 指定时按比例抽样主数据集，返回估算的聚合结果和每个度量的误差列"""
+
+    def __init__(self, plan: CompiledModel, dimensions: List[str], measures: List[str],
+                 filters: Optional[List[Dict[str, Any]]] = None,
+                 sort_by: Optional[str] = None, sort_order: Optional[str] = None,
+                 top_n: Optional[int] = None, top_n_by: Optional[str] = None, sample_rate: Optional[float] = None):
+        self.plan = plan
+        self.dimensions = list(dimensions)
+        self.measures = list(measures)
+        self.filters = filters
+        self.sort_by = sort_by
+        self.sort_order = sort_order
+        self.top_n, self.top_n_by, self.sample_rate = self._check_options(top_n, top_n_by, sample_rate)
+        self.sql, self.query_sql, self.model_sql, self.params = plan.bind(
+            self.dimensions, self.measures, filters, sort_by, sort_order, self.top_n, self.top_n_by, self.sample_rate
+        )
+        # 与单独执行时的结果列名一致
+        self.columns = [f"pivot_{name.replace('.', '_')}" for name in self.dimensions + self.measures]
+        if self.sample_rate is not None:
+            self.columns += [f"pivot_{meas.replace('.', '_')}_error" for meas in self.measures]
+
+    def _check_options(self, top_n: Optional[int], top_n_by: Optional[str],
+                       sample_rate: Optional[float]) -> Tuple[Optional[int], Optional[str], Optional[float]]:
+        if top_n is not None:
+            if isinstance(top_n, bool) or not isinstance(top_n, int) or not 1 <= top_n <= settings.PIVOT_TOP_N_MAX:
+                raise Exception(f"前N组数量无效: {top_n}，应为1到{settings.PIVOT_TOP_N_MAX}之间的整数")
+            if not self.dimensions or not self.measures:
+                raise Exception("前N组查询需要至少一个维度和一个度量")
+            top_n_by = top_n_by or self.measures[0]
+            if top_n_by not in self.measures:
+                raise Exception(f"前N组的排名度量不在度量中: {top_n_by}")
+        else:
+            top_n_by = None
+        if sample_rate is not None:
+            if not isinstance(sample_rate, (int, float)) or not 0 < sample_rate <= 1:
+                raise Exception(f"抽样比例无效: {sample_rate}，应大于0且不超过1")
+            # 抽样比例为1时即全量查询
+            sample_rate = float(sample_rate) if sample_rate < 1 else None
+        return top_n, top_n_by, sample_rate
+
+    @property
+    def is_exploratory(self) -> bool:
+        """前N组或抽样查询，结果不能由融合查询或汇总表得到"""
+        return self.top_n is not None or self.sample_rate is not None
+
+    def rebind(self, plan: CompiledModel) -> "BoundPivot":
+        """在另一个编译结果（如改用本地快照）上绑定相同的查询"""
+        return BoundPivot(plan, self.dimensions, self.measures, self.filters, self.sort_by, self.sort_order,
+                          self.top_n, self.top_n_by, self.sample_rate)
+
+    def finish(self, columns: List[str], rows: List[tuple]) -> Tuple[List[str], List[tuple]]:
+        """把数据库返回的结果转换为最终结果：“其他”分组的最后一个维度替换为 PIVOT_OTHERS_LABEL；
+        抽样查询的求和、计数按抽样比例放大，并按平方和估算每个度量的误差（置信区间半宽），去掉辅助列"""
+        if not self.is_exploratory:
+            return columns, rows
+        positions = {name.lower(): i for i, name in enumerate(columns)}
+        names = self.columns[:len(self.dimensions) + len(self.measures)]
+        value_positions = [positions[name.lower()] for name in names]
+        others_position = positions.get(OTHERS_COLUMN) if self.top_n is not None else None
+        rate = self.sample_rate
+        z = settings.PIVOT_SAMPLE_Z
+
+        result = []
+        for row in rows:
+            values = [row[i] for i in value_positions]
+            if others_position is not None and row[others_position]:
+                values[len(self.dimensions) - 1] = settings.PIVOT_OTHERS_LABEL
+            if rate is not None:
+                errors = []
+                for k, meas in enumerate(self.measures):
+                    index = len(self.dimensions) + k
+                    squares, count = (positions.get(f"{names[index]}{suffix}".lower()) for suffix in ("__sq", "__n"))
+                    estimate, error = self._estimate(self.plan.aggregations[meas].upper(), values[index],
+                                                     None if squares is None else row[squares],
+                                                     None if count is None else row[count], rate, z)
+                    values[index] = estimate
+                    errors.append(error)
+                values += errors
+            result.append(tuple(values))
+        return list(self.columns), result
+
+    @staticmethod
+    def _estimate(aggregation: str, value: Any, squares: Any, count: Any, rate: float, z: float) -> Tuple[Any, Optional[float]]:
+        """抽样聚合值的估算值和误差：求和、计数按Horvitz-Thompson估计量放大，平均值使用样本均值；其他聚合不估算误差"""
+        if value is None:
+            return None, None
+        if aggregation == "SUM":
+            error = z * math.sqrt((1 - rate) * float(squares)) / rate if squares is not None else None
+            return float(value) / rate, error
+        if aggregation == "COUNT":
+            return round(float(value) / rate), z * math.sqrt((1 - rate) * float(value)) / rate
+        if aggregation == "AVG":
+            if not count or squares is None:
+                return value, None
+            mean = float(value)
+            variance = max(float(squares) / float(count) - mean * mean, 0.0)
+            return value, z * math.sqrt(variance * (1 - rate) / float(count))
+        return value, None
+
+    @property
+    def fusion_key(self) -> Tuple[Any, Any, str]:
+        # 同一模型、同一数据源、筛选条件相同的查询扫描的是同一批数据，可以合并为一次查询
+        filters = json.dumps(self.filters or [], sort_keys=True, ensure_ascii=False, default=str)
+        return self.plan.model_id, self.plan.data_source.id, filters
+
+    def sort_rows(self, rows: List[tuple]) -> List[tuple]:
+        """按请求的排序字段在进程内排序，空值排在最后"""
+        if not self.sort_by:
+            return rows
+        names = self.dimensions + self.measures
+        if self.sort_by not in names:
+            return rows
+        index = names.index(self.sort_by)
+        descending = check_sort_order(self.sort_order) == 'DESC'
+        present = [row for row in rows if row[index] is not None]
+        missing = [row for row in rows if row[index] is None]
+        try:
+            present.sort(key=lambda row: row[index], reverse=descending)
+        except TypeError:
+            return rows
+        return present + missing
+
+
+class FusedQuery:
+    """把同一模型上维度、度量不同的多个透视查询合并为一次扫描，再按查询拆分结果。
+    数据库支持时使用 GROUPING SETS，否则按所有维度的并集聚合到最细粒度，在进程内再次聚合"""
+
+    def __init__(self, members: List[BoundPivot]):
+        self.members = members
+        self.plan = members[0].plan
+        self.use_grouping_sets = self.plan.data_source.db_type in GROUPING_SETS_DB_TYPES
+
+        self.dimensions: List[str] = []
+        self.measures: List[str] = []
+        for member in members:
+            self.dimensions += [dim for dim in member.dimensions if dim not in self.dimensions]
+            self.measures += [meas for meas in member.measures if meas not in self.measures]
+
+        # 每个度量在融合结果中对应的列：[(列别名, 聚合函数)]
+        self.measure_columns: Dict[str, List[Tuple[str, str]]] = {}
+        aggregates = []
+        for j, meas in enumerate(self.measures):
+            aggregation = self.plan.aggregations[meas].upper()
+            if self.use_grouping_sets or aggregation != "AVG":
+                parts = [(f"fused_m{j}", aggregation)]
+            else:
+                # 平均值拆分为求和与计数，再次聚合时相除
+                parts = [(f"fused_m{j}_sum", "SUM"), (f"fused_m{j}_count", "COUNT")]
+            self.measure_columns[meas] = parts
+            aggregates += [(alias, self.plan.aggregations[meas] if len(parts) == 1 else func, meas) for alias, func in parts]
+
+        grouping_sets = None
+        if self.use_grouping_sets:
+            grouping_sets = []
+            for member in members:
+                grouping_set = sorted(self.dimensions.index(dim) for dim in member.dimensions)
+                if grouping_set not in grouping_sets:
+                    grouping_sets.append(grouping_set)
+
+        self.sql, self.params = self.plan.bind_fused(self.dimensions, aggregates, members[0].filters, grouping_sets)
+        if not self.use_grouping_sets:
+            # 最细粒度结果过大时放弃融合，多取一行用于判断是否超出上限
+            self.sql += f" LIMIT {settings.QUERY_FUSION_MAX_ROWS + 1}"
+
+    @classmethod
+    def can_fuse(cls, members: List[BoundPivot]) -> bool:
+        plan = members[0].plan
+        if plan.data_source.db_type in GROUPING_SETS_DB_TYPES:
+            return True
+        return all(
+            plan.aggregations[meas].upper() in REAGGREGATABLE_AGGREGATIONS
+            for member in members for meas in member.measures
+        )
+
+    def is_truncated(self, rows: List[tuple]) -> bool:
+        return not self.use_grouping_sets and len(rows) > settings.QUERY_FUSION_MAX_ROWS
+
+    def split(self, columns: List[str], rows: List[tuple]) -> List[List[tuple]]:
+        """按成员查询拆分融合结果，返回与成员顺序一致的结果行"""
+        positions = {name: i for i, name in enumerate(columns)}
+        return [
+            member.sort_rows(
+                self._grouping_rows(member, positions, rows) if self.use_grouping_sets
+                else self._reaggregate(member, positions, rows)
+            )
+            for member in self.members
+        ]
+
+    def _grouping_rows(self, member: BoundPivot, positions: Dict[str, int], rows: List[tuple]) -> List[tuple]:
+        # GROUPING 标记为0表示该维度参与分组，只保留与成员维度完全一致的分组
+        expected = [0 if dim in member.dimensions else 1 for dim in self.dimensions]
+        flag_positions = [positions[f"fused_g{i}"] for i in range(len(self.dimensions))]
+        dim_positions = [positions[f"fused_d{self.dimensions.index(dim)}"] for dim in member.dimensions]
+        measure_positions = [positions[self.measure_columns[meas][0][0]] for meas in member.measures]
+        result = []
+        for row in rows:
+            if [row[i] for i in flag_positions] == expected:
+                result.append(tuple(row[i] for i in dim_positions) + tuple(row[i] for i in measure_positions))
+        return result
+
+    def _reaggregate(self, member: BoundPivot, positions: Dict[str, int], rows: List[tuple]) -> List[tuple]:
+        dim_positions = [positions[f"fused_d{self.dimensions.index(dim)}"] for dim in member.dimensions]
+        groups: Dict[tuple, List[Any]] = {}
+        for row in rows:
+            key = tuple(row[i] for i in dim_positions)
+            accumulators = groups.get(key)
+            if accumulators is None:
+                accumulators = groups[key] = [None] * len(member.measures)
+            for k, meas in enumerate(member.measures):
+                accumulators[k] = self._accumulate(meas, accumulators[k], row, positions)
+
+        # 没有维度的聚合查询在无数据时仍返回一行
+        if not member.dimensions and not groups:
+            groups[()] = [None] * len(member.measures)
+
+        result = []
+        for key, accumulators in groups.items():
+            values = tuple(self._finish(meas, acc) for meas, acc in zip(member.measures, accumulators))
+            result.append(key + values)
+        return result
+
+    def _accumulate(self, meas: str, acc: Any, row: tuple, positions: Dict[str, int]) -> Any:
+        parts = self.measure_columns[meas]
+        aggregation = self.plan.aggregations[meas].upper()
+        if aggregation == "AVG":
+            total, count = row[positions[parts[0][0]]], row[positions[parts[1][0]]] or 0
+            if acc is None:
+                acc = [None, 0]
+            if total is not None:
+                acc[0] = total if acc[0] is None else acc[0] + total
+            acc[1] += count
+            return acc
+
+        value = row[positions[parts[0][0]]]
+        if value is None:
+            return acc
+        if acc is None:
+            return value
+        if aggregation == "MIN":
+            return min(acc, value)
+        if aggregation == "MAX":
+            return max(acc, value)
+        # SUM 和 COUNT 再次聚合时求和
+        return acc + value
+
+    def _finish(self, meas: str, acc: Any) -> Any:
+        aggregation = self.plan.aggregations[meas].upper()
+        if aggregation == "AVG":
+            if acc is None or acc[0] is None or not acc[1]:
+                return None
+            return acc[0] / acc[1]
+        if aggregation == "COUNT" and acc is None:
+            return 0
+        return acc
+
+
+def plan_fusion(pivots: List[BoundPivot]) -> Tuple[List[List[int]], List[int]]:
+    """按融合键分组，返回可以融合的查询组（成员下标）和需要单独执行的查询下标"""
+    groups: Dict[Tuple[Any, Any, str], List[int]] = {}
+    fused, singles = [], []
+    for index, pivot in enumerate(pivots):
+        if pivot.is_exploratory:
+            singles.append(index)
+        else:
+            groups.setdefault(pivot.fusion_key, []).append(index)
+
+    for indexes in groups.values():
+        members = [pivots[i] for i in indexes]
+        if settings.QUERY_FUSION_ENABLED and len(indexes) > 1 and FusedQuery.can_fuse(members):
+            fused.append(indexes)
+        else:
+            singles += indexes
+    return fused, singles
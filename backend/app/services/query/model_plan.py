@@ -0,0 +1,706 @@
+import copy
+import hashlib
+import json
+import threading
+from types import MappingProxyType
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import func, literal, literal_column, select, tuple_, union_all
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.services.query import sql_builder
+from app.services.query.sql_utils import FILTER_OPERATORS, check_identifier, check_sort_order
+from app.models.data_models import DataSet, DataModel
+from app.models.sources import DataSource
+
+# 每个编译后的模型按查询结构缓存的SQL条数上限
+_STATEMENT_CACHE_SIZE = 256
+# 聚合结果合并为“其他”分组时的再次聚合方式，平均值单独处理
+_REAGGREGATIONS = {"SUM": "SUM", "COUNT": "SUM", "MIN": "MIN", "MAX": "MAX"}
+
+
+def _config_name(config) -> str:
+    """获取维度/度量配置的名称，兼容字典和对象两种格式"""
+    if isinstance(config, dict):
+        if 'name' in config:
+            return config['name']
+        elif 'field' in config:
+            return config['field']
+        return str(config)
+    try:
+        return config.name
+    except AttributeError:
+        return str(config)
+
+
+def _data_set_id(data_set) -> Any:
+    return data_set.get('data_set_id') if isinstance(data_set, dict) else data_set.data_set_id
+
+
+def _pure_field(field: str) -> str:
+    # 如果字段名包含表名前缀，提取纯字段名
+    return field.split('.')[-1] if '.' in field else field
+
+
+def data_set_table(data_set: DataSet) -> str:
+    """数据集对应的表名"""
+    # 从 visual_config.tables 中获取实际的表名，没有 visual_config 时使用数据集名称作为表名
+    if data_set.visual_config and 'tables' in data_set.visual_config:
+        actual_tables = data_set.visual_config['tables']
+        if not actual_tables:
+            raise Exception(f"数据集 {data_set.id} 中没有配置表")
+        return actual_tables[0]
+    return data_set.name
+
+
+def definition_version(data_set: DataSet, data_source: DataSource) -> str:
+    """数据集定义版本：数据集或其数据源修改后变化，用于判断本地物化的数据是否仍然有效"""
+    raw = json.dumps([data_set.id, data_set.updated_at, data_source.id, data_source.updated_at], default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _filter_conditions(filters: Optional[List[Dict[str, Any]]], resolve=None) -> Tuple[List[str], Dict[str, Any]]:
+    """根据操作符生成筛选条件，筛选值作为绑定参数传递；resolve 把筛选字段转换为带表别名的字段"""
+    where_conditions = []
+    params = {}
+    for index, filter_item in enumerate(filters or []):
+        field = filter_item.get('field', '')
+        operator = filter_item.get('operator', '=')
+        value = filter_item.get('value', '')
+        if operator not in FILTER_OPERATORS:
+            continue
+        check_identifier(field)
+        if resolve is not None:
+            field = resolve(field)
+
+        # 参数名只与筛选条件的位置有关，不同筛选值生成相同的SQL语句，数据库可以复用执行计划
+        param = f"filter_{index}"
+        if operator == 'is null':
+            where_conditions.append(f"{field} IS NULL")
+        elif operator == 'like':
+            where_conditions.append(f"{field} LIKE :{param}")
+            params[param] = f"%{value}%"
+        else:
+            where_conditions.append(f"{field} {operator} :{param}")
+            params[param] = value
+    return where_conditions, params
+
+
+class CompiledModel:
+    """编译后的数据模型：表、别名、连接关系和字段映射只解析一次，透视请求只需绑定维度、度量和筛选条件"""
+
+    def __init__(self, data_model: DataModel, data_sets: Dict[Any, DataSet], data_sources: Dict[Any, DataSource]):
+        self.model_id = data_model.id
+        self.updated_at = data_model.updated_at
+
+        if not data_model.data_sets:
+            raise Exception("数据模型中没有配置数据集")
+
+        self.dimension_names = tuple(_config_name(dim) for dim in data_model.dimensions)
+        self.measure_names = tuple(_config_name(meas) for meas in data_model.measures)
+        # 层次结构名称 -> 从粗到细的层级（维度名称）
+        self.hierarchies = MappingProxyType({
+            hierarchy['name']: tuple(hierarchy.get('levels') or [])
+            for hierarchy in data_model.hierarchies or [] if isinstance(hierarchy, dict) and hierarchy.get('name')
+        })
+
+        # 构建表连接信息
+        table_names = {}
+        table_mapping = {}
+        # 记录模型涉及的数据集刷新间隔，作为结果缓存的有效期
+        refresh_intervals = []
+        data_set_versions = {}
+        for i, data_set in enumerate(data_model.data_sets):
+            data_set_id = _data_set_id(data_set)
+            data_set_obj = data_sets.get(data_set_id)
+            if not data_set_obj:
+                if i == 0:
+                    raise Exception(f"主数据集不存在: {data_set_id}")
+                raise Exception(f"数据集不存在: {data_set_id}")
+            if data_set_obj.data_source_id not in data_sources:
+                raise Exception(f"数据源不存在: {data_set_obj.data_source_id}")
+            refresh_intervals.append(data_set_obj.refresh_interval)
+            data_set_versions[data_set_id] = definition_version(data_set_obj, data_sources[data_set_obj.data_source_id])
+
+            table_names[data_set_id] = data_set_table(data_set_obj)
+            table_mapping[data_set_id] = f"t{i+1}"
+        self.table_aliases = MappingProxyType(table_mapping)
+        self.data_set_versions = MappingProxyType(data_set_versions)
+        self.data_set_tables = MappingProxyType(table_names)
+        self._table_names = dict(table_names)
+        self._relationships = [rel for rel in data_model.relationships or [] if isinstance(rel, dict)]
+        # 查询结构 -> 编译后的单层SQL
+        self._statements: Dict[tuple, str] = {}
+
+        main_data_set_id = _data_set_id(data_model.data_sets[0])
+        self.main_data_set_id = main_data_set_id
+        self.main_table_name = f"data_set_{main_data_set_id}"
+        self.first_table_alias = table_mapping[main_data_set_id]
+        self.data_set_ids = tuple(table_mapping.keys())
+        self._join_edges = [rel for rel in self._relationships if self._is_join_edge(rel)]
+        self._parents = self._join_tree()
+        # 查询在第一个数据集的数据源上执行
+        self.data_source = data_sources[data_sets[main_data_set_id].data_source_id]
+        # 连接排序使用的行数估计来自原数据源的元数据目录（改用本地快照后不变）
+        self._origin_source = self.data_source
+        self.source_ids = frozenset(data_sets[data_set_id].data_source_id for data_set_id in self.data_set_ids)
+        refresh_intervals.append(self.data_source.refresh_interval)
+        self.refresh_intervals = tuple(refresh_intervals)
+
+        # 构建字段映射：字段名称 -> 实际字段名（模型维度、度量，数据集字段作为补充）
+        field_mapping = {}
+        field_configs = list(data_model.dimensions or []) + list(data_model.measures or [])
+        for config in field_configs:
+            if isinstance(config, dict):
+                name = config.get('name') or config.get('field')
+                if name:
+                    field_mapping[name] = _pure_field(name)
+                    field_mapping[_pure_field(name)] = _pure_field(name)
+        # 字段所属的数据集：表名或数据集名前缀 -> 数据集，数据集字段 -> 数据集，主数据集优先
+        self._prefix_owners: Dict[str, Any] = {}
+        self._field_owners: Dict[str, Any] = {}
+        for data_set_id in self.data_set_ids:
+            self._prefix_owners.setdefault(table_names[data_set_id], data_set_id)
+            self._prefix_owners.setdefault(data_sets[data_set_id].name, data_set_id)
+            for field in data_sets[data_set_id].fields or []:
+                if isinstance(field, dict) and field.get('name'):
+                    field_mapping[field['name']] = _pure_field(field['name'])
+                    field_mapping[_pure_field(field['name'])] = _pure_field(field['name'])
+                    self._field_owners.setdefault(field['name'], data_set_id)
+                    self._field_owners.setdefault(_pure_field(field['name']), data_set_id)
+
+        # 维度和度量对应的实际字段及聚合方式
+        dimension_fields = {}
+        dimension_owners = {}
+        for name in self.dimension_names:
+            found = next((d for d in data_model.dimensions
+                          if isinstance(d, dict) and (d.get('name') or d.get('field')) == name), None)
+            actual_field = (found.get('field') or found.get('name')) if found else field_mapping.get(name, name)
+            dimension_fields[name] = _pure_field(actual_field)
+            dimension_owners[name] = self._owner(actual_field) or main_data_set_id
+
+        measure_fields = {}
+        measure_owners = {}
+        aggregations = {}
+        # 近似分位数度量的分位点
+        quantiles = {}
+        for name in self.measure_names:
+            found = next((m for m in data_model.measures
+                          if isinstance(m, dict) and (m.get('name') or m.get('field')) == name), None)
+            actual_field = (found.get('field') or found.get('name')) if found else field_mapping.get(name, name)
+            measure_fields[name] = _pure_field(actual_field)
+            measure_owners[name] = self._owner(actual_field) or main_data_set_id
+            aggregations[name] = found.get('aggregation', 'SUM') if found else 'SUM'
+            if aggregations[name].upper() == "APPROX_QUANTILE":
+                quantile = found.get('quantile', 0.5) if found else 0.5
+                if isinstance(quantile, bool) or not isinstance(quantile, (int, float)) or not 0 <= quantile <= 1:
+                    raise Exception(f"度量的分位点无效: {name}({quantile})，应为0到1之间的数")
+                quantiles[name] = float(quantile)
+
+        self.dimension_fields = MappingProxyType(dimension_fields)
+        self.measure_fields = MappingProxyType(measure_fields)
+        self.aggregations = MappingProxyType(aggregations)
+        self.quantiles = MappingProxyType(quantiles)
+        # 维度、度量字段所属的数据集
+        self.dimension_owners = MappingProxyType(dimension_owners)
+        self.measure_owners = MappingProxyType(measure_owners)
+
+        # 模型定义版本：模型、数据集或数据源任何一个修改后都会变化，用于判断物化数据是否仍然有效
+        versions = [("model", self.model_id, data_model.updated_at)]
+        versions += [("data_set", data_set_id, data_sets[data_set_id].updated_at) for data_set_id in self.data_set_ids]
+        versions += [("source", source.id, source.updated_at) for source in data_sources.values() if source.id in self.source_ids]
+        self.signature = hashlib.sha256(json.dumps(sorted(versions, key=str), default=str).encode("utf-8")).hexdigest()
+
+    def _owner(self, field: str) -> Optional[Any]:
+        """字段所属的数据集：按表名（或数据集名）前缀查找，其次按数据集字段查找，找不到时返回None"""
+        if '.' in field:
+            owner = self._prefix_owners.get(field.rsplit('.', 1)[0])
+            if owner is not None:
+                return owner
+        owner = self._field_owners.get(field)
+        if owner is None:
+            owner = self._field_owners.get(_pure_field(field))
+        return owner
+
+    def _is_join_edge(self, rel: Dict[str, Any]) -> bool:
+        return bool(rel.get('source_field') and rel.get('target_field')
+                    and rel.get('source_data_set') in self.table_aliases and rel.get('target_data_set') in self.table_aliases)
+
+    def _join_tree(self) -> Optional[Dict[Any, Dict[str, Any]]]:
+        """数据集ID -> 把它连接进来的关系。关系不能组成以主数据集为根的树（如重复连接同一数据集），
+        或包含内连接、左连接以外的连接时返回None，此时按配置连接全部数据集"""
+        parents: Dict[Any, Dict[str, Any]] = {}
+        joined = {self.main_data_set_id}
+        pending = list(self._join_edges)
+        while pending:
+            ready = [rel for rel in pending if rel['source_data_set'] in joined]
+            if not ready:
+                return None
+            for rel in ready:
+                target = rel['target_data_set']
+                if target in joined or rel.get('join_type', 'inner').lower() not in ('inner', 'left'):
+                    return None
+                parents[target] = rel
+                joined.add(target)
+                pending.remove(rel)
+        return parents
+
+    def _render_join(self, rel: Dict[str, Any], table_names: Dict[Any, str]) -> str:
+        source, target = rel['source_data_set'], rel['target_data_set']
+        join_type = rel.get('join_type', 'inner').upper()
+        return (f"{join_type} JOIN {table_names[target]} {self.table_aliases[target]} "
+                f"ON {self.table_aliases[source]}.{_pure_field(rel['source_field'])} = "
+                f"{self.table_aliases[target]}.{_pure_field(rel['target_field'])}")
+
+    def _catalog_tables(self) -> Dict[Any, Dict[str, Any]]:
+        """各数据集在元数据目录中的表信息，只使用已缓存的元数据目录，不访问数据源"""
+        from app.services.sources.metadata_catalog import metadata_catalog
+        if getattr(self._origin_source, 'type', None) != 'database':
+            return {}
+        catalog = metadata_catalog.peek(self._origin_source)
+        if catalog is None:
+            return {}
+        tables = {}
+        for data_set_id, table_name in self.data_set_tables.items():
+            table = catalog["tables"].get(table_name) or catalog["tables"].get(catalog["lower_names"].get(table_name.lower(), ""))
+            if table:
+                tables[data_set_id] = table
+        return tables
+
+    @staticmethod
+    def _row_estimates(tables: Dict[Any, Dict[str, Any]]) -> Dict[Any, int]:
+        """各数据集的估计行数"""
+        return {data_set_id: table["row_estimate"] for data_set_id, table in tables.items() if table["row_estimate"] is not None}
+
+    @staticmethod
+    def _prunable(rel: Dict[str, Any], tables: Dict[Any, Dict[str, Any]]) -> bool:
+        """目标数据集没有被用到时能否省略该连接：关系声明满足参照完整性，
+        或者为左连接且元数据目录中目标连接键有唯一索引（连接不会增减行）"""
+        if rel.get('referential_integrity', False):
+            return True
+        if rel.get('join_type', 'inner').lower() != 'left':
+            return False
+        table = tables.get(rel['target_data_set'])
+        field = _pure_field(rel['target_field']).lower()
+        return bool(table) and any(
+            index["unique"] and [column.lower() for column in index["columns"]] == [field] for index in table["indexes"]
+        )
+
+    def _plan_joins(self, needed: Optional[set], filtered: set) -> List[Dict[str, Any]]:
+        """查询需要的连接关系（按连接顺序）：省略没有被维度、度量、筛选条件用到、且连接不影响结果的数据集
+        （关系声明了 referential_integrity，或左连接的目标连接键唯一），其他关系始终连接；
+        内连接和带筛选条件的数据集先连接，同类按估计行数从小到大。
+        needed 为None（有无法定位的字段）时连接全部数据集，关系不能组成树时按配置顺序连接全部数据集"""
+        if self._parents is None or not settings.JOIN_PLANNER_ENABLED:
+            return list(self._join_edges)
+        if needed is None:
+            needed = set(self._parents)
+
+        tables = self._catalog_tables()
+        needed = set(needed) | {target for target, rel in self._parents.items() if not self._prunable(rel, tables)}
+        keep = set()
+        for data_set_id in needed:
+            # 雪花模型中还需要连接到主数据集路径上的所有数据集
+            while data_set_id in self._parents and data_set_id not in keep:
+                keep.add(data_set_id)
+                data_set_id = self._parents[data_set_id]['source_data_set']
+        if not keep:
+            return []
+
+        estimates = self._row_estimates(tables)
+        joined, joins = {self.main_data_set_id}, []
+        remaining = [self._parents[data_set_id] for data_set_id in keep]
+        while remaining:
+            rel = min((rel for rel in remaining if rel['source_data_set'] in joined), key=lambda rel: (
+                rel.get('join_type', 'inner').lower() != 'inner',
+                rel['target_data_set'] not in filtered,
+                estimates.get(rel['target_data_set'], float('inf')),
+                self._join_edges.index(rel)
+            ))
+            joins.append(rel)
+            joined.add(rel['target_data_set'])
+            remaining.remove(rel)
+        return joins
+
+    def _column(self, owner: Any, field: str) -> str:
+        return f"{self.table_aliases[owner]}.{field}"
+
+    def _filter_owner(self, field: str) -> Tuple[Optional[Any], str]:
+        """筛选字段所属的数据集和实际字段名：维度、度量名称按其字段，其他字段按表名前缀或数据集字段定位；
+        无法定位时所属数据集为None，字段原样使用"""
+        if field in self.dimension_fields:
+            return self.dimension_owners[field], self.dimension_fields[field]
+        if field in self.measure_fields:
+            return self.measure_owners[field], self.measure_fields[field]
+        owner = self._owner(field)
+        if owner is None:
+            return None, field
+        return owner, _pure_field(field)
+
+    def _filter_column(self, field: str) -> str:
+        owner, actual_field = self._filter_owner(field)
+        return actual_field if owner is None else self._column(owner, actual_field)
+
+    def _joins_for(self, dimensions: List[str], measures: List[str],
+                   filters: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """查询的维度、度量和筛选条件需要的连接关系"""
+        needed = {self.dimension_owners[dim] for dim in dimensions} | {self.measure_owners[meas] for meas in measures}
+        filtered = set()
+        for filter_item in filters or []:
+            if filter_item.get('operator', '=') not in FILTER_OPERATORS:
+                continue
+            owner = self._filter_owner(filter_item.get('field', ''))[0]
+            if owner is None:
+                needed = None
+                break
+            filtered.add(owner)
+        if needed is not None:
+            needed |= filtered
+        return self._plan_joins(needed, filtered)
+
+    def _dataset_from(self, dimensions: List[str], measures: List[str],
+                      filters: Optional[List[Dict[str, Any]]]) -> Tuple[List[str], List[str], Dict[str, Any]]:
+        """数据集层的 FROM/JOIN 子句、带别名的筛选条件和绑定参数"""
+        where_conditions, params = _filter_conditions(filters, self._filter_column)
+        from_parts = [f"FROM {self._table_names[self.main_data_set_id]} {self.first_table_alias}"]
+        from_parts += [self._render_join(rel, self._table_names) for rel in self._joins_for(dimensions, measures, filters)]
+        return from_parts, where_conditions, params
+
+    def _flat_sql(self, dimensions: List[str], dimension_labels: List[str], aggregates: List[Tuple[str, str, str]],
+                  filters: Optional[List[Dict[str, Any]]], grouping_sets: Optional[List[List[int]]] = None,
+                  sort_label: Optional[str] = None, sort_order: str = 'ASC', sample_rate: Optional[float] = None,
+                  top_n: Optional[Tuple[int, str, List[Tuple[str, Any]]]] = None,
+                  value: Optional[Tuple[str, str]] = None) -> str:
+        """用SQLAlchemy Core生成单层SELECT：只连接需要的数据集，筛选条件直接作用在带别名的字段上，
+        按数据源方言引用标识符。SQL只与查询结构有关（筛选值是绑定参数），按结构缓存编译结果。
+        sample_rate 指定时按比例抽样主数据集；top_n 为 (N, 排名列, 再次聚合方式)，指定时在分组结果上用窗口函数取前N组；
+        value 为 (列别名, 度量)，指定时度量字段的原始值也作为分组列，用于构建草图"""
+        filter_shape = tuple((filter_item.get('field', ''), filter_item.get('operator', '='))
+                             for filter_item in filters or [])
+        key = (tuple(dimensions), tuple(dimension_labels), tuple(aggregates), filter_shape,
+               None if grouping_sets is None else tuple(map(tuple, grouping_sets)), sort_label, sort_order,
+               sample_rate, None if top_n is None else (top_n[0], top_n[1], tuple(top_n[2])), value)
+        sql = self._statements.get(key)
+        if sql is not None:
+            return sql
+
+        measures = [meas for _, _, meas in aggregates] + ([value[1]] if value is not None else [])
+        joins = self._joins_for(dimensions, measures, filters)
+        conditions = []
+        for index, filter_item in enumerate(filters or []):
+            filter_operator = filter_item.get('operator', '=')
+            if filter_operator in FILTER_OPERATORS:
+                conditions.append((index, filter_operator, self._filter_owner(check_identifier(filter_item.get('field', '')))))
+
+        # 每个数据集在查询中用到的字段
+        fields: Dict[Any, List[str]] = {}
+
+        def use(owner: Any, field: str) -> None:
+            owner_fields = fields.setdefault(owner, [])
+            if field not in owner_fields:
+                owner_fields.append(field)
+
+        for dim in dimensions:
+            use(self.dimension_owners[dim], self.dimension_fields[dim])
+        for meas in measures:
+            use(self.measure_owners[meas], self.measure_fields[meas])
+        for rel in joins:
+            use(rel['source_data_set'], _pure_field(rel['source_field']))
+            use(rel['target_data_set'], _pure_field(rel['target_field']))
+        for _, _, (owner, field) in conditions:
+            if owner is not None:
+                use(owner, field)
+
+        tables = {
+            data_set_id: sql_builder.table_alias(self._table_names[data_set_id], self.table_aliases[data_set_id], fields.get(data_set_id, []))
+            for data_set_id in [rel['target_data_set'] for rel in joins]
+        }
+        sample = None
+        if sample_rate is not None:
+            # 只抽样主数据集，连接的数据集按关系取对应的行
+            tables[self.main_data_set_id], sample = sql_builder.sampled_table(
+                self._table_names[self.main_data_set_id], self.first_table_alias, fields.get(self.main_data_set_id, []),
+                sample_rate, self.data_source.db_type
+            )
+        else:
+            tables[self.main_data_set_id] = sql_builder.table_alias(
+                self._table_names[self.main_data_set_id], self.first_table_alias, fields.get(self.main_data_set_id, [])
+            )
+        from_clause = tables[self.main_data_set_id]
+        for rel in joins:
+            source, target = tables[rel['source_data_set']], tables[rel['target_data_set']]
+            on = source.c[_pure_field(rel['source_field'])] == target.c[_pure_field(rel['target_field'])]
+            from_clause = sql_builder.join(from_clause, target, on, rel.get('join_type'))
+
+        dimension_exprs = [tables[self.dimension_owners[dim]].c[self.dimension_fields[dim]] for dim in dimensions]
+        columns = [expr.label(label) for expr, label in zip(dimension_exprs, dimension_labels)]
+        if grouping_sets is not None:
+            columns += [func.grouping(expr).label(f"fused_g{i}") for i, expr in enumerate(dimension_exprs)]
+        group_exprs = list(dimension_exprs)
+        if value is not None:
+            value_label, value_measure = value
+            group_exprs.append(tables[self.measure_owners[value_measure]].c[self.measure_fields[value_measure]])
+            columns.append(group_exprs[-1].label(value_label))
+        columns += [
+            sql_builder.aggregate(aggregation, tables[self.measure_owners[meas]].c[self.measure_fields[meas]],
+                                  self.data_source.db_type, self.quantiles.get(meas)).label(alias)
+            for alias, aggregation, meas in aggregates
+        ]
+
+        statement = select(*columns).select_from(from_clause)
+        where = [
+            sql_builder.condition(literal_column(field) if owner is None else tables[owner].c[field], filter_operator, f"filter_{index}")
+            for index, filter_operator, (owner, field) in conditions
+        ]
+        if sample is not None:
+            where.append(sample)
+        if where:
+            statement = statement.where(*where)
+        if grouping_sets is not None:
+            statement = statement.group_by(func.grouping_sets(*[tuple_(*[dimension_exprs[i] for i in grouping_set]) for grouping_set in grouping_sets]))
+        elif group_exprs:
+            statement = statement.group_by(*group_exprs)
+        order_by = []
+        if top_n is not None:
+            n, rank_label, reaggregations = top_n
+            statement = sql_builder.top_n(statement, dimension_labels, reaggregations, rank_label, n)
+            columns = list(statement.selected_columns)
+            others = statement.selected_columns[sql_builder.OTHERS_COLUMN]
+            if sort_label is None:
+                # 未指定排序时每组内按排名度量从大到小，“其他”排在最后
+                order_by = [statement.selected_columns[label] for label in dimension_labels[:-1]]
+                order_by += [others, statement.selected_columns[rank_label].desc()]
+            else:
+                order_by = [others]
+        if sort_label is not None:
+            label = next(column for column in columns if column.name == sort_label)
+            order_by.append(label.desc() if sort_order == 'DESC' else label.asc())
+        if order_by:
+            statement = statement.order_by(*order_by)
+
+        sql = sql_builder.compile_sql(statement, self.data_source.db_type)
+        if len(self._statements) >= _STATEMENT_CACHE_SIZE:
+            self._statements.clear()
+        self._statements[key] = sql
+        return sql
+
+    def with_tables(self, table_names: Dict[Any, str], data_source) -> "CompiledModel":
+        """返回改用其他表（如本地数据抽取）和执行目标的副本，维度、度量和连接关系不变"""
+        plan = copy.copy(self)
+        plan._table_names = dict(table_names)
+        plan.data_source = data_source
+        plan._statements = {}
+        return plan
+
+    def validate(self, dimensions: List[str], measures: List[str]) -> None:
+        """验证维度和度量是否存在于数据模型中"""
+        for dim in dimensions:
+            if dim not in self.dimension_names:
+                raise Exception(f"维度不存在: {dim}")
+        for meas in measures:
+            if meas not in self.measure_names:
+                raise Exception(f"度量不存在: {meas}")
+
+    def hierarchy_levels(self, name: str) -> List[str]:
+        """层次结构的层级，验证层级都是模型维度"""
+        levels = self.hierarchies.get(name)
+        if levels is None:
+            raise Exception(f"层次结构不存在: {name}")
+        if not levels:
+            raise Exception(f"层次结构没有配置层级: {name}")
+        for level in levels:
+            if level not in self.dimension_names:
+                raise Exception(f"层次结构的层级不是模型维度: {name}.{level}")
+        return list(levels)
+
+    def bind(self, dimensions: List[str], measures: List[str], filters: Optional[List[Dict[str, Any]]] = None,
+             sort_by: Optional[str] = None, sort_order: Optional[str] = None, top_n: Optional[int] = None,
+             top_n_by: Optional[str] = None, sample_rate: Optional[float] = None) -> Tuple[str, str, str, Dict[str, Any]]:
+        """绑定维度、度量和筛选条件，返回透视SQL、实际执行的单层SQL、通过模型解析的三层嵌套SQL（调试用）和绑定参数。
+        top_n、sample_rate 只影响实际执行的SQL，结果需要经 BoundPivot.finish 转换；
+        数据库不能计算某个度量（如SQLite上的分位数）时实际执行的SQL为None，只能由汇总表或本地快照回答"""
+        self.validate(dimensions, measures)
+        where_conditions, params = _filter_conditions(filters)
+        sort_order = check_sort_order(sort_order)
+        names = list(dimensions) + list(measures)
+        if sort_by:
+            check_identifier(sort_by)
+            if sort_by not in names:
+                raise Exception(f"排序字段不在维度和度量中: {sort_by}")
+
+        # 透视SQL
+        sql_parts = ["SELECT"]
+        select_fields = list(dimensions) + [f"{self.aggregations[meas]}({meas}) AS {meas}" for meas in measures]
+        sql_parts.append(", ".join(select_fields))
+        sql_parts.append(f"FROM {self.main_table_name}")
+        if where_conditions:
+            sql_parts.append("WHERE " + " AND ".join(where_conditions))
+        if dimensions:
+            sql_parts.append("GROUP BY " + ", ".join(dimensions))
+        if sort_by:
+            sql_parts.append(f"ORDER BY {sort_by} {sort_order}")
+        sql = " ".join(sql_parts)
+
+        # 实际执行的单层SQL，结果列名与三层嵌套SQL一致
+        labels = [f"pivot_{name.replace('.', '_')}" for name in names]
+        aggregates, reaggregations = self._measure_parts(measures, labels[len(dimensions):], top_n is not None, sample_rate is not None)
+        query_sql = None
+        if all(sql_builder.supports_aggregation(self.aggregations[meas], self.data_source.db_type) for meas in measures):
+            query_sql = self._flat_sql(
+                dimensions, labels[:len(dimensions)], aggregates, filters,
+                sort_label=labels[names.index(sort_by)] if sort_by else None, sort_order=sort_order, sample_rate=sample_rate,
+                top_n=None if top_n is None else (top_n, labels[names.index(top_n_by)], reaggregations)
+            )
+
+        # 数据集层SQL（最内层）：只连接需要的数据集，筛选条件在这一层执行
+        from_parts, dataset_conditions, _ = self._dataset_from(dimensions, measures, filters)
+        group_by_fields = [self._column(self.dimension_owners[dim], self.dimension_fields[dim]) for dim in dimensions]
+        dataset_fields = [f"{field} AS dataset_{dim.replace('.', '_')}" for field, dim in zip(group_by_fields, dimensions)]
+        dataset_fields += [
+            f"{self.aggregations[meas]}({self._column(self.measure_owners[meas], self.measure_fields[meas])}) AS dataset_{meas.replace('.', '_')}"
+            for meas in measures
+        ]
+        dataset_sql_parts = ["SELECT", ", ".join(dataset_fields)]
+        dataset_sql_parts.extend(from_parts)
+        if dataset_conditions:
+            dataset_sql_parts.append("WHERE " + " AND ".join(dataset_conditions))
+        if group_by_fields:
+            dataset_sql_parts.append("GROUP BY " + ", ".join(group_by_fields))
+        dataset_sql = " ".join(dataset_sql_parts)
+
+        # 模型层SQL（中间层）
+        names = [name.replace('.', '_') for name in names]
+        model_field_mappings = [f"dataset_query.dataset_{name} AS model_{name}" for name in names]
+        model_sql = f"SELECT {', '.join(model_field_mappings)} FROM ({dataset_sql}) AS dataset_query"
+
+        # 透视层SQL（最外层）
+        pivot_field_mappings = [f"model_query.model_{name} AS pivot_{name}" for name in names]
+        model_sql_parts = [f"SELECT {', '.join(pivot_field_mappings)}", f"FROM ({model_sql}) AS model_query"]
+        if sort_by:
+            model_sql_parts.append(f"ORDER BY pivot_{sort_by.replace('.', '_')} {sort_order}")
+        model_sql = " ".join(model_sql_parts)
+
+        return sql, query_sql, model_sql, params
+
+    def _measure_parts(self, measures: List[str], labels: List[str], top_n: bool,
+                       sampled: bool) -> Tuple[List[Tuple[str, str, str]], List[Tuple[str, Any]]]:
+        """度量的结果列 [(列别名, 聚合函数, 度量)] 和前N组合并时各列的再次聚合方式。
+        前N组的平均值需要求和与计数才能合并；抽样的求和、平均值需要平方和估算误差，平均值还需要计数"""
+        aggregates, reaggregations = [], []
+        for label, meas in zip(labels, measures):
+            aggregation = self.aggregations[meas].upper()
+            aggregates.append((label, self.aggregations[meas], meas))
+            if aggregation == "AVG" and top_n:
+                reaggregations.append((label, ("AVG", f"{label}__sum", f"{label}__n")))
+            else:
+                reaggregations.append((label, _REAGGREGATIONS.get(aggregation)))
+            extras = []
+            if sampled and aggregation in ("SUM", "AVG"):
+                extras.append((f"{label}__sq", "SUM_SQUARES"))
+            if aggregation == "AVG" and (top_n or sampled):
+                extras.append((f"{label}__n", "COUNT"))
+            if aggregation == "AVG" and top_n:
+                extras.append((f"{label}__sum", "SUM"))
+            aggregates += [(alias, extra, meas) for alias, extra in extras]
+            reaggregations += [(alias, "SUM") for alias, _ in extras]
+        return aggregates, reaggregations
+
+    def bind_fused(self, dimensions: List[str], aggregates: List[Tuple[str, str, str]],
+                   filters: Optional[List[Dict[str, Any]]] = None,
+                   grouping_sets: Optional[List[List[int]]] = None) -> Tuple[str, Dict[str, Any]]:
+        """生成融合查询，aggregates 为 [(列别名, 聚合函数, 度量)]；
+        grouping_sets 为各分组包含的维度下标，指定时按 GROUPING SETS 分组并返回每个维度的 GROUPING 标记"""
+        _, params = _filter_conditions(filters)
+        sql = self._flat_sql(dimensions, [f"fused_d{i}" for i in range(len(dimensions))], aggregates, filters, grouping_sets)
+        return sql, params
+
+    def bind_values(self, dimensions: List[str], meas: str) -> Tuple[str, Dict[str, Any]]:
+        """按维度和度量字段的原始值分组计数（sketch_d0.., sketch_v, sketch_n），在数据源上先去重，
+        用于构建近似去重计数、分位数度量的草图"""
+        aggregates = [("sketch_n", "COUNT", meas)]
+        sql = self._flat_sql(dimensions, [f"sketch_d{i}" for i in range(len(dimensions))], aggregates, None,
+                             value=("sketch_v", meas))
+        return sql, {}
+
+    @property
+    def cache_tags(self) -> List[Tuple[str, Any]]:
+        tags = [("source", self.data_source.id), ("model", self.model_id)]
+        tags += [("data_set", data_set_id) for data_set_id in self.data_set_ids]
+        return tags
+
+
+class ModelPlanCache:
+    """数据模型编译结果缓存，按模型及其数据集、数据源的更新时间判断是否需要重新编译。
+    其他worker修改数据集或数据源时即使失效消息没有送达（Redis不可用）也能发现"""
+
+    def __init__(self):
+        # 模型ID -> (编译结果, 编译时模型、数据集、数据源的更新时间)
+        self._plans: Dict[Any, Tuple[CompiledModel, Dict[tuple, Any]]] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "compiles": 0, "invalidations": 0}
+
+    @staticmethod
+    def _versions(db: Session, model_id: Any, data_set_ids, source_ids) -> Dict[tuple, Any]:
+        """通过一次查询取回模型、数据集和数据源的更新时间"""
+        parts = [select(literal("model"), DataModel.id, DataModel.updated_at).where(DataModel.id == model_id)]
+        if data_set_ids:
+            parts.append(select(literal("data_set"), DataSet.id, DataSet.updated_at).where(DataSet.id.in_(data_set_ids)))
+        if source_ids:
+            parts.append(select(literal("source"), DataSource.id, DataSource.updated_at).where(DataSource.id.in_(source_ids)))
+        rows = db.execute(union_all(*parts) if len(parts) > 1 else parts[0]).all()
+        return {(kind, object_id): updated_at for kind, object_id, updated_at in rows}
+
+    def get(self, db: Session, model_id: Any) -> CompiledModel:
+        # 只查询更新时间，模型及其数据集、数据源都未变化时直接使用编译结果
+        entry = self._plans.get(model_id)
+        if entry is not None:
+            plan, versions = entry
+            if self._versions(db, model_id, plan.data_set_ids, plan.source_ids) == versions:
+                self._stats["hits"] += 1
+                return plan
+
+        plan, versions = self._compile(db, model_id)
+        with self._lock:
+            self._plans[model_id] = (plan, versions)
+            self._stats["compiles"] += 1
+        return plan
+
+    def _compile(self, db: Session, model_id: Any) -> Tuple[CompiledModel, Dict[tuple, Any]]:
+        data_model = db.query(DataModel).filter(DataModel.id == model_id).first()
+        if not data_model:
+            raise Exception(f"数据模型不存在: {model_id}")
+
+        # 批量加载模型涉及的数据集和数据源
+        data_set_ids = [_data_set_id(data_set) for data_set in data_model.data_sets or []]
+        data_sets = {ds.id: ds for ds in db.query(DataSet).filter(DataSet.id.in_(data_set_ids)).all()} if data_set_ids else {}
+        source_ids = {ds.data_source_id for ds in data_sets.values()}
+        data_sources = {src.id: src for src in db.query(DataSource).filter(DataSource.id.in_(source_ids)).all()} if source_ids else {}
+        # 编译结果在会话关闭后继续使用，从会话中移除，避免调用方提交事务时属性过期
+        for obj in [data_model, *data_sets.values(), *data_sources.values()]:
+            db.expunge(obj)
+        plan = CompiledModel(data_model, data_sets, data_sources)
+        versions = {("model", data_model.id): data_model.updated_at}
+        versions.update({("data_set", ds.id): ds.updated_at for ds in data_sets.values() if ds.id in plan.data_set_ids})
+        versions.update({("source", src.id): src.updated_at for src in data_sources.values() if src.id in plan.source_ids})
+        return plan, versions
+
+    def invalidate(self, kind: str, object_id: Any) -> None:
+        """模型、数据集或数据源变化时移除相关的编译结果"""
+        with self._lock:
+            self._stats["invalidations"] += 1
+            if kind == "*":
+                self._plans.clear()
+                return
+            for model_id, (plan, _) in list(self._plans.items()):
+                if ((kind == "model" and model_id == object_id)
+                        or (kind == "data_set" and object_id in plan.data_set_ids)
+                        or (kind == "source" and object_id in plan.source_ids)):
+                    del self._plans[model_id]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._plans)
+        return stats
+
+
+model_plan_cache = ModelPlanCache()
@@ -0,0 +1,137 @@
+import base64
+import json
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# 窗口计数附加列，总数与分页数据在同一次查询中返回
+TOTAL_COUNT_COLUMN = "__total_count"
+# 键集分页附加的排序列前缀，用于生成下一页游标
+SEEK_COLUMN_PREFIX = "__seek_"
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """将上一页最后一行的排序值编码为分页游标"""
+    raw = json.dumps(list(values), ensure_ascii=False, separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+    except Exception:
+        raise Exception("分页游标无效")
+    if not isinstance(values, list):
+        raise Exception("分页游标无效")
+    return values
+
+
+class SelectQuery:
+    """单表查询的组成部分，按需组合为分页查询、计数查询和键集分页查询"""
+
+    def __init__(
+        self,
+        select: Sequence[str],
+        from_clause: str,
+        where: Optional[Sequence[str]] = None,
+        order_by: Optional[Sequence[Tuple[str, str]]] = None,
+        params: Optional[Dict[str, Any]] = None,
+        raw_sql: Optional[str] = None
+    ):
+        self.select = list(select)
+        self.from_clause = from_clause
+        self.where = list(where or [])
+        # [(列表达式, ASC/DESC)]
+        self.order_by = list(order_by or [])
+        self.params = dict(params or {})
+        self.raw_sql = raw_sql
+
+    @classmethod
+    def wrap(cls, sql: str) -> "SelectQuery":
+        """包装用户提供的SQL，不分页时原样执行，分页时作为子查询"""
+        return cls(["base_query.*"], f"({sql.strip().rstrip(';')}) AS base_query", raw_sql=sql)
+
+    def to_sql(
+        self,
+        extra_select: Sequence[str] = (),
+        extra_where: Sequence[str] = (),
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        nulls_last: bool = False
+    ) -> str:
+        if self.raw_sql is not None and not (extra_select or extra_where or limit or offset):
+            return self.raw_sql
+
+        sql = f"SELECT {', '.join(self.select + list(extra_select))} FROM {self.from_clause}"
+        where = self.where + list(extra_where)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if self.order_by:
+            if nulls_last:
+                # 各数据库对空值的默认排序位置不同，统一排在最后，与键集分页的定位条件一致
+                order_by = [f"CASE WHEN {column} IS NULL THEN 1 ELSE 0 END, {column} {direction}" for column, direction in self.order_by]
+            else:
+                order_by = [f"{column} {direction}" for column, direction in self.order_by]
+            sql += " ORDER BY " + ", ".join(order_by)
+        if limit is not None:
+            sql += f" LIMIT {int(limit)} OFFSET {int(offset or 0)}"
+        elif offset:
+            raise Exception("指定偏移量时必须同时指定返回行数限制")
+        return sql
+
+    def windowed_sql(self, limit: int, offset: int) -> str:
+        """分页查询附加 COUNT(*) OVER()，窗口函数在LIMIT之前计算，得到筛选后的总行数"""
+        return self.to_sql([f"COUNT(*) OVER() AS {TOTAL_COUNT_COLUMN}"], limit=limit, offset=offset)
+
+    def count_sql(self) -> str:
+        """计数查询只保留筛选条件，不包含排序和分页"""
+        sql = f"SELECT COUNT(*) AS total FROM {self.from_clause}"
+        if self.where:
+            sql += " WHERE " + " AND ".join(self.where)
+        return sql
+
+    def keyset_sql(self, limit: int, cursor: Optional[str]) -> Tuple[str, Dict[str, Any]]:
+        """键集分页：根据上一页最后一行的排序值定位，代替深度 OFFSET 扫描。
+        排序字段中应包含唯一键，否则排序值相同的行在页边界处会被跳过；空值排在最后"""
+        if not self.order_by:
+            raise Exception("键集分页需要指定排序字段")
+
+        seek_select = [f"{column} AS {SEEK_COLUMN_PREFIX}{index}" for index, (column, _) in enumerate(self.order_by)]
+        params = dict(self.params)
+        seek_where = []
+        if cursor:
+            values = decode_cursor(cursor)
+            if len(values) != len(self.order_by):
+                raise Exception("分页游标与排序字段不匹配")
+
+            def equal(index: int) -> str:
+                column = self.order_by[index][0]
+                return f"{column} IS NULL" if values[index] is None else f"{column} = :{SEEK_COLUMN_PREFIX}{index}"
+
+            # (c1 > v1) OR (c1 = v1 AND c2 > v2) ...，降序列使用 <；空值排在最后，
+            # 游标值非空时其后为更大的值和空值，游标值为空时该列上没有更靠后的值
+            branches = []
+            for index, (column, direction) in enumerate(self.order_by):
+                if values[index] is None:
+                    continue
+                operator = "<" if direction.upper() == "DESC" else ">"
+                terms = [equal(prev) for prev in range(index)]
+                terms.append(f"({column} {operator} :{SEEK_COLUMN_PREFIX}{index} OR {column} IS NULL)")
+                branches.append("(" + " AND ".join(terms) + ")")
+            seek_where.append("(" + " OR ".join(branches) + ")" if branches else "1 = 0")
+            for index, value in enumerate(values):
+                if value is not None:
+                    params[f"{SEEK_COLUMN_PREFIX}{index}"] = value
+
+        return self.to_sql(seek_select, seek_where, limit=limit, nulls_last=True), params
+
+
+def split_page_columns(columns: List[str], rows: List[tuple]) -> Tuple[List[str], List[tuple], Optional[int], Optional[List[Any]]]:
+    """去掉分页附加列，返回业务列、结果行、窗口计数和最后一行的排序值"""
+    keep = [i for i, name in enumerate(columns) if name != TOTAL_COUNT_COLUMN and not name.startswith(SEEK_COLUMN_PREFIX)]
+    total_index = columns.index(TOTAL_COUNT_COLUMN) if TOTAL_COUNT_COLUMN in columns else None
+    seek_indexes = [i for i, name in enumerate(columns) if name.startswith(SEEK_COLUMN_PREFIX)]
+
+    total = rows[0][total_index] if rows and total_index is not None else None
+    last_values = [rows[-1][i] for i in seek_indexes] if rows and seek_indexes else None
+    if len(keep) == len(columns):
+        return columns, rows, total, last_values
+    return [columns[i] for i in keep], [tuple(row[i] for i in keep) for row in rows], total, last_values
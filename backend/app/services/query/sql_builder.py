@@ -0,0 +1,179 @@
+import operator
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import bindparam, case, column, func, literal_column, select, table, within_group
+from sqlalchemy.engine import Dialect
+from sqlalchemy.dialects.mysql.base import MySQLDialect
+from sqlalchemy.dialects.oracle.base import OracleDialect
+from sqlalchemy.dialects.postgresql.base import PGDialect
+from sqlalchemy.dialects.sqlite.base import SQLiteDialect
+from sqlalchemy.sql import ClauseElement, ColumnElement, FromClause, Select
+from app.core.config import settings
+from app.services.query.sql_utils import check_identifier
+
+# 数据库类型 -> 编译SQL使用的方言；本地分析存储（DuckDB）的标识符引用规则与PostgreSQL一致
+_DIALECT_CLASSES = {
+    "mysql": MySQLDialect,
+    "postgresql": PGDialect,
+    "oracle": OracleDialect,
+    "sqlite": SQLiteDialect,
+    "duckdb": PGDialect
+}
+
+# 筛选操作符 -> 比较函数，like 单独处理
+_COMPARATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le
+}
+
+# 支持 TABLESAMPLE BERNOULLI ... REPEATABLE 的数据库，其他数据库按行随机筛选
+_TABLESAMPLE_DB_TYPES = {"postgresql", "duckdb"}
+
+# 原生支持近似去重计数、分位数的数据库；其他数据库的去重计数按精确值计算，分位数按精确值计算（PostgreSQL）或不支持
+_APPROX_DB_TYPES = {"duckdb", "oracle"}
+_QUANTILE_DB_TYPES = {"duckdb", "oracle", "postgresql"}
+
+# 前N组查询中标记“其他”分组的结果列
+OTHERS_COLUMN = "pivot_others"
+
+_dialects: Dict[str, Dialect] = {}
+_lock = threading.Lock()
+
+
+def dialect_for(db_type: Optional[str]) -> Dialect:
+    """数据库类型对应的方言，未知类型按SQLite处理（与 build_db_url 一致）。
+    绑定参数统一编译为 :name 形式，通过 text() 执行，本地分析存储也按此形式转换"""
+    db_type = db_type if db_type in _DIALECT_CLASSES else "sqlite"
+    dialect = _dialects.get(db_type)
+    if dialect is None:
+        with _lock:
+            dialect = _dialects.setdefault(db_type, _DIALECT_CLASSES[db_type](paramstyle="named"))
+    return dialect
+
+
+def compile_sql(statement: ClauseElement, db_type: Optional[str]) -> str:
+    """按数据库方言编译语句，标识符按方言规则引用（保留字、大小写敏感或含中文的名称）"""
+    return str(statement.compile(dialect=dialect_for(db_type)))
+
+
+def _number(value: Any) -> ColumnElement:
+    # 常量直接写入SQL，不生成绑定参数
+    return literal_column(repr(value))
+
+
+def table_alias(name: str, alias: str, fields: Sequence[str]) -> FromClause:
+    """带别名的表，fields 为查询中用到的字段；表名可以带schema前缀"""
+    schema, _, table_name = name.rpartition('.')
+    return table(table_name, *[column(field) for field in fields], schema=schema or None).alias(alias)
+
+
+def sampled_table(name: str, alias: str, fields: Sequence[str], rate: float,
+                  db_type: Optional[str]) -> Tuple[FromClause, Optional[ColumnElement]]:
+    """按比例抽样的表，返回表和需要加入 WHERE 的抽样条件。PostgreSQL、DuckDB使用可重复的行级 TABLESAMPLE，
+    其他数据库按行生成随机数筛选（MySQL使用固定种子）"""
+    schema, _, table_name = name.rpartition('.')
+    source = table(table_name, *[column(field) for field in fields], schema=schema or None)
+    percent = round(rate * 100, 6)
+    if db_type in _TABLESAMPLE_DB_TYPES:
+        method = func.bernoulli(literal_column(f"{percent} PERCENT" if db_type == "duckdb" else repr(percent)))
+        return source.tablesample(method, name=alias, seed=_number(settings.PIVOT_SAMPLE_SEED)), None
+    if db_type == "mysql":
+        sample = func.rand(_number(settings.PIVOT_SAMPLE_SEED)) < _number(rate)
+    elif db_type == "oracle":
+        sample = func.dbms_random.value() < _number(rate)
+    else:
+        # SQLite 的 random() 返回64位整数
+        sample = func.abs(func.random() % _number(1000000)) < _number(int(rate * 1000000))
+    return source.alias(alias), sample
+
+
+def join(left: FromClause, right: FromClause, on: ColumnElement, join_type: Optional[str]) -> FromClause:
+    join_type = (join_type or 'inner').lower()
+    if join_type == 'inner':
+        return left.join(right, on)
+    if join_type == 'left':
+        return left.outerjoin(right, on)
+    if join_type == 'full':
+        return left.outerjoin(right, on, full=True)
+    if join_type == 'right':
+        # 右连接改写为左连接，已连接的部分作为右侧
+        return right.outerjoin(left, on)
+    raise Exception(f"不支持的连接类型: {join_type}")
+
+
+def condition(expr: ColumnElement, filter_operator: str, param: str) -> ColumnElement:
+    """筛选条件，筛选值通过名为 param 的绑定参数传递（'is null' 没有绑定参数）"""
+    if filter_operator == 'is null':
+        return expr.is_(None)
+    if filter_operator == 'like':
+        return expr.like(bindparam(param))
+    comparator = _COMPARATORS.get(filter_operator)
+    if comparator is None:
+        raise Exception(f"不支持的筛选操作符: {filter_operator}")
+    return comparator(expr, bindparam(param))
+
+
+def supports_aggregation(aggregation: str, db_type: Optional[str]) -> bool:
+    """数据库能否直接计算该聚合；不能时只能由汇总表中的草图或本地快照回答"""
+    return aggregation.upper() != "APPROX_QUANTILE" or db_type in _QUANTILE_DB_TYPES
+
+
+def aggregate(aggregation: str, expr: ColumnElement, db_type: Optional[str] = None,
+              quantile: Optional[float] = None) -> ColumnElement:
+    """聚合表达式；SUM_SQUARES 为平方和，用于估算抽样结果的误差。
+    APPROX_COUNT_DISTINCT、APPROX_QUANTILE（quantile 为分位点）在DuckDB、Oracle上使用原生的近似函数，
+    其他数据库按精确的去重计数、连续分位数计算"""
+    aggregation = aggregation.upper()
+    if aggregation == "SUM_SQUARES":
+        return func.sum(expr * expr)
+    if aggregation == "APPROX_COUNT_DISTINCT":
+        if db_type in _APPROX_DB_TYPES:
+            return func.approx_count_distinct(expr)
+        return func.count(expr.distinct())
+    if aggregation == "APPROX_QUANTILE":
+        quantile = _number(0.5 if quantile is None else quantile)
+        if db_type == "duckdb":
+            return func.approx_quantile(expr, quantile)
+        if db_type == "oracle":
+            return within_group(func.approx_percentile(quantile), expr)
+        if db_type == "postgresql":
+            return within_group(func.percentile_cont(quantile), expr)
+        raise Exception(f"数据库不支持分位数度量: {db_type}，请启用数据集抽取或创建包含该度量的汇总表")
+    return getattr(func, check_identifier(aggregation).lower())(expr)
+
+
+def top_n(grouped: Select, dimension_labels: List[str], reaggregations: List[Tuple[str, Any]],
+          rank_label: str, n: int) -> Select:
+    """在分组结果上按 rank_label 列从大到小，为除最后一个维度外的每组维度值保留前 n 个最后维度的值，
+    其余的值合并为一行，最后维度为空值，OTHERS_COLUMN 列为1。reaggregations 为 [(列名, 再次聚合方式)]，
+    再次聚合方式为 SUM、MIN、MAX、("AVG", 求和列, 计数列)，或 None（不能再次聚合，合并行为空值）"""
+    grouped = grouped.subquery("grouped_query")
+    partition = [grouped.c[label] for label in dimension_labels[:-1]]
+    ranking = grouped.c[rank_label]
+    # 空值排在最后（MySQL不支持 NULLS LAST）
+    rank = func.row_number().over(
+        partition_by=partition or None,
+        order_by=[case((ranking.is_(None), _number(1)), else_=_number(0)), ranking.desc()]
+    ).label("pivot_rank")
+    ranked = select(*grouped.c, rank).subquery("ranked_query")
+
+    is_top = ranked.c.pivot_rank <= _number(n)
+    others = case((is_top, _number(0)), else_=_number(1))
+    last = case((is_top, ranked.c[dimension_labels[-1]]))
+    columns = [ranked.c[label] for label in dimension_labels[:-1]] + [last.label(dimension_labels[-1])]
+    for label, reaggregation in reaggregations:
+        if isinstance(reaggregation, tuple):
+            _, sum_label, count_label = reaggregation
+            expr = func.sum(ranked.c[sum_label]) * _number(1.0) / func.nullif(func.sum(ranked.c[count_label]), _number(0))
+        elif reaggregation is not None:
+            expr = getattr(func, reaggregation.lower())(ranked.c[label])
+        else:
+            # 前N组每组只有一行，取该行的值
+            expr = case((func.max(ranked.c.pivot_rank) <= _number(n), func.max(ranked.c[label])))
+        columns.append(expr.label(label))
+    columns.append(others.label(OTHERS_COLUMN))
+    return select(*columns).group_by(*[ranked.c[label] for label in dimension_labels[:-1]], last, others)
@@ -0,0 +1,22 @@
+import re
+
+# 筛选条件支持的操作符
+# 'is null' 没有筛选值
+FILTER_OPERATORS = ('=', '!=', '>', '<', '>=', '<=', 'like', 'is null')
+
+# 字段名只允许字母、数字、下划线、中文和表名前缀的点号
+_IDENTIFIER_PATTERN = re.compile(r"^[\w.]+$")
+
+
+def check_identifier(name: str) -> str:
+    """校验拼接到SQL中的字段名，筛选值通过绑定参数传递，字段名无法绑定"""
+    if not name or not _IDENTIFIER_PATTERN.match(name):
+        raise Exception(f"字段名无效: {name}")
+    return name
+
+
+def check_sort_order(sort_order) -> str:
+    sort_order = sort_order.upper() if sort_order else 'ASC'
+    if sort_order not in ('ASC', 'DESC'):
+        raise Exception(f"排序顺序无效: {sort_order}")
+    return sort_order
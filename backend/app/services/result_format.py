@@ -0,0 +1,161 @@
+import datetime
+import json
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence
+from app.services.cache.serialization import encode_result
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow 为可选依赖，未安装时不提供Arrow格式
+    pa = None
+
+# 支持的响应格式及对应的媒体类型
+ROWS_MEDIA_TYPE = "application/json"
+COLUMNAR_JSON_MEDIA_TYPE = "application/vnd.bi.columnar+json"
+COLUMNAR_BINARY_MEDIA_TYPE = "application/vnd.bi.columnar+zlib"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+_FORMATS_BY_MEDIA_TYPE = {
+    COLUMNAR_JSON_MEDIA_TYPE: "columnar",
+    COLUMNAR_BINARY_MEDIA_TYPE: "binary",
+    ARROW_MEDIA_TYPE: "arrow",
+}
+
+
+class QueryResult:
+    """查询结果，按数据库返回的行保存，按需转换为行字典或列式格式"""
+
+    def __init__(self, columns: Sequence[str], rows: Sequence[Sequence[Any]], total: Optional[int] = None,
+                 sql: Optional[str] = None, model_sql: Optional[str] = None, message: Optional[str] = None,
+                 next_cursor: Optional[str] = None):
+        self.columns = list(columns)
+        self.rows = rows
+        self.total = total
+        self.sql = sql
+        self.model_sql = model_sql
+        self.message = message
+        self.next_cursor = next_cursor
+
+    def records(self) -> List[Dict[str, Any]]:
+        """转换为字典列表（兼容原有的行格式响应）"""
+        columns = self.columns
+        return [dict(zip(columns, row)) for row in self.rows]
+
+    def column_values(self) -> List[List[Any]]:
+        """转换为按列存储的数组，不为每行创建字典"""
+        if not self.rows:
+            return [[] for _ in self.columns]
+        return [list(values) for values in zip(*self.rows)]
+
+
+def negotiate_format(accept: Optional[str]) -> str:
+    """根据Accept请求头选择响应格式，默认返回行格式JSON"""
+    if not accept:
+        return "rows"
+
+    candidates = []
+    for index, part in enumerate(accept.split(",")):
+        params = [p.strip() for p in part.split(";")]
+        media_type = params[0].lower()
+        quality = 1.0
+        for param in params[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        candidates.append((-quality, index, media_type))
+
+    for negative_quality, _, media_type in sorted(candidates):
+        if negative_quality >= 0:
+            continue
+        result_format = _FORMATS_BY_MEDIA_TYPE.get(media_type)
+        if result_format == "arrow" and pa is None:
+            continue
+        if result_format:
+            return result_format
+        if media_type in (ROWS_MEDIA_TYPE, "*/*", "application/*"):
+            return "rows"
+    return "rows"
+
+
+def _json_default(value: Any) -> Any:
+    # 列式格式面向图表和数据分析，数值统一输出为数字
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return str(value)
+
+
+def encode_columnar_json(result: QueryResult, success: bool = True) -> bytes:
+    """列式JSON：列名只出现一次，数据按列存储"""
+    payload = {
+        "success": success,
+        "columns": result.columns,
+        "values": result.column_values(),
+        "row_count": len(result.rows),
+        "total": result.total,
+        "sql": result.sql,
+        "model_sql": result.model_sql,
+        "message": result.message,
+        "next_cursor": result.next_cursor
+    }
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+
+def encode_columnar_binary(result: QueryResult) -> bytes:
+    """压缩的列式二进制格式，与结果缓存使用相同的编码"""
+    extra = {"total": result.total, "sql": result.sql, "model_sql": result.model_sql, "message": result.message,
+             "next_cursor": result.next_cursor}
+    return encode_result(result.columns, result.rows, extra)
+
+
+def encode_arrow(result: QueryResult) -> bytes:
+    """Arrow IPC 流格式"""
+    arrays = []
+    for values in result.column_values():
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # 混合类型的列按字符串输出
+            arrays.append(pa.array([None if v is None else str(v) for v in values]))
+    metadata = {"total": str(result.total) if result.total is not None else ""}
+    table = pa.Table.from_arrays(arrays, names=result.columns).replace_schema_metadata(metadata)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_result_body(result: QueryResult, result_format: str):
+    """按格式编码查询结果，返回响应体和媒体类型"""
+    if result_format == "arrow":
+        return encode_arrow(result), ARROW_MEDIA_TYPE
+    if result_format == "binary":
+        return encode_columnar_binary(result), COLUMNAR_BINARY_MEDIA_TYPE
+    return encode_columnar_json(result), COLUMNAR_JSON_MEDIA_TYPE
+
+
+def encode_ndjson_rows(columns: Sequence[str], rows: Sequence[Sequence[Any]]) -> bytes:
+    """NDJSON格式：每行一个JSON对象"""
+    lines = [
+        json.dumps(dict(zip(columns, row)), ensure_ascii=False, separators=(",", ":"), default=_json_default)
+        for row in rows
+    ]
+    return ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+
+
+def encode_columnar_batch(columns: Sequence[str], rows: Sequence[Sequence[Any]]) -> bytes:
+    """列式批次：每批一行JSON，包含列名和按列存储的数据"""
+    values = [list(v) for v in zip(*rows)] if rows else [[] for _ in columns]
+    payload = {"columns": list(columns), "values": values, "row_count": len(rows)}
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=_json_default).encode("utf-8") + b"\n"
+
+
+def encode_json_line(payload: Dict[str, Any]) -> bytes:
+    """编码为一行JSON，用于NDJSON流式响应"""
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=_json_default).encode("utf-8") + b"\n"
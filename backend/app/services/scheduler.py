@@ -0,0 +1,214 @@
+import asyncio
+import datetime
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.dashboards import Chart, Dashboard
+from app.services.cache import result_cache
+from app.services.query import model_plan_cache
+from app.services.analytics import analytics_store, extract_service, rollup_service
+from app.services.analytics.freshness import utcnow
+from app.services.dashboards import dashboard_service
+
+# 同一轮中先刷新快照和汇总表，再预热依赖它们的仪表盘
+_KIND_ORDER = {"extract": 0, "rollup": 1, "dashboard": 2}
+
+
+class RefreshScheduler:
+    """后台刷新调度器：按刷新间隔刷新数据集快照、构建汇总表，并在缓存过期前预热最近访问过的仪表盘。
+    到期时间加入随机抖动避免同时触发；全局限制同时执行的任务数，按数据源限制每分钟启动的任务数"""
+
+    def __init__(self):
+        # (类型, ID) -> 任务状态
+        self._jobs: Dict[Tuple[str, Any], Dict[str, Any]] = {}
+        self._running: Dict[Tuple[str, Any], asyncio.Task] = {}
+        # 数据源ID -> 最近一分钟内启动任务的时间
+        self._source_starts: Dict[Any, Deque[float]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"runs": 0, "failures": 0, "skipped": 0, "rate_limited": 0}
+
+    def _job(self, kind: str, job_id: Any) -> Dict[str, Any]:
+        job = self._jobs.get((kind, job_id))
+        if job is None:
+            job = self._jobs[(kind, job_id)] = {
+                "kind": kind, "id": job_id, "name": None, "source_ids": [], "interval": None,
+                "last_run": None, "next_run": None, "last_duration": None, "last_status": None,
+                "last_error": None, "runs": 0, "failures": 0, "last_viewed": None,
+                "jitter": random.random() * settings.REFRESH_SCHEDULER_JITTER
+            }
+        return job
+
+    def _prune(self, kind: str, job_ids) -> None:
+        # 去掉已删除或不再需要调度的任务
+        for key in [key for key in self._jobs if key[0] == kind and key[1] not in job_ids and key not in self._running]:
+            del self._jobs[key]
+
+    def _sync_jobs(self, kind: str, items: List[Dict[str, Any]], now: datetime.datetime) -> List[Dict[str, Any]]:
+        """合并快照、汇总表的任务信息，返回到期的任务；到期时间在刷新间隔之后随机推迟"""
+        self._prune(kind, {item["id"] for item in items})
+        due = []
+        for item in items:
+            job = self._job(kind, item["id"])
+            job.update(name=item["name"], source_ids=item["source_ids"], interval=item["interval"], last_run=item["last_run"])
+            if item["pending"] or item["last_run"] is None:
+                job["next_run"] = now
+            else:
+                job["next_run"] = item["last_run"] + datetime.timedelta(seconds=item["interval"] * (1 + job["jitter"]))
+            if item["due"] and job["next_run"] <= now:
+                due.append(job)
+        return due
+
+    def _dashboard_jobs(self, now: datetime.datetime) -> List[Dict[str, Any]]:
+        """最近访问过的仪表盘的预热任务；在刷新间隔之前随机提前预热，用户访问时缓存仍然有效"""
+        views = dashboard_service.recent_views(settings.DASHBOARD_WARM_WINDOW)
+        self._prune("dashboard", views.keys())
+        if not views:
+            return []
+        due = []
+        db = SessionLocal()
+        try:
+            dashboards = db.query(Dashboard).filter(Dashboard.id.in_(list(views.keys())), Dashboard.is_active == True).all()
+            for dashboard in dashboards:
+                job = self._job("dashboard", dashboard.id)
+                job.update(
+                    name=dashboard.name,
+                    interval=dashboard.refresh_interval or settings.DEFAULT_REFRESH_INTERVAL,
+                    source_ids=self._dashboard_sources(db, dashboard),
+                    last_viewed=views[dashboard.id]
+                )
+                # 访问时刚加载过的组件查询无需立即预热
+                last_run = job["last_run"] or views[dashboard.id]
+                job["next_run"] = last_run + datetime.timedelta(seconds=job["interval"] * (1 - job["jitter"]))
+                if job["next_run"] <= now:
+                    due.append(job)
+        finally:
+            db.close()
+        return due
+
+    def _dashboard_sources(self, db, dashboard: Dashboard) -> List[Any]:
+        chart_ids = {widget.get('chart_id') for widget in dashboard.widgets or [] if widget.get('type') == 'chart'}
+        model_ids = {chart.data_model_id for chart in db.query(Chart).filter(Chart.id.in_(chart_ids)).all()} if chart_ids else set()
+        sources = set()
+        for model_id in model_ids:
+            try:
+                sources.add(extract_service.localize_plan(model_plan_cache.get(db, model_id)).data_source.id)
+            except Exception:
+                continue
+        return sorted(sources, key=str)
+
+    def _take_rate(self, source_ids: List[Any]) -> bool:
+        """任务涉及的数据源在最近一分钟内启动的任务数都未达到上限时占用一次额度"""
+        now = time.monotonic()
+        for source_id in source_ids:
+            starts = self._source_starts.setdefault(source_id, deque())
+            while starts and now - starts[0] >= 60:
+                starts.popleft()
+            if len(starts) >= settings.REFRESH_SOURCE_RATE_LIMIT:
+                return False
+        for source_id in source_ids:
+            self._source_starts[source_id].append(now)
+        return True
+
+    async def _execute(self, job: Dict[str, Any]) -> bool:
+        """执行任务，返回是否实际执行（其他worker正在执行或已执行时返回False）"""
+        if job["kind"] == "extract":
+            return await extract_service.refresh(job["id"], only_if_due=True) is not None
+        if job["kind"] == "rollup":
+            return await rollup_service.build(job["id"], only_if_due=True) is not None
+        # 多个worker之间同一仪表盘在半个刷新间隔内只预热一次，锁到期后自动释放
+        token = await result_cache.try_lock(f"warm:dashboard:{job['id']}", max(1, int(job["interval"] / 2)))
+        if token is None:
+            return False
+        counts = await dashboard_service.warm(job["id"])
+        if counts["failed"]:
+            raise Exception(f"{counts['failed']} 个组件预热失败")
+        return True
+
+    async def _run(self, job: Dict[str, Any]) -> None:
+        key = (job["kind"], job["id"])
+        start = time.perf_counter()
+        try:
+            executed = await self._execute(job)
+            job["last_status"] = "succeeded" if executed else "skipped"
+            job["last_error"] = None
+            self._stats["runs" if executed else "skipped"] += 1
+        except Exception as e:
+            job["last_status"] = "failed"
+            job["last_error"] = str(e)
+            job["failures"] += 1
+            self._stats["failures"] += 1
+        finally:
+            job["runs"] += 1
+            job["last_duration"] = round(time.perf_counter() - start, 3)
+            if job["kind"] == "dashboard":
+                job["last_run"] = utcnow()
+            # 每次执行后重新抽样抖动，避免多个任务长期保持同一节奏
+            job["jitter"] = random.random() * settings.REFRESH_SCHEDULER_JITTER
+            self._running.pop(key, None)
+
+    async def run_due(self) -> List[Dict[str, Any]]:
+        """启动到期的任务，返回本轮启动的任务。先快照、汇总表，再按最近访问时间预热仪表盘；
+        达到并发上限或数据源额度用尽的任务留到下一轮"""
+        now = utcnow()
+        due = []
+        if analytics_store.available:
+            due += self._sync_jobs("extract", extract_service.jobs(), now)
+            due += self._sync_jobs("rollup", rollup_service.jobs(), now)
+        due += self._dashboard_jobs(now)
+        due.sort(key=lambda job: (
+            _KIND_ORDER[job["kind"]],
+            -(job["last_viewed"].timestamp() if job["last_viewed"] else 0),
+            job["next_run"]
+        ))
+
+        started = []
+        for job in due:
+            key = (job["kind"], job["id"])
+            if key in self._running:
+                continue
+            if len(self._running) >= settings.REFRESH_SCHEDULER_MAX_CONCURRENCY:
+                break
+            if not self._take_rate(job["source_ids"]):
+                self._stats["rate_limited"] += 1
+                continue
+            self._running[key] = asyncio.create_task(self._run(job))
+            started.append(job)
+        return started
+
+    async def _schedule(self) -> None:
+        while True:
+            try:
+                await self.run_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"刷新调度失败: {e}")
+            await asyncio.sleep(settings.REFRESH_SCHEDULER_INTERVAL)
+
+    def start(self) -> None:
+        """启动刷新调度任务"""
+        if self._task is None and settings.REFRESH_SCHEDULER_ENABLED:
+            self._task = asyncio.create_task(self._schedule())
+
+    async def stop(self) -> None:
+        """停止刷新调度任务，取消正在执行的任务"""
+        tasks = list(self._running.values())
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_status(self) -> Dict[str, Any]:
+        """调度器状态：各任务的下次执行时间、上次耗时和结果"""
+        jobs = []
+        for key, job in sorted(self._jobs.items(), key=lambda item: (_KIND_ORDER[item[0][0]], str(item[0][1]))):
+            jobs.append({name: value for name, value in job.items() if name != "jitter"} | {"running": key in self._running})
+        return {"enabled": self._task is not None, "stats": dict(self._stats), "jobs": jobs}
+
+
+refresh_scheduler = RefreshScheduler()
@@ -1,3 +1,11 @@
 from app.services.sources.data_source_service import DataSourceService
+from app.services.sources.engine_registry import engine_registry
+from app.services.sources.health import HealthProber, health_prober
+from app.services.sources.metadata_catalog import MetadataCatalog, metadata_catalog
+from app.services.sources.query_executor import query_executor
+from app.services.cache import invalidation_bus
 
 data_source_service = DataSourceService()
+
+# 数据源更新或删除时移除其元数据目录
+invalidation_bus.subscribe(metadata_catalog.invalidate)
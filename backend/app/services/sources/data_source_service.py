@@ -1,17 +1,23 @@
 import asyncio
+import time
 import mysql.connector
 import oracledb
 import psycopg2
 import pandas as pd
-import requests
 from typing import List, Optional
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.future import select
 from app.models.sources import DataSource
 from app.schemas.sources import DataSourceCreate, DataSourceUpdate, TestConnectionRequest
 from app.core.config import settings
 from app.core.database import SessionLocal
+from app.services.sources.engine_registry import engine_registry, CONNECTION_FIELDS
+from app.services.sources.query_executor import query_executor
+from app.services.sources.metadata_catalog import metadata_catalog
+from app.services.sources.health import health_prober
+from app.services.cache import invalidation_bus
+from app.services.analytics import analytics_store, excel_cache, api_connector, API_TABLE
+from app.services.analytics.api import api_config
 
 class DataSourceService:
     def __init__(self):
@@ -22,15 +28,19 @@ class DataSourceService:
         try:
             # 验证数据源连接
             test_request = TestConnectionRequest(**data_source.model_dump())
+            start = time.perf_counter()
             test_result = await self.test_connection(test_request)
             if not test_result["success"]:
                 raise Exception(f"连接测试失败: {test_result['message']}")
+            elapsed = time.perf_counter() - start
 
             # 创建数据源
             db_data_source = DataSource(**data_source.model_dump())
             db.add(db_data_source)
             db.commit()
             db.refresh(db_data_source)
+            # 连接测试的结果作为第一次健康检查，无需等待后台检查
+            health_prober.record(db_data_source, elapsed)
             return db_data_source
         finally:
             db.close()
@@ -67,13 +77,16 @@ class DataSourceService:
             update_data = data_source_update.model_dump(exclude_unset=True)
             
             # 如果更新了连接信息，验证连接
-            if any(key in update_data for key in ["host", "port", "database", "username", "password", "file_path", "api_url"]):
+            elapsed = None
+            if any(key in update_data for key in ["host", "port", "database", "username", "password", "file_path", "api_url", "api_options"]):
                 # 构建测试请求
                 test_data = {**db_data_source.__dict__, **update_data}
                 test_request = TestConnectionRequest(**test_data)
+                start = time.perf_counter()
                 test_result = await self.test_connection(test_request)
                 if not test_result["success"]:
                     raise Exception(f"连接测试失败: {test_result['message']}")
+                elapsed = time.perf_counter() - start
 
             # 更新数据源
             for key, value in update_data.items():
@@ -81,6 +94,18 @@ class DataSourceService:
 
             db.commit()
             db.refresh(db_data_source)
+
+            # 连接配置变化后释放旧连接池，下次查询时按新配置重建
+            if any(key in update_data for key in CONNECTION_FIELDS):
+                engine_registry.dispose(source_id)
+            if any(key.startswith("api_") for key in update_data):
+                api_connector.dispose(source_id)
+            # 连接配置变化后重新判断健康状态，连接测试的结果作为第一次检查
+            if elapsed is not None:
+                health_prober.forget(source_id)
+                health_prober.record(db_data_source, elapsed)
+            # 数据源变化后，该数据源上的查询结果缓存失效
+            await invalidation_bus.publish("source", source_id)
             return db_data_source
         finally:
             db.close()
@@ -95,23 +120,28 @@ class DataSourceService:
 
             db.delete(db_data_source)
             db.commit()
+            engine_registry.dispose(source_id)
+            api_connector.dispose(source_id)
+            health_prober.forget(source_id)
+            await invalidation_bus.publish("source", source_id)
         finally:
             db.close()
 
     async def test_connection(self, request: TestConnectionRequest) -> dict:
         try:
+            # 连接测试包含阻塞的驱动调用，放到执行器线程中运行
             if request.type == "database":
-                return await self._test_database_connection(request)
+                return await query_executor.run(None, self._test_database_connection, request)
             elif request.type == "excel":
-                return await self._test_excel_connection(request)
+                return await query_executor.run(None, self._test_excel_connection, request)
             elif request.type == "api":
-                return await self._test_api_connection(request)
+                return await query_executor.run(None, self._test_api_connection, request)
             else:
                 return {"success": False, "message": f"不支持的数据源类型: {request.type}"}
         except Exception as e:
             return {"success": False, "message": str(e)}
 
-    async def _test_database_connection(self, request: TestConnectionRequest) -> dict:
+    def _test_database_connection(self, request: TestConnectionRequest) -> dict:
         if not request.db_type:
             return {"success": False, "message": "数据库类型不能为空"}
 
@@ -147,33 +177,30 @@ class DataSourceService:
         except Exception as e:
             return {"success": False, "message": str(e)}
 
-    async def _test_excel_connection(self, request: TestConnectionRequest) -> dict:
+    def _test_excel_connection(self, request: TestConnectionRequest) -> dict:
         if not request.file_path:
             return {"success": False, "message": "文件路径不能为空"}
 
         try:
+            if analytics_store.available:
+                # 解析全部工作表并缓存为列式文件，后续获取表、字段和查询直接使用缓存
+                sheets = excel_cache.load(request.file_path)["sheets"]
+                rows = sum(sheet["row_count"] for sheet in sheets)
+                return {"success": True, "message": f"文件读取成功，包含 {len(sheets)} 个工作表，共 {rows} 行"}
             # 尝试读取Excel文件的前几行
             df = pd.read_excel(request.file_path, nrows=5)
             return {"success": True, "message": f"文件读取成功，包含 {len(df.columns)} 列"}
         except Exception as e:
             return {"success": False, "message": str(e)}
 
-    async def _test_api_connection(self, request: TestConnectionRequest) -> dict:
+    def _test_api_connection(self, request: TestConnectionRequest) -> dict:
         if not request.api_url:
             return {"success": False, "message": "API地址不能为空"}
 
         try:
-            method = request.api_method or "get"
-            headers = request.api_headers or {}
-            data = request.api_body or {}
-
-            if method.lower() == "get":
-                response = requests.get(request.api_url, headers=headers, params=data, timeout=10)
-            else:
-                response = requests.post(request.api_url, headers=headers, json=data, timeout=10)
-
-            response.raise_for_status()
-            return {"success": True, "message": f"API请求成功，状态码: {response.status_code}"}
+            # 请求第一页并按分页与记录路径配置推断字段
+            fields, count = api_connector.sample_fields(api_config(request))
+            return {"success": True, "message": f"API请求成功，第一页包含 {count} 条记录、{len(fields)} 个字段"}
         except Exception as e:
             return {"success": False, "message": str(e)}
 
@@ -182,118 +209,99 @@ class DataSourceService:
         try:
             # 获取数据源信息
             data_source = await self.get_by_id(source_id)
-            
-            # 根据数据源类型返回不同的表列表
-            if data_source.type == "database":
-                if data_source.db_type == "mysql":
-                    conn = mysql.connector.connect(
-                        host=data_source.host,
-                        port=data_source.port,
-                        user=data_source.username,
-                        password=data_source.password,
-                        database=data_source.database
-                    )
-                    cursor = conn.cursor()
-                    cursor.execute("SHOW TABLES")
-                    tables = [table[0] for table in cursor.fetchall()]
-                    cursor.close()
-                    conn.close()
-                    return tables
-                elif data_source.db_type == "postgresql":
-                    conn = psycopg2.connect(
-                        host=data_source.host,
-                        port=data_source.port,
-                        database=data_source.database,
-                        user=data_source.username,
-                        password=data_source.password
-                    )
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'")
-                    tables = [table[0] for table in cursor.fetchall()]
-                    cursor.close()
-                    conn.close()
-                    return tables
-                elif data_source.db_type == "oracle":
-                    conn = oracledb.connect(
-                        user=data_source.username,
-                        password=data_source.password,
-                        dsn=f"{data_source.host}:{data_source.port}/{data_source.database}"
-                    )
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT table_name FROM user_tables")
-                    tables = [table[0] for table in cursor.fetchall()]
-                    cursor.close()
-                    conn.close()
-                    return tables
-            elif data_source.type == "excel":
-                # Excel文件作为单个表处理
-                return ["Sheet1"]
-            elif data_source.type == "api":
-                # API数据源作为单个表处理
-                return ["API Data"]
-            
-            return []
+            # 元数据目录已缓存时直接返回，不占用执行器线程
+            catalog = metadata_catalog.peek(data_source) if data_source.type == "database" else None
+            if catalog is not None:
+                return list(catalog["tables"])
+            return await query_executor.run(data_source, self._fetch_tables, data_source)
         except Exception as e:
             print(f"获取表列表失败: {e}")
             return []
 
+    def _fetch_tables(self, data_source: DataSource) -> List[str]:
+        """在执行器线程中查询表列表"""
+        # 根据数据源类型返回不同的表列表
+        if data_source.type == "database":
+            # 首次访问时批量加载整个schema的元数据并缓存
+            return metadata_catalog.table_names(data_source)
+        elif data_source.type == "excel":
+            # Excel文件的每个工作表作为一个表
+            if analytics_store.available:
+                return excel_cache.sheet_names(data_source.file_path)
+            with pd.ExcelFile(data_source.file_path) as workbook:
+                return list(workbook.sheet_names)
+        elif data_source.type == "api":
+            # API数据源作为单个表处理
+            return [API_TABLE]
+        
+        return []
+
     async def get_fields(self, source_id: int, table_name: str) -> List[str]:
         """获取表的字段列表"""
         try:
             # 获取数据源信息
             data_source = await self.get_by_id(source_id)
-            
-            # 根据数据源类型返回不同的字段列表
-            if data_source.type == "database":
-                if data_source.db_type == "mysql":
-                    conn = mysql.connector.connect(
-                        host=data_source.host,
-                        port=data_source.port,
-                        user=data_source.username,
-                        password=data_source.password,
-                        database=data_source.database
-                    )
-                    cursor = conn.cursor()
-                    cursor.execute(f"DESCRIBE {table_name}")
-                    fields = [field[0] for field in cursor.fetchall()]
-                    cursor.close()
-                    conn.close()
-                    return fields
-                elif data_source.db_type == "postgresql":
-                    conn = psycopg2.connect(
-                        host=data_source.host,
-                        port=data_source.port,
-                        database=data_source.database,
-                        user=data_source.username,
-                        password=data_source.password
-                    )
-                    cursor = conn.cursor()
-                    cursor.execute(f"SELECT column_name FROM information_schema.columns WHERE table_name = '{table_name}'")
-                    fields = [field[0] for field in cursor.fetchall()]
-                    cursor.close()
-                    conn.close()
-                    return fields
-                elif data_source.db_type == "oracle":
-                    conn = oracledb.connect(
-                        user=data_source.username,
-                        password=data_source.password,
-                        dsn=f"{data_source.host}:{data_source.port}/{data_source.database}"
-                    )
-                    cursor = conn.cursor()
-                    cursor.execute(f"SELECT column_name FROM user_tab_columns WHERE table_name = '{table_name.upper()}'")
-                    fields = [field[0] for field in cursor.fetchall()]
-                    cursor.close()
-                    conn.close()
-                    return fields
-            elif data_source.type == "excel":
-                # 读取Excel文件的列名
-                df = pd.read_excel(data_source.file_path, nrows=0)
-                return list(df.columns)
-            elif data_source.type == "api":
-                # 模拟API字段
-                return ["field1", "field2", "field3"]
-            
-            return []
+            catalog = metadata_catalog.peek(data_source) if data_source.type == "database" else None
+            if catalog is not None:
+                return [column["name"] for column in metadata_catalog.table(data_source, table_name)["columns"]]
+            return await query_executor.run(data_source, self._fetch_fields, data_source, table_name)
         except Exception as e:
             print(f"获取字段列表失败: {e}")
             return []
+
+    def _fetch_fields(self, data_source: DataSource, table_name: str) -> List[str]:
+        """在执行器线程中查询字段列表"""
+        # 根据数据源类型返回不同的字段列表
+        if data_source.type == "database":
+            return [column["name"] for column in metadata_catalog.table(data_source, table_name)["columns"]]
+        elif data_source.type == "excel":
+            # 读取工作表的列名
+            if analytics_store.available:
+                return excel_cache.columns(data_source.file_path, table_name)
+            df = pd.read_excel(data_source.file_path, sheet_name=table_name, nrows=0)
+            return list(df.columns)
+        elif data_source.type == "api":
+            # 展开后的JSON字段，未拉取过数据时根据第一页抽样推断
+            return api_connector.fields(data_source)
+        
+        return []
+
+    async def get_table_metadata(self, source_id: int, table_name: str) -> dict:
+        """获取表的字段、类型、行数估计和索引"""
+        data_source = await self.get_by_id(source_id)
+        catalog = metadata_catalog.peek(data_source) if data_source.type == "database" else None
+        if catalog is not None:
+            return metadata_catalog.table(data_source, table_name)
+        return await query_executor.run(data_source, self._fetch_table_metadata, data_source, table_name)
+
+    def _fetch_table_metadata(self, data_source: DataSource, table_name: str) -> dict:
+        if data_source.type == "database":
+            return metadata_catalog.table(data_source, table_name)
+        if not analytics_store.available:
+            raise Exception("未安装duckdb，无法获取表的元数据")
+        if data_source.type == "excel":
+            # Excel、API数据源的类型和行数来自本地的列式缓存
+            table = excel_cache.sheet(data_source.file_path, table_name)
+        elif data_source.type == "api":
+            table = api_connector.load(api_config(data_source), data_source.refresh_interval, data_source.id)
+        else:
+            raise Exception(f"不支持的数据源类型: {data_source.type}")
+        return {
+            "name": table_name,
+            "row_estimate": table["row_count"],
+            "columns": [{"name": name, "type": table["column_types"].get(name)} for name in table["columns"]],
+            "indexes": []
+        }
+
+    async def refresh_schema(self, source_id: int) -> int:
+        """重新加载数据库数据源的元数据目录，返回表的数量"""
+        data_source = await self.get_by_id(source_id)
+        if data_source.type != "database":
+            raise Exception("只有数据库数据源需要刷新元数据")
+        catalog = await query_executor.run(data_source, metadata_catalog.get, data_source, True)
+        return len(catalog["tables"])
+
+    async def probe(self, source_id: int) -> dict:
+        """立即检查数据源的健康状态"""
+        data_source = await self.get_by_id(source_id)
+        return await health_prober.probe(data_source)
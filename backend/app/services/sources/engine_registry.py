@@ -0,0 +1,210 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.engine import Engine, URL
+from sqlalchemy.pool import NullPool
+from app.core.config import settings
+
+# 各驱动的连接超时参数(秒)
+_CONNECT_TIMEOUT_ARGS = {
+    "mysql": "connection_timeout",
+    "postgresql": "connect_timeout",
+    "oracle": "tcp_connect_timeout",
+    "sqlite": "timeout"
+}
+
+# 影响数据库连接的数据源字段，任一字段变化都需要重建连接池
+CONNECTION_FIELDS = ["type", "db_type", "host", "port", "database", "username", "password", "connection_pool"]
+
+
+def build_db_url(data_source) -> URL:
+    """根据数据源配置构建SQLAlchemy连接URL"""
+    if data_source.db_type == 'mysql':
+        return URL.create(
+            "mysql+mysqlconnector",
+            username=data_source.username,
+            password=data_source.password,
+            host=data_source.host,
+            port=data_source.port,
+            database=data_source.database
+        )
+    elif data_source.db_type == 'postgresql':
+        return URL.create(
+            "postgresql+psycopg2",
+            username=data_source.username,
+            password=data_source.password,
+            host=data_source.host,
+            port=data_source.port,
+            database=data_source.database
+        )
+    elif data_source.db_type == 'oracle':
+        # 与连接测试保持一致，database 作为服务名使用
+        return URL.create(
+            "oracle+oracledb",
+            username=data_source.username,
+            password=data_source.password,
+            host=data_source.host,
+            port=data_source.port,
+            query={"service_name": data_source.database} if data_source.database else {}
+        )
+    # 默认为SQLite
+    return URL.create("sqlite", database="app.db")
+
+
+class EngineRegistry:
+    """进程级数据库引擎注册表，按数据源ID缓存带连接池的引擎"""
+
+    def __init__(self):
+        self._engines: Dict[int, Tuple[tuple, Engine]] = {}
+        # 健康检查使用的不带连接池的引擎
+        self._probe_engines: Dict[int, Tuple[tuple, Engine]] = {}
+        self._stats: Dict[int, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _fingerprint(self, data_source) -> tuple:
+        return tuple(getattr(data_source, key, None) for key in CONNECTION_FIELDS)
+
+    def _pool_sizes(self, data_source) -> Tuple[int, int]:
+        # 单个数据源的连接池大小不超过全局上限，溢出连接数同样受全局上限约束
+        pool_size = max(1, min(data_source.connection_pool or 10, settings.MAX_CONNECTION_POOL))
+        max_overflow = max(0, min(pool_size, settings.MAX_CONNECTION_POOL - pool_size))
+        return pool_size, max_overflow
+
+    def _create_engine(self, data_source) -> Engine:
+        url = build_db_url(data_source)
+        if url.get_backend_name() == "sqlite":
+            return create_engine(url, connect_args={"check_same_thread": False}, pool_pre_ping=True)
+
+        pool_size, max_overflow = self._pool_sizes(data_source)
+        return create_engine(
+            url,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=settings.CONNECTION_POOL_TIMEOUT,
+            pool_recycle=settings.CONNECTION_POOL_RECYCLE,
+            pool_pre_ping=True
+        )
+
+    def get_engine(self, data_source) -> Engine:
+        """获取数据源对应的引擎，连接配置变化时自动重建"""
+        fingerprint = self._fingerprint(data_source)
+        with self._lock:
+            entry = self._engines.get(data_source.id)
+            if entry and entry[0] == fingerprint:
+                return entry[1]
+
+            # 配置已变化（例如其他进程更新了数据源），释放旧连接池
+            if entry:
+                entry[1].dispose()
+
+            engine = self._create_engine(data_source)
+            self._engines[data_source.id] = (fingerprint, engine)
+            self._stats[data_source.id] = {
+                "checkouts": 0,
+                "total_wait_time": 0.0,
+                "max_wait_time": 0.0,
+                "timeouts": 0
+            }
+            return engine
+
+    @contextmanager
+    def connect(self, data_source):
+        """从连接池获取连接，并记录获取连接的等待时间"""
+        engine = self.get_engine(data_source)
+        start = time.perf_counter()
+        try:
+            conn = engine.connect()
+        except PoolTimeoutError:
+            self._record_checkout(data_source.id, time.perf_counter() - start, timed_out=True)
+            raise
+        self._record_checkout(data_source.id, time.perf_counter() - start)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _probe_engine(self, data_source, timeout: float) -> Engine:
+        fingerprint = self._fingerprint(data_source) + (timeout,)
+        with self._lock:
+            entry = self._probe_engines.get(data_source.id)
+            if entry and entry[0] == fingerprint:
+                return entry[1]
+            url = build_db_url(data_source)
+            connect_args = {_CONNECT_TIMEOUT_ARGS[url.get_backend_name()]: timeout}
+            if url.get_backend_name() == "sqlite":
+                connect_args["check_same_thread"] = False
+            engine = create_engine(url, connect_args=connect_args, poolclass=NullPool)
+            self._probe_engines[data_source.id] = (fingerprint, engine)
+            return engine
+
+    @contextmanager
+    def probe_connect(self, data_source, timeout: float):
+        """健康检查使用的连接：不经过查询连接池，连接池被查询占满时不会等待获取连接而误判为不可用；
+        驱动的连接超时为 timeout"""
+        conn = self._probe_engine(data_source, timeout).connect()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _record_checkout(self, source_id: int, wait_time: float, timed_out: bool = False) -> None:
+        with self._lock:
+            stats = self._stats.get(source_id)
+            if stats is None:
+                return
+            if timed_out:
+                stats["timeouts"] += 1
+                return
+            stats["checkouts"] += 1
+            stats["total_wait_time"] += wait_time
+            stats["max_wait_time"] = max(stats["max_wait_time"], wait_time)
+
+    def dispose(self, source_id: int) -> None:
+        """释放指定数据源的连接池"""
+        with self._lock:
+            entry = self._engines.pop(source_id, None)
+            self._stats.pop(source_id, None)
+            self._probe_engines.pop(source_id, None)
+        if entry:
+            entry[1].dispose()
+
+    def dispose_all(self) -> None:
+        """释放所有连接池"""
+        with self._lock:
+            entries = list(self._engines.values())
+            self._engines.clear()
+            self._stats.clear()
+            self._probe_engines.clear()
+        for _, engine in entries:
+            engine.dispose()
+
+    def get_pool_stats(self, source_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """获取连接池统计信息"""
+        with self._lock:
+            items = [(sid, entry[1], dict(self._stats.get(sid, {}))) for sid, entry in self._engines.items()]
+
+        result = []
+        for sid, engine, stats in items:
+            if source_id is not None and sid != source_id:
+                continue
+            pool = engine.pool
+            checkouts = stats.get("checkouts", 0)
+            result.append({
+                "source_id": sid,
+                "pool_size": pool.size() if hasattr(pool, "size") else None,
+                "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+                "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,
+                # QueuePool.overflow() 在未用满连接池时为负数，这里只统计实际溢出的连接
+                "overflow": max(0, pool.overflow()) if hasattr(pool, "overflow") else None,
+                "checkouts": checkouts,
+                "timeouts": stats.get("timeouts", 0),
+                "avg_wait_time": stats.get("total_wait_time", 0.0) / checkouts if checkouts else 0.0,
+                "max_wait_time": stats.get("max_wait_time", 0.0)
+            })
+        return result
+
+
+engine_registry = EngineRegistry()
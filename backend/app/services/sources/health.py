@@ -0,0 +1,173 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+import requests
+from sqlalchemy import text
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.sources import DataSource
+from app.services.analytics.freshness import utcnow
+from app.services.sources.engine_registry import engine_registry
+
+# 健康检查耗时直方图的桶上限(秒)
+_LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class HealthProber:
+    """数据源健康检查：后台定期对每个启用的数据源执行轻量检查（数据库通过不经过连接池、带驱动连接超时的独立连接执行 SELECT 1），
+    记录耗时直方图和可用率。连续失败的数据源标记为不可用，查询直接失败或返回过期缓存，不再等待驱动超时"""
+
+    def __init__(self):
+        # 数据源ID -> 健康状态
+        self._states: Dict[Any, Dict[str, Any]] = {}
+        # 检查使用独立的线程池，不与查询争用数据源执行器
+        self._executor = ThreadPoolExecutor(max_workers=settings.HEALTH_PROBE_CONCURRENCY, thread_name_prefix="health-probe")
+        # 数据源ID -> 正在执行的检查，上一次检查未结束时不重复发起
+        self._probes: Dict[Any, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _state(self, data_source) -> Dict[str, Any]:
+        state = self._states.get(data_source.id)
+        if state is None:
+            state = self._states[data_source.id] = {
+                "source_id": data_source.id, "status": "unknown", "checks": 0, "failures": 0,
+                "consecutive_failures": 0, "last_checked": None, "last_success": None, "last_error": None,
+                "last_latency": None, "latency_buckets": [0] * (len(_LATENCY_BUCKETS) + 1)
+            }
+        state.update(name=data_source.name, type=data_source.type)
+        return state
+
+    def _ping(self, data_source) -> None:
+        """在线程池中执行一次轻量检查，失败时抛出异常"""
+        if data_source.type == "database":
+            # 连接超时交给驱动，不经过查询连接池，避免排队等待连接被当作数据源不可用
+            with engine_registry.probe_connect(data_source, settings.HEALTH_PROBE_TIMEOUT) as conn:
+                conn.execute(text("SELECT 1 FROM DUAL" if conn.dialect.name == "oracle" else "SELECT 1"))
+        elif data_source.type == "excel":
+            if not data_source.file_path or not os.access(data_source.file_path, os.R_OK):
+                raise Exception(f"文件不存在或不可读: {data_source.file_path}")
+        elif data_source.type == "api":
+            # 只检查接口是否可达，不下载数据；服务端错误视为不可用
+            response = requests.head(data_source.api_url, headers=data_source.api_headers or {},
+                                     timeout=settings.HEALTH_PROBE_TIMEOUT, allow_redirects=True)
+            if response.status_code >= 500:
+                raise Exception(f"API返回状态码: {response.status_code}")
+
+    def record(self, data_source, latency: float, error: Optional[str] = None) -> Dict[str, Any]:
+        """记录一次检查结果并更新状态；连接测试的结果也会记录"""
+        state = self._state(data_source)
+        state["checks"] += 1
+        state["last_checked"] = utcnow()
+        state["last_latency"] = round(latency, 4)
+        bucket = next((i for i, bound in enumerate(_LATENCY_BUCKETS) if latency <= bound), len(_LATENCY_BUCKETS))
+        state["latency_buckets"][bucket] += 1
+        if error is None:
+            state["consecutive_failures"] = 0
+            state["last_success"] = state["last_checked"]
+            state["last_error"] = None
+            state["status"] = "degraded" if latency > settings.HEALTH_SLOW_THRESHOLD else "healthy"
+        else:
+            state["failures"] += 1
+            state["consecutive_failures"] += 1
+            state["last_error"] = error
+            state["status"] = "unavailable" if state["consecutive_failures"] >= settings.HEALTH_FAILURE_THRESHOLD else "degraded"
+        return state
+
+    def _timed_ping(self, data_source) -> Tuple[float, Optional[str]]:
+        """在检查线程中执行一次检查并计时，返回耗时和错误；耗时不包含在线程池中排队的时间"""
+        start = time.perf_counter()
+        try:
+            self._ping(data_source)
+            error = None
+        except Exception as e:
+            error = str(e)
+        latency = time.perf_counter() - start
+        if error is None and latency > settings.HEALTH_PROBE_TIMEOUT:
+            error = f"健康检查超时({settings.HEALTH_PROBE_TIMEOUT}秒)"
+        return latency, error
+
+    async def _run_probe(self, data_source) -> Dict[str, Any]:
+        try:
+            latency, error = await asyncio.get_running_loop().run_in_executor(self._executor, self._timed_ping, data_source)
+            return self.record(data_source, latency, error)
+        finally:
+            self._probes.pop(data_source.id, None)
+
+    def _start_probe(self, data_source) -> asyncio.Task:
+        task = self._probes.get(data_source.id)
+        if task is None:
+            task = self._probes[data_source.id] = asyncio.create_task(self._run_probe(data_source))
+        return task
+
+    async def probe(self, data_source) -> Dict[str, Any]:
+        """检查一个数据源；该数据源上一次检查仍在执行时等待其结果，不重复发起"""
+        return await asyncio.shield(self._start_probe(data_source))
+
+    async def probe_all(self) -> List[Dict[str, Any]]:
+        """检查所有启用的数据源；个别数据源的检查迟迟不结束时不阻塞本轮，其结果在完成后记录"""
+        db = SessionLocal()
+        try:
+            data_sources = db.query(DataSource).filter(DataSource.is_active == True).all()
+            for data_source in data_sources:
+                db.expunge(data_source)
+        finally:
+            db.close()
+        # 去掉已删除或停用的数据源
+        active = {data_source.id for data_source in data_sources}
+        for source_id in [source_id for source_id in self._states if source_id not in active]:
+            del self._states[source_id]
+        tasks = [self._start_probe(data_source) for data_source in data_sources]
+        if tasks:
+            await asyncio.wait(tasks, timeout=settings.HEALTH_PROBE_INTERVAL)
+        return [self._state(data_source) for data_source in data_sources]
+
+    def is_available(self, source_id: Any) -> bool:
+        state = self._states.get(source_id)
+        return state is None or state["status"] != "unavailable"
+
+    def check_available(self, data_source) -> None:
+        """数据源已被标记为不可用时直接抛出异常，调用方可以返回过期缓存"""
+        state = self._states.get(data_source.id)
+        if state is not None and state["status"] == "unavailable":
+            raise Exception(f"数据源暂不可用: {state['name']}: {state['last_error']}")
+
+    def forget(self, source_id: Any) -> None:
+        """数据源配置变化或删除后清除其状态，由下一次检查重新判断"""
+        self._states.pop(source_id, None)
+
+    async def _schedule(self) -> None:
+        while True:
+            try:
+                await self.probe_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"数据源健康检查失败: {e}")
+            await asyncio.sleep(settings.HEALTH_PROBE_INTERVAL)
+
+    def start(self) -> None:
+        """启动后台健康检查任务"""
+        if self._task is None and settings.HEALTH_PROBE_ENABLED:
+            self._task = asyncio.create_task(self._schedule())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def get_status(self) -> List[Dict[str, Any]]:
+        """各数据源的健康状态、可用率和检查耗时直方图"""
+        result = []
+        for state in sorted(self._states.values(), key=lambda state: str(state["source_id"])):
+            status = {name: value for name, value in state.items() if name != "latency_buckets"}
+            status["availability"] = round(1 - state["failures"] / state["checks"], 4) if state["checks"] else None
+            bounds = [f"<={bound}s" for bound in _LATENCY_BUCKETS] + [f">{_LATENCY_BUCKETS[-1]}s"]
+            status["latency_histogram"] = dict(zip(bounds, state["latency_buckets"]))
+            result.append(status)
+        return result
+
+
+health_prober = HealthProber()
@@ -0,0 +1,172 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from sqlalchemy import text
+from app.core.config import settings
+from app.services.sources.engine_registry import engine_registry, CONNECTION_FIELDS
+
+# 按数据库方言批量查询整个schema的表（含行数估计）、字段和索引，每类信息各一次查询，不按表逐个查询
+_CATALOG_QUERIES = {
+    "mysql": {
+        "tables": "SELECT table_name, table_rows FROM information_schema.tables WHERE table_schema = DATABASE() ORDER BY table_name",
+        "columns": "SELECT table_name, column_name, data_type, is_nullable FROM information_schema.columns "
+                   "WHERE table_schema = DATABASE() ORDER BY table_name, ordinal_position",
+        "indexes": "SELECT table_name, index_name, column_name, non_unique = 0 FROM information_schema.statistics "
+                   "WHERE table_schema = DATABASE() ORDER BY table_name, index_name, seq_in_index"
+    },
+    "postgresql": {
+        "tables": "SELECT t.table_name, c.reltuples FROM information_schema.tables t "
+                  "LEFT JOIN pg_class c ON c.relname = t.table_name AND c.relnamespace = 'public'::regnamespace "
+                  "WHERE t.table_schema = 'public' ORDER BY t.table_name",
+        "columns": "SELECT table_name, column_name, data_type, is_nullable FROM information_schema.columns "
+                   "WHERE table_schema = 'public' ORDER BY table_name, ordinal_position",
+        "indexes": "SELECT t.relname, i.relname, a.attname, ix.indisunique FROM pg_index ix "
+                   "JOIN pg_class t ON t.oid = ix.indrelid JOIN pg_class i ON i.oid = ix.indexrelid "
+                   "JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = ANY(ix.indkey) "
+                   "WHERE t.relnamespace = 'public'::regnamespace "
+                   "ORDER BY t.relname, i.relname, array_position(ix.indkey::int2[], a.attnum)"
+    },
+    "oracle": {
+        "tables": "SELECT table_name, num_rows FROM user_tables ORDER BY table_name",
+        "columns": "SELECT table_name, column_name, data_type, nullable FROM user_tab_columns ORDER BY table_name, column_id",
+        "indexes": "SELECT ic.table_name, ic.index_name, ic.column_name, CASE WHEN i.uniqueness = 'UNIQUE' THEN 1 ELSE 0 END "
+                   "FROM user_ind_columns ic JOIN user_indexes i ON i.index_name = ic.index_name "
+                   "ORDER BY ic.table_name, ic.index_name, ic.column_position"
+    },
+    "sqlite": {
+        "tables": "SELECT name, NULL FROM sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%' ORDER BY name",
+        "columns": "SELECT m.name, p.name, p.type, p.\"notnull\" = 0 FROM sqlite_master m JOIN pragma_table_info(m.name) p "
+                   "WHERE m.type IN ('table', 'view') AND m.name NOT LIKE 'sqlite_%' ORDER BY m.name, p.cid",
+        "indexes": "SELECT m.name, il.name, ii.name, il.\"unique\" FROM sqlite_master m JOIN pragma_index_list(m.name) il "
+                   "JOIN pragma_index_info(il.name) ii WHERE m.type = 'table' ORDER BY m.name, il.name, ii.seqno"
+    }
+}
+
+
+def _nullable(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.upper() in ("YES", "Y")
+    return bool(value)
+
+
+class MetadataCatalog:
+    """数据库数据源的元数据目录缓存：首次访问时批量加载整个schema的表、字段、类型、行数估计和索引，
+    在有效期内直接使用；数据源更新时经失效总线移除，也可以手动刷新"""
+
+    def __init__(self):
+        # 数据源ID -> 元数据目录
+        self._catalogs: Dict[Any, Dict[str, Any]] = {}
+        # 数据源ID -> 加载锁，同一数据源同时只加载一次
+        self._load_locks: Dict[Any, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "loads": 0, "load_seconds": 0.0, "invalidations": 0}
+
+    @staticmethod
+    def _fingerprint(data_source) -> tuple:
+        return tuple(getattr(data_source, key, None) for key in CONNECTION_FIELDS)
+
+    def peek(self, data_source) -> Optional[Dict[str, Any]]:
+        """返回未过期的元数据目录，不访问数据库；用于在进入执行器线程之前直接返回缓存"""
+        catalog = self._catalogs.get(data_source.id)
+        if catalog is None or catalog["fingerprint"] != self._fingerprint(data_source):
+            return None
+        if time.monotonic() - catalog["loaded_at"] > settings.METADATA_CACHE_TTL:
+            return None
+        self._stats["hits"] += 1
+        return catalog
+
+    def get(self, data_source, refresh: bool = False) -> Dict[str, Any]:
+        """返回数据源的元数据目录，未缓存、已过期或 refresh 为True时重新加载（在执行器线程中调用）"""
+        catalog = None if refresh else self.peek(data_source)
+        if catalog is not None:
+            return catalog
+
+        requested = time.monotonic()
+        with self._lock:
+            load_lock = self._load_locks.setdefault(data_source.id, threading.Lock())
+        with load_lock:
+            # 等待期间其他线程已经加载完成时直接使用
+            catalog = self.peek(data_source)
+            if catalog is None or (refresh and catalog["loaded_at"] < requested):
+                catalog = self._load(data_source)
+                with self._lock:
+                    self._catalogs[data_source.id] = catalog
+            return catalog
+
+    def _load(self, data_source) -> Dict[str, Any]:
+        start = time.perf_counter()
+        with engine_registry.connect(data_source) as conn:
+            queries = _CATALOG_QUERIES.get(conn.dialect.name)
+            if queries is None:
+                raise Exception(f"不支持的数据库类型: {conn.dialect.name}")
+            tables: Dict[str, Dict[str, Any]] = {}
+            for name, row_estimate in conn.execute(text(queries["tables"])):
+                tables[name] = {
+                    "name": name,
+                    "row_estimate": int(row_estimate) if row_estimate is not None and row_estimate >= 0 else None,
+                    "columns": [],
+                    "indexes": []
+                }
+            for table_name, column_name, data_type, nullable in conn.execute(text(queries["columns"])):
+                if table_name in tables:
+                    tables[table_name]["columns"].append({"name": column_name, "type": data_type, "nullable": _nullable(nullable)})
+            try:
+                index_rows = conn.execute(text(queries["indexes"])).fetchall()
+            except Exception as e:
+                # 没有读取索引信息的权限时只缓存表和字段
+                print(f"读取索引信息失败: {e}")
+                conn.rollback()
+                index_rows = []
+            for table_name, index_name, column_name, unique in index_rows:
+                table = tables.get(table_name)
+                if table is None:
+                    continue
+                index = next((index for index in table["indexes"] if index["name"] == index_name), None)
+                if index is None:
+                    index = {"name": index_name, "columns": [], "unique": bool(unique)}
+                    table["indexes"].append(index)
+                index["columns"].append(column_name)
+
+        self._stats["loads"] += 1
+        self._stats["load_seconds"] += time.perf_counter() - start
+        return {
+            "fingerprint": self._fingerprint(data_source),
+            "loaded_at": time.monotonic(),
+            "tables": tables,
+            # 按小写表名查找，兼容Oracle等大写存储表名的数据库
+            "lower_names": {name.lower(): name for name in tables}
+        }
+
+    def table_names(self, data_source) -> List[str]:
+        return list(self.get(data_source)["tables"])
+
+    def table(self, data_source, table_name: str) -> Dict[str, Any]:
+        """表的元数据：字段、类型、行数估计和索引"""
+        catalog = self.get(data_source)
+        table = catalog["tables"].get(table_name)
+        if table is None and table_name.lower() in catalog["lower_names"]:
+            table = catalog["tables"][catalog["lower_names"][table_name.lower()]]
+        if table is None:
+            raise Exception(f"表不存在: {table_name}")
+        return table
+
+    def invalidate(self, kind: str, object_id: Any) -> None:
+        """数据源变化时移除其元数据目录"""
+        if kind not in ("source", "*"):
+            return
+        with self._lock:
+            self._stats["invalidations"] += 1
+            if kind == "*":
+                self._catalogs.clear()
+            else:
+                self._catalogs.pop(object_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["sources"] = len(self._catalogs)
+            stats["tables"] = sum(len(catalog["tables"]) for catalog in self._catalogs.values())
+        return stats
+
+
+metadata_catalog = MetadataCatalog()
@@ -0,0 +1,201 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Any, AsyncIterator, Callable, Iterator, List, Tuple
+from app.core.config import settings
+
+# 未绑定数据源的任务（如创建数据源前的连接测试）使用的执行器键
+DEFAULT_EXECUTOR_KEY = "default"
+
+# 流式任务结束标记
+_STREAM_END = object()
+
+
+class _StreamError:
+    """包装生产线程中的异常，传递给消费方重新抛出"""
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+class QueryExecutor:
+    """按数据源隔离的查询执行器，在有界线程池中执行阻塞的数据源I/O，避免阻塞事件循环"""
+
+    def __init__(self):
+        self._executors: Dict[Any, Tuple[int, ThreadPoolExecutor]] = {}
+        self._stats: Dict[Any, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _concurrency_limit(self, data_source) -> int:
+        # 并发上限与连接池大小一致，线程不会在连接池上排队等待
+        if data_source is None:
+            return settings.QUERY_EXECUTOR_DEFAULT_WORKERS
+        return max(1, min(data_source.connection_pool or 10, settings.MAX_CONNECTION_POOL))
+
+    def _get_executor(self, key, limit: int) -> ThreadPoolExecutor:
+        """返回数据源的线程池（调用方持有 self._lock）"""
+        entry = self._executors.get(key)
+        if entry and entry[0] == limit:
+            return entry[1]
+
+        # 连接池大小变化后重建线程池，旧线程池中的任务执行完后自动退出
+        if entry:
+            entry[1].shutdown(wait=False)
+
+        executor = ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"query-{key}")
+        self._executors[key] = (limit, executor)
+        if key not in self._stats:
+            self._stats[key] = {
+                "queued": 0,
+                "running": 0,
+                "completed": 0,
+                "failed": 0,
+                "rejected": 0,
+                "total_queue_time": 0.0,
+                "max_queue_time": 0.0,
+                "total_run_time": 0.0
+            }
+        return executor
+
+    def _submit(self, data_source, func: Callable, *args, **kwargs) -> asyncio.Future:
+        key = data_source.id if data_source is not None else DEFAULT_EXECUTOR_KEY
+        limit = self._concurrency_limit(data_source)
+        loop = asyncio.get_running_loop()
+        # 任务是否已离开队列：开始执行，或未执行就被取消
+        job = {"dequeued": False}
+        submitted_at = time.perf_counter()
+
+        # 在锁内取得线程池并提交，其他请求不能在提交前关闭该线程池
+        with self._lock:
+            executor = self._get_executor(key, limit)
+            stats = self._stats[key]
+            if stats["queued"] >= settings.QUERY_EXECUTOR_MAX_QUEUE:
+                stats["rejected"] += 1
+                raise Exception(f"数据源查询队列已满，请稍后重试: {key}")
+            future = executor.submit(partial(self._run_tracked, key, job, submitted_at, func, *args, **kwargs))
+            stats["queued"] += 1
+
+        future.add_done_callback(partial(self._dequeue, key, job))
+        return asyncio.wrap_future(future, loop=loop)
+
+    def _dequeue(self, key, job: Dict[str, bool], _future=None) -> bool:
+        """任务离开队列时减少排队数，每个任务只减少一次；等待方取消了尚未开始的任务时由完成回调减少"""
+        with self._lock:
+            if job["dequeued"]:
+                return False
+            job["dequeued"] = True
+            self._stats[key]["queued"] -= 1
+            return True
+
+    async def run(self, data_source, func: Callable, *args, **kwargs) -> Any:
+        """在数据源对应的线程池中执行阻塞函数"""
+        return await self._submit(data_source, func, *args, **kwargs)
+
+    async def stream(self, data_source, func: Callable[..., Iterator[Any]], *args) -> AsyncIterator[Any]:
+        """在数据源线程池中运行同步生成器，逐批异步产出结果；缓冲区满时生产线程等待消费"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        slots = threading.Semaphore(settings.QUERY_STREAM_BUFFER)
+        stopped = threading.Event()
+
+        def put(item) -> None:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # 事件循环已关闭，消费方不再读取
+                stopped.set()
+
+        def produce() -> None:
+            iterator = func(*args)
+            try:
+                for item in iterator:
+                    while not slots.acquire(timeout=0.5):
+                        if stopped.is_set():
+                            return
+                    if stopped.is_set():
+                        return
+                    put(item)
+            except Exception as e:
+                put(_StreamError(e))
+            finally:
+                # 关闭生成器，释放游标和连接
+                close = getattr(iterator, "close", None)
+                if close:
+                    close()
+                put(_STREAM_END)
+
+        future = self._submit(data_source, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, _StreamError):
+                    raise item.error
+                slots.release()
+                yield item
+            await future
+        finally:
+            # 消费方提前退出（如客户端断开）时通知生产线程停止
+            stopped.set()
+
+    def _run_tracked(self, key, job: Dict[str, bool], submitted_at: float, func: Callable, *args, **kwargs) -> Any:
+        started_at = time.perf_counter()
+        queue_time = started_at - submitted_at
+        self._dequeue(key, job)
+        with self._lock:
+            stats = self._stats[key]
+            stats["running"] += 1
+            stats["total_queue_time"] += queue_time
+            stats["max_queue_time"] = max(stats["max_queue_time"], queue_time)
+
+        failed = False
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            with self._lock:
+                stats = self._stats[key]
+                stats["running"] -= 1
+                stats["failed" if failed else "completed"] += 1
+                stats["total_run_time"] += time.perf_counter() - started_at
+
+    def shutdown(self, key=None) -> None:
+        """关闭线程池，不指定键时关闭全部"""
+        with self._lock:
+            keys = [key] if key is not None else list(self._executors.keys())
+            entries = [self._executors.pop(k) for k in keys if k in self._executors]
+        for _, executor in entries:
+            executor.shutdown(wait=False)
+
+    def get_stats(self, key=None) -> List[Dict[str, Any]]:
+        """获取各数据源的并发与排队指标"""
+        with self._lock:
+            items = [(k, self._executors[k][0], dict(v)) for k, v in self._stats.items() if k in self._executors]
+
+        result = []
+        for k, limit, stats in items:
+            if key is not None and k != key:
+                continue
+            finished = stats["completed"] + stats["failed"]
+            started = finished + stats["running"]
+            result.append({
+                "source_id": k,
+                "concurrency_limit": limit,
+                "queue_depth": stats["queued"],
+                "running": stats["running"],
+                "completed": stats["completed"],
+                "failed": stats["failed"],
+                "rejected": stats["rejected"],
+                "avg_queue_time": stats["total_queue_time"] / started if started else 0.0,
+                "max_queue_time": stats["max_queue_time"],
+                "avg_run_time": stats["total_run_time"] / finished if finished else 0.0
+            })
+        return result
+
+
+query_executor = QueryExecutor()
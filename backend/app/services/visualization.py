@@ -1,788 +1,615 @@
-from typing import List, Dict, Any, Optional
+import asyncio
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
 from sqlalchemy.orm import Session
-from app.models.data_models import DataSet, DataModel
+from app.models.data_models import DataSet
 from app.models.sources import DataSource
-from app.schemas.visualization import PivotAnalysisRequest, PivotAnalysisResponse, AdhocQueryRequest, AdhocQueryResponse, SpreadsheetRequest, SpreadsheetResponse
+from app.schemas.visualization import PivotAnalysisRequest, PivotAnalysisResponse, DrillDownRequest, DrillDownResponse, AdhocQueryRequest, AdhocQueryResponse, AdhocStreamRequest, SpreadsheetRequest, SpreadsheetResponse
+from app.core.config import settings
 from app.core.database import SessionLocal
+from app.services.cache import result_cache, CachedResult
+from app.services.sources.engine_registry import engine_registry
+from app.services.sources.query_executor import query_executor
+from app.services.sources.health import health_prober
+from app.services.result_format import QueryResult
+from app.services.query import SelectQuery, BoundPivot, FusedQuery, encode_cursor, split_page_columns, model_plan_cache, plan_fusion, DrillCache, drill_cache
+from app.services.query import sql_builder
+from app.services.query.sql_utils import FILTER_OPERATORS, check_identifier, check_sort_order
+from app.services.analytics import rollup_service, extract_service, ExtractSource, LocalSource
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError, ProgrammingError
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, Alignment
+from openpyxl.utils import get_column_letter
 import io
+import os
+import time
 import base64
+import tempfile
+
+# 电子表格汇总行中需要求和的字段名关键字
+SUMMARY_KEYWORDS = ['amount', '金额', '销售', '利润', 'count', '数量', 'price', '价格']
 
 class VisualizationService:
     def __init__(self):
-        pass
+        # 不支持窗口函数计数的数据源，分页时改用缓存的计数查询
+        self._window_count_unsupported = set()
+        # 进行中的下钻查询（含后台预取）：(下钻缓存键, 层级, 限定路径) -> 任务，相同的查询只执行一次
+        self._drill_tasks: Dict[tuple, asyncio.Task] = {}
+
+    def _cache_ttl(self, refresh_intervals: List[Optional[int]]) -> int:
+        """取最短的刷新间隔作为缓存有效期，未配置时使用默认刷新间隔"""
+        intervals = [interval for interval in refresh_intervals if interval]
+        return min(intervals) if intervals else settings.DEFAULT_REFRESH_INTERVAL
+
+    def _check_available(self, data_source: DataSource) -> None:
+        """健康检查标记为不可用的数据源直接失败，不等待驱动超时；本地快照和缓存上的查询不受影响"""
+        if not isinstance(data_source, LocalSource):
+            health_prober.check_available(data_source)
+
+    async def _load_query(self, data_source: DataSource, sql: str, params: Optional[Dict[str, Any]] = None) -> CachedResult:
+        self._check_available(data_source)
+        columns, rows = await query_executor.run(data_source, self._execute_query, data_source, sql, params)
+        return columns, rows, {}
+
+    async def _cached_query(self, data_source: DataSource, sql: str, params: Optional[Dict[str, Any]], ttl: int, tags) -> CachedResult:
+        return await result_cache.get_or_load(
+            result_cache.build_key(data_source.id, sql, params),
+            lambda: self._load_query(data_source, sql, params),
+            ttl=ttl,
+            tags=tags
+        )
+
+    def _execute_query(self, data_source: DataSource, sql: str, params: Optional[Dict[str, Any]] = None):
+        """在执行器线程中执行查询，返回列名和结果行"""
+        if isinstance(data_source, LocalSource):
+            # 数据集快照、Excel缓存在本地分析存储上查询
+            return data_source.execute(sql, params)
+        # 从引擎注册表获取连接池中的连接，避免每次请求重新建立连接
+        with engine_registry.connect(data_source) as conn:
+            result = conn.execute(text(sql), params or {})
+            # 在连接关闭之前获取所有的查询结果
+            rows = result.fetchall()
+            # 获取结果的列名
+            columns = list(result.keys())
+        return columns, rows
+
+    def _stream_query(self, data_source: DataSource, sql: str, params: Optional[Dict[str, Any]], batch_size: int):
+        """在执行器线程中使用服务端游标执行查询，先产出列名，再逐批产出结果行"""
+        if isinstance(data_source, LocalSource):
+            yield from data_source.stream(sql, params, batch_size)
+            return
+        with engine_registry.connect(data_source) as conn:
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(text(sql), params or {})
+            try:
+                yield list(result.keys())
+                for partition in result.partitions(batch_size):
+                    yield partition
+            finally:
+                result.close()
+
+    async def _count_rows(self, data_source: DataSource, query: SelectQuery, ttl: int, tags) -> int:
+        """按筛选条件计数，相同筛选条件的总数在缓存有效期内复用"""
+        _, rows, _ = await self._cached_query(data_source, query.count_sql(), query.params, ttl, tags)
+        return rows[0][0] if rows else 0
+
+    @staticmethod
+    def _is_syntax_error(error: DBAPIError) -> bool:
+        """数据库驱动是否报告了SQL语法错误（SQLite的语法错误为OperationalError）"""
+        return isinstance(error, ProgrammingError) or "syntax" in str(error.orig).lower()
+
+    async def _fetch_page(
+        self,
+        data_source: DataSource,
+        query: SelectQuery,
+        limit: int,
+        offset: int,
+        ttl: int,
+        tags,
+        pagination: str = "offset",
+        cursor: Optional[str] = None
+    ) -> QueryResult:
+        """执行分页查询并获取总数，避免每页都对完整查询再执行一次COUNT"""
+        if pagination == "keyset":
+            # 键集分页按上一页最后一行的排序值定位，翻页深度不影响查询耗时
+            sql, params = query.keyset_sql(limit, cursor)
+            columns, rows, _ = await self._cached_query(data_source, sql, params, ttl, tags)
+            columns, rows, _, last_values = split_page_columns(columns, rows)
+            total = await self._count_rows(data_source, query, ttl, tags)
+            next_cursor = encode_cursor(last_values) if last_values and len(rows) == limit else None
+            return QueryResult(columns, rows, total=total, sql=sql, next_cursor=next_cursor)
+
+        total = None
+        sql = None
+        window_unsupported = False
+        if data_source.id not in self._window_count_unsupported:
+            # 总数通过 COUNT(*) OVER() 与分页数据在同一次查询中返回
+            windowed_sql = query.windowed_sql(limit, offset)
+            try:
+                columns, rows, _ = await self._cached_query(data_source, windowed_sql, query.params, ttl, tags)
+                columns, rows, total, _ = split_page_columns(columns, rows)
+                sql = windowed_sql
+            except DBAPIError as e:
+                # 只有SQL语法错误才可能是不支持窗口函数（如MySQL 5.7），连接失败、超时等错误直接抛出
+                if not self._is_syntax_error(e):
+                    raise
+                window_unsupported = True
+
+        if sql is None:
+            sql = query.to_sql(limit=limit, offset=offset)
+            columns, rows, _ = await self._cached_query(data_source, sql, query.params, ttl, tags)
+            if window_unsupported:
+                # 普通分页查询可以执行，说明是窗口函数语法不被支持，之后不再尝试
+                self._window_count_unsupported.add(data_source.id)
+
+        if total is None:
+            if offset == 0 and len(rows) < limit:
+                # 第一页未取满时行数即为总数
+                total = len(rows)
+            else:
+                # 超出末页或不支持窗口函数时，使用按筛选条件缓存的计数
+                total = await self._count_rows(data_source, query, ttl, tags)
+        return QueryResult(columns, rows, total=total, sql=sql)
 
     async def pivot_analysis(self, request: PivotAnalysisRequest) -> PivotAnalysisResponse:
+        result = await self.pivot_query(request)
+        return PivotAnalysisResponse(
+            success=True,
+            data=result.records(),
+            columns=result.columns,
+            sql=result.sql,
+            model_sql=result.model_sql,
+            message=result.message
+        )
+
+    async def pivot_query(self, request: PivotAnalysisRequest) -> QueryResult:
+        """执行透视分析查询，返回未转换格式的查询结果"""
         db = SessionLocal()
         try:
-            # 验证数据模型是否存在
-            data_model = db.query(DataModel).filter(DataModel.id == request.data_model_id).first()
-            if not data_model:
-                raise Exception(f"数据模型不存在: {request.data_model_id}")
-
-            # 验证维度和度量是否存在于数据模型中
-            # 处理不同格式的维度和度量数据
-            dimension_names = []
-            for dim in data_model.dimensions:
-                if isinstance(dim, dict):
-                    if 'name' in dim:
-                        dimension_names.append(dim['name'])
-                    elif 'field' in dim:
-                        dimension_names.append(dim['field'])
-                    else:
-                        dimension_names.append(str(dim))
-                else:
-                    try:
-                        dimension_names.append(dim.name)
-                    except AttributeError:
-                        dimension_names.append(str(dim))
-
-            measure_names = []
-            for meas in data_model.measures:
-                if isinstance(meas, dict):
-                    if 'name' in meas:
-                        measure_names.append(meas['name'])
-                    elif 'field' in meas:
-                        measure_names.append(meas['field'])
-                    else:
-                        measure_names.append(str(meas))
-                else:
-                    try:
-                        measure_names.append(meas.name)
-                    except AttributeError:
-                        measure_names.append(str(meas))
-
-            for dim in request.dimensions:
-                if dim not in dimension_names:
-                    raise Exception(f"维度不存在: {dim}")
-
-            for meas in request.measures:
-                if meas not in measure_names:
-                    raise Exception(f"度量不存在: {meas}")
-
-            # 生成SQL查询
-            sql_parts = []
-            sql_parts.append("SELECT")
-            
-            # 添加SELECT字段（维度和度量）
-            select_fields = []
-            for dim in request.dimensions:
-                select_fields.append(dim)
-            for meas in request.measures:
-                # 查找度量的聚合方式
-                aggregation = 'SUM'
-                for meas_config in data_model.measures:
-                    if isinstance(meas_config, dict):
-                        meas_name = meas_config.get('name') or meas_config.get('field')
-                    else:
-                        try:
-                            meas_name = meas_config.name
-                        except AttributeError:
-                            meas_name = str(meas_config)
-                    
-                    if meas_name == meas:
-                        aggregation = meas_config.get('aggregation', 'SUM') if isinstance(meas_config, dict) else 'SUM'
-                        break
-                
-                select_fields.append(f"{aggregation}({meas}) AS {meas}")
-            
-            sql_parts.append(", ".join(select_fields))
-            
-            # 添加FROM子句（使用第一个数据集作为主表）
-            if data_model.data_sets and len(data_model.data_sets) > 0:
-                main_data_set_id = data_model.data_sets[0].get('data_set_id') if isinstance(data_model.data_sets[0], dict) else data_model.data_sets[0].data_set_id
-                main_data_set = db.query(DataSet).filter(DataSet.id == main_data_set_id).first()
-                if main_data_set:
-                    table_name = f"data_set_{main_data_set_id}"
-                    sql_parts.append(f"FROM {table_name}")
+            # 数据模型编译结果按模型更新时间缓存，这里只需一次轻量查询确认模型未变化
+            plan = model_plan_cache.get(db, request.data_model_id)
+        finally:
+            db.close()
+
+        # 绑定维度、度量和筛选条件，生成透视SQL、实际执行的单层SQL和三层嵌套的模型解析SQL（（数据集）模型）透视
+        pivot = BoundPivot(plan, request.dimensions, request.measures, request.filters, request.sort_by, request.sort_order,
+                           request.top_n, request.top_n_by, request.sample_rate)
+        return await self.run_pivot(pivot)
+
+    async def run_pivot(self, pivot: BoundPivot, refresh: bool = False) -> QueryResult:
+        """执行已绑定的透视查询：有覆盖该查询的汇总表时在汇总表上执行，否则在数据源上执行；
+        refresh 为True时跳过结果缓存重新查询"""
+        rollup = rollup_service.match(pivot)
+        if rollup is not None:
+            result = await rollup_service.run(pivot, rollup)
+            if result is not None:
+                return result
+
+        # 模型的数据集都有本地快照时在快照上执行
+        pivot = extract_service.localize(pivot)
+        plan, sql, model_sql, params = pivot.plan, pivot.sql, pivot.model_sql, pivot.params
+        data_source = plan.data_source
+        if pivot.query_sql is None:
+            # 如SQLite、MySQL上的分位数度量，只能由汇总表中的草图或本地快照回答
+            measures = [f"{meas}({plan.aggregations[meas]})" for meas in pivot.measures
+                        if not sql_builder.supports_aggregation(plan.aggregations[meas], data_source.db_type)]
+            raise Exception(f"数据库不支持度量的聚合方式: {', '.join(measures)}，请启用数据集抽取或创建包含这些度量的汇总表")
+        start = time.perf_counter()
+        try:
+            # 执行单层SQL，三层嵌套SQL只用于展示；相同SQL的查询结果从缓存读取，未命中时在数据源执行器线程中执行
+            columns, rows, _ = await result_cache.get_or_load(
+                result_cache.build_key(data_source.id, pivot.query_sql, params),
+                lambda: self._load_query(data_source, pivot.query_sql, params),
+                ttl=self._cache_ttl(list(plan.refresh_intervals)),
+                tags=plan.cache_tags,
+                refresh=refresh
+            )
+        except Exception as e:
+            # 如果数据库查询失败，返回错误信息
+            raise Exception(f"数据库查询失败: {str(e)}")
+        # 记录查询粒度和耗时，供汇总表顾问使用
+        rollup_service.observe(pivot, time.perf_counter() - start)
+
+        # 前N组、抽样查询转换为最终结果；如果查询结果为空，直接返回空列表，不生成模拟数据
+        columns, rows = pivot.finish(columns, rows)
+        message = "透视分析成功" if pivot.sample_rate is None else f"透视分析成功（按{pivot.sample_rate:.2%}抽样估算）"
+        return QueryResult(columns, rows, sql=sql, model_sql=model_sql, message=message)
+
+    async def run_pivots(self, pivots: List[BoundPivot], refresh: bool = False) -> AsyncIterator[Tuple[int, Optional[QueryResult], Optional[Exception]]]:
+        """批量执行透视查询：相同的查询只执行一次，同一模型、筛选条件相同的查询合并为一次扫描，
+        各查询组按数据源限制并发，每组完成后立即产出 (下标, 结果, 错误)"""
+        # 模型的数据集都有本地快照时在快照上执行
+        pivots = [extract_service.localize(pivot) for pivot in pivots]
+        # 合并完全相同的查询
+        unique: Dict[str, BoundPivot] = {}
+        duplicates: Dict[str, List[int]] = {}
+        for index, pivot in enumerate(pivots):
+            key = result_cache.build_key(pivot.plan.data_source.id, pivot.query_sql or pivot.sql, pivot.params)
+            unique.setdefault(key, pivot)
+            duplicates.setdefault(key, []).append(index)
+        keys = list(unique.keys())
+        # 能由汇总表回答的查询不参与融合
+        covered = [position for position, key in enumerate(keys) if rollup_service.match(unique[key]) is not None]
+        uncovered = [position for position in range(len(keys)) if position not in covered]
+        fused_groups, singles = plan_fusion([unique[keys[position]] for position in uncovered])
+        fused_groups = [[uncovered[i] for i in group] for group in fused_groups]
+        singles = covered + [uncovered[i] for i in singles]
+
+        # 同一数据源上的查询组共享并发上限，避免一批查询占满数据源的连接池
+        limits: Dict[Any, asyncio.Semaphore] = {}
+        for pivot in unique.values():
+            limits.setdefault(pivot.plan.data_source.id, asyncio.Semaphore(settings.DASHBOARD_RENDER_SOURCE_CONCURRENCY))
+
+        async def run_single(position: int):
+            pivot = unique[keys[position]]
+            async with limits[pivot.plan.data_source.id]:
+                try:
+                    result = await self.run_pivot(pivot, refresh)
+                    return [(position, result, None)]
+                except Exception as e:
+                    return [(position, None, e)]
+
+        async def run_fused(positions: List[int]):
+            fused = FusedQuery([unique[keys[position]] for position in positions])
+            async with limits[fused.plan.data_source.id]:
+                start = time.perf_counter()
+                try:
+                    columns, rows, _ = await result_cache.get_or_load(
+                        result_cache.build_key(fused.plan.data_source.id, fused.sql, fused.params),
+                        lambda: self._load_query(fused.plan.data_source, fused.sql, fused.params),
+                        ttl=self._cache_ttl(list(fused.plan.refresh_intervals)),
+                        tags=fused.plan.cache_tags,
+                        refresh=refresh
+                    )
+                except Exception as e:
+                    return [(position, None, Exception(f"数据库查询失败: {str(e)}")) for position in positions]
+                elapsed = time.perf_counter() - start
+            if fused.is_truncated(rows):
+                # 最细粒度结果超出上限，改为分别执行
+                results = []
+                for position in positions:
+                    results += await run_single(position)
+                return results
+            for member in fused.members:
+                rollup_service.observe(member, elapsed / len(fused.members))
+            return [
+                (position, QueryResult(member.columns, member_rows, sql=member.sql, model_sql=member.model_sql, message="透视分析成功"), None)
+                for position, member, member_rows in zip(positions, fused.members, fused.split(columns, rows))
+            ]
+
+        tasks = [asyncio.ensure_future(run_fused(positions)) for positions in fused_groups]
+        tasks += [asyncio.ensure_future(run_single(position)) for position in singles]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                for position, result, error in await next_done:
+                    for index in duplicates[keys[position]]:
+                        yield index, result, error
+        finally:
+            # 调用方提前退出（如客户端断开）时取消尚未完成的查询
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    def _drill_filters(levels: List[str], path: List[Any]) -> List[Dict[str, Any]]:
+        # 空值成员（如未分类）按 IS NULL 筛选，与下钻缓存中的匹配方式一致
+        return [{"field": level, "operator": "is null"} if member is None else {"field": level, "operator": "=", "value": member}
+                for level, member in zip(levels, path)]
+
+    async def drill_down(self, request: DrillDownRequest) -> DrillDownResponse:
+        """层次下钻：返回点击成员（path）的下一层。从数据源取回时同时取回兄弟成员的下一层，
+        之后点击兄弟成员或返回上层由下钻缓存在进程内回答；并在后台预取当前结果各成员的下一层"""
+        db = SessionLocal()
+        try:
+            plan = model_plan_cache.get(db, request.data_model_id)
+        finally:
+            db.close()
+        levels = plan.hierarchy_levels(request.hierarchy)
+        path = list(request.path or [])
+        if len(path) >= len(levels):
+            raise Exception(f"已经是层次结构的最后一层: {request.hierarchy}")
+        depth = len(path) + 1
+
+        # 绑定目标层级的透视查询：校验度量和排序字段，生成展示的SQL；默认按当前层级排序
+        pivot = BoundPivot(plan, levels[:depth], request.measures, list(request.filters or []) + self._drill_filters(levels, path),
+                           request.sort_by or levels[depth - 1], request.sort_order)
+        key = drill_cache.key(plan, request.hierarchy, request.measures, request.filters)
+        rows = None if request.refresh else drill_cache.lookup(key, plan, depth, path)
+        cached = rows is not None
+        if rows is None:
+            # 限定到点击成员的上级，取回点击成员及其兄弟成员的下一层
+            task = self._drill_task(plan, key, levels, depth, path[:-1], request, request.refresh)
+            rows = DrillCache.restrict(await asyncio.shield(task), len(path) - 1, path) if path else await asyncio.shield(task)
+
+        if settings.DRILL_PREFETCH_ENABLED and depth < len(levels) and not drill_cache.covers(key, plan, depth + 1, path):
+            self._drill_task(plan, key, levels, depth + 1, path, request, False, prefetch=True)
+
+        rows = pivot.sort_rows(rows)
+        message = "下钻分析成功（由已取回的结果计算）" if cached else "下钻分析成功"
+        return DrillDownResponse(
+            success=True, data=[dict(zip(pivot.columns, row)) for row in rows], columns=pivot.columns,
+            sql=pivot.sql, model_sql=pivot.model_sql, message=message,
+            level=levels[depth - 1], depth=depth, has_next=depth < len(levels), cached=cached
+        )
+
+    def _drill_task(self, plan, key: tuple, levels: List[str], depth: int, restriction: List[Any],
+                    request: DrillDownRequest, refresh: bool, prefetch: bool = False) -> asyncio.Task:
+        """取回层级 depth 在限定路径下的结果并保存到下钻缓存；相同的查询正在进行时复用该任务"""
+        task_key = (key, depth, tuple(str(member) for member in restriction))
+        task = self._drill_tasks.get(task_key)
+        if task is not None and not refresh:
+            return task
+
+        async def fetch() -> List[tuple]:
+            filters = list(request.filters or []) + self._drill_filters(levels, restriction)
+            result = await self.run_pivot(BoundPivot(plan, levels[:depth], request.measures, filters), refresh)
+            rows = [tuple(row) for row in result.rows]
+            drill_cache.store(key, plan, depth, restriction, rows, self._cache_ttl(list(plan.refresh_intervals)))
+            return rows
+
+        def done(finished: asyncio.Task) -> None:
+            if self._drill_tasks.get(task_key) is finished:
+                del self._drill_tasks[task_key]
+            if not finished.cancelled() and finished.exception() is not None and prefetch:
+                print(f"预取下钻结果失败: {finished.exception()}")
+
+        task = asyncio.ensure_future(fetch())
+        task.add_done_callback(done)
+        self._drill_tasks[task_key] = task
+        return task
+
+    async def pivot_batch(self, requests: List[PivotAnalysisRequest]) -> List[PivotAnalysisResponse]:
+        """批量透视分析，结果顺序与请求顺序一致"""
+        responses: List[Optional[PivotAnalysisResponse]] = [None] * len(requests)
+        pivots, positions = [], []
+        db = SessionLocal()
+        try:
+            for index, request in enumerate(requests):
+                try:
+                    plan = model_plan_cache.get(db, request.data_model_id)
+                    pivots.append(BoundPivot(plan, request.dimensions, request.measures, request.filters,
+                                             request.sort_by, request.sort_order,
+                                             request.top_n, request.top_n_by, request.sample_rate))
+                    positions.append(index)
+                except Exception as e:
+                    responses[index] = PivotAnalysisResponse(success=False, data=[], columns=[], message=str(e))
+        finally:
+            db.close()
+
+        async for position, result, error in self.run_pivots(pivots):
+            index = positions[position]
+            if error is not None:
+                responses[index] = PivotAnalysisResponse(success=False, data=[], columns=[], message=str(error))
+            else:
+                responses[index] = PivotAnalysisResponse(
+                    success=True, data=result.records(), columns=result.columns,
+                    sql=result.sql, model_sql=result.model_sql, message=result.message
+                )
+        return responses
+
+    def _build_adhoc_query(self, db: Session, request: AdhocQueryRequest):
+        """校验即席查询请求并生成不含分页的查询，返回数据集、数据源和查询"""
+        # 验证数据集是否存在
+        data_set = db.query(DataSet).filter(DataSet.id == request.data_set_id).first()
+        if not data_set:
+            raise Exception(f"数据集不存在: {request.data_set_id}")
+
+        # 获取数据源信息
+        data_source = db.query(DataSource).filter(DataSource.id == data_set.data_source_id).first()
+        if not data_source:
+            raise Exception(f"数据源不存在: {data_set.data_source_id}")
+
+        # 验证字段是否存在于数据集中
+        field_names = []
+        for field in data_set.fields:
+            if isinstance(field, dict):
+                if 'name' in field:
+                    field_names.append(field['name'])
+                elif 'field' in field:
+                    field_names.append(field['field'])
                 else:
-                    raise Exception(f"主数据集不存在: {main_data_set_id}")
+                    field_names.append(str(field))
             else:
-                raise Exception("数据模型中没有配置数据集")
-            
-            # 添加WHERE子句（筛选条件）
-            if request.filters and len(request.filters) > 0:
-                where_conditions = []
-                for filter_item in request.filters:
-                    field = filter_item.get('field', '')
-                    operator = filter_item.get('operator', '=')
-                    value = filter_item.get('value', '')
-                    
-                    # 根据操作符生成条件
-                    if operator == 'like':
-                        where_conditions.append(f"{field} LIKE '%{value}%'")
-                    elif operator == '=':
-                        where_conditions.append(f"{field} = '{value}'")
-                    elif operator == '!=':
-                        where_conditions.append(f"{field} != '{value}'")
-                    elif operator == '>':
-                        where_conditions.append(f"{field} > '{value}'")
-                    elif operator == '<':
-                        where_conditions.append(f"{field} < '{value}'")
-                    elif operator == '>=':
-                        where_conditions.append(f"{field} >= '{value}'")
-                    elif operator == '<=':
-                        where_conditions.append(f"{field} <= '{value}'")
-                
-                if where_conditions:
-                    sql_parts.append("WHERE " + " AND ".join(where_conditions))
-            
-            # 添加GROUP BY子句（维度）
-            if request.dimensions and len(request.dimensions) > 0:
-                sql_parts.append("GROUP BY " + ", ".join(request.dimensions))
-            
-            # 添加ORDER BY子句（排序）
-            if request.sort_by:
-                sort_order = request.sort_order.upper() if request.sort_order else 'ASC'
-                sql_parts.append(f"ORDER BY {request.sort_by} {sort_order}")
-            
-            # 组合SQL
-            sql = " ".join(sql_parts)
-            
-            # 生成模型解析SQL（包含所有表和关系）
-            # 构建复杂的三层嵌套SQL结构，反映（（数据集）模型）透视的层次关系
-            
-            # 构建表连接信息
-            tables = []
-            table_mapping = {}
-            
-            if data_model.data_sets and len(data_model.data_sets) > 0:
-                for i, data_set in enumerate(data_model.data_sets):
-                    data_set_id = data_set.get('data_set_id') if isinstance(data_set, dict) else data_set.data_set_id
-                    # 获取实际数据集信息
-                    data_set_obj = db.query(DataSet).filter(DataSet.id == data_set_id).first()
-                    if data_set_obj:
-                        # 获取数据源信息
-                        data_source = db.query(DataSource).filter(DataSource.id == data_set_obj.data_source_id).first()
-                        if data_source:
-                            # 从 visual_config.tables 中获取实际的表名
-                            if data_set_obj.visual_config and 'tables' in data_set_obj.visual_config:
-                                actual_tables = data_set_obj.visual_config['tables']
-                                if actual_tables:
-                                    # 使用第一个表作为主表
-                                    table_name = actual_tables[0]
-                                    alias = f"t{i+1}"
-                                    table_mapping[data_set_id] = alias
-                                    tables.append(f"{table_name} {alias}")
-                                else:
-                                    raise Exception(f"数据集 {data_set_id} 中没有配置表")
-                            else:
-                                # 如果没有 visual_config，使用数据集名称作为表名
-                                table_name = data_set_obj.name
-                                alias = f"t{i+1}"
-                                table_mapping[data_set_id] = alias
-                                tables.append(f"{table_name} {alias}")
-                        else:
-                            raise Exception(f"数据源不存在: {data_set_obj.data_source_id}")
-                    else:
-                        raise Exception(f"数据集不存在: {data_set_id}")
+                try:
+                    field_names.append(field.name)
+                except AttributeError:
+                    field_names.append(str(field))
+
+        for field in request.fields:
+            if field not in field_names:
+                raise Exception(f"字段不存在: {field}")
+
+        # 数据集有本地快照（或来自Excel文件）时在本地分析存储上查询，标识符使用双引号
+        local_source = extract_service.source_for(data_set, data_source)
+        if local_source is not None:
+            data_source, quote = local_source, '"'
+        else:
+            quote = '`'
+
+        # 构建SQL查询
+        if isinstance(local_source, ExtractSource) and data_set.creation_mode == 'sql':
+            # 快照即为SQL的查询结果
+            return data_set, data_source, SelectQuery.wrap(f"SELECT * FROM {local_source.table_for(data_set.id)}")
+        if data_set.creation_mode == 'sql':
+            # SQL模式：直接使用用户提供的SQL查询
+            # 这里需要解析SQL并替换SELECT子句
+            # 为了简化，我们假设用户提供的SQL已经包含了正确的字段
+            # 实际项目中可能需要更复杂的SQL解析
+            return data_set, data_source, SelectQuery.wrap(data_set.sql_query)
+
+        # 可视化模式：根据visual_config生成SQL查询
+        if not data_set.visual_config:
+            raise Exception("数据集配置不完整")
+
+        # 获取表名
+        tables = data_set.visual_config.get('tables', [])
+        if not tables:
+            raise Exception("数据集配置中缺少表信息")
+
+        table_name = tables[0]
+
+        # 构建SELECT子句
+        # 处理字段名，去掉表名前缀（例如：sys_oper_log.title -> title）
+        select_fields = []
+        for field in request.fields:
+            # 如果字段名包含表名前缀，提取纯字段名
+            if '.' in field:
+                actual_field = field.split('.')[-1]
             else:
-                raise Exception("数据模型中没有配置数据集")
-            
-            # 构建正确的三层嵌套SQL结构
-            # 第一层：透视分析层（最外层）
-            # 第二层：模型层
-            # 第三层：数据集层（最内层）
-            
-            # 构建数据集层SQL（最内层）
-            dataset_sql_parts = []
-            dataset_sql_parts.append("SELECT")
-            
-            # 数据集层字段
-            dataset_fields = []
-            # 获取第一个表的别名作为默认表别名
-            default_table_alias = table_mapping[list(table_mapping.keys())[0]] if table_mapping else 't1'
-            
-            # 从数据模型配置中获取真正的字段名
-            # 构建字段映射：字段名称 -> 实际字段名
-            field_mapping = {}
-            
-            # 1. 从数据模型的维度配置中获取字段名
-            if data_model.dimensions:
-                for dim in data_model.dimensions:
-                    if isinstance(dim, dict):
-                        # 从 name 或 field 中获取字段名
-                        dim_name = dim.get('name') or dim.get('field')
-                        if dim_name:
-                            # 如果字段名包含表名前缀，提取纯字段名
-                            if '.' in dim_name:
-                                pure_field = dim_name.split('.')[-1]
-                                field_mapping[dim_name] = pure_field
-                                field_mapping[pure_field] = pure_field
-                            else:
-                                field_mapping[dim_name] = dim_name
-            
-            # 2. 从数据模型的度量配置中获取字段名
-            if data_model.measures:
-                for meas in data_model.measures:
-                    if isinstance(meas, dict):
-                        # 从 name 或 field 中获取字段名
-                        meas_name = meas.get('name') or meas.get('field')
-                        if meas_name:
-                            # 如果字段名包含表名前缀，提取纯字段名
-                            if '.' in meas_name:
-                                pure_field = meas_name.split('.')[-1]
-                                field_mapping[meas_name] = pure_field
-                                field_mapping[pure_field] = pure_field
-                            else:
-                                field_mapping[meas_name] = meas_name
-            
-            # 3. 从数据集配置中获取字段名作为补充
-            for data_set in data_model.data_sets:
-                data_set_id = data_set.get('data_set_id') if isinstance(data_set, dict) else data_set.data_set_id
-                data_set_obj = db.query(DataSet).filter(DataSet.id == data_set_id).first()
-                if data_set_obj and data_set_obj.fields:
-                    for field in data_set_obj.fields:
-                        if isinstance(field, dict):
-                            field_name = field.get('name')
-                            if field_name:
-                                # 如果字段名包含表名前缀，提取纯字段名
-                                if '.' in field_name:
-                                    pure_field = field_name.split('.')[-1]
-                                    field_mapping[field_name] = pure_field
-                                    field_mapping[pure_field] = pure_field
-                                else:
-                                    field_mapping[field_name] = field_name
-            
-            # 处理维度字段
-            # 获取第一个表的别名
-            first_table_alias = list(table_mapping.values())[0] if table_mapping else 't1'
-            # 获取第一个表的实际表名
-            first_table_name = ''
-            if data_model.data_sets and len(data_model.data_sets) > 0:
-                first_data_set_id = data_model.data_sets[0].get('data_set_id') if isinstance(data_model.data_sets[0], dict) else data_model.data_sets[0].data_set_id
-                first_data_set = db.query(DataSet).filter(DataSet.id == first_data_set_id).first()
-                if first_data_set and first_data_set.visual_config and 'tables' in first_data_set.visual_config:
-                    first_table_name = first_data_set.visual_config['tables'][0] if first_data_set.visual_config['tables'] else first_data_set.name
-            
-            # 构建维度字段和GROUP BY字段
-            dimension_fields = []
-            group_by_fields = []
-            # 从模型的维度配置中获取关联字段
-            for dim in request.dimensions:
-                # 查找模型中对应的维度配置
-                found_dim = None
-                for model_dim in data_model.dimensions:
-                    if isinstance(model_dim, dict):
-                        dim_name = model_dim.get('name') or model_dim.get('field')
-                        if dim_name == dim:
-                            found_dim = model_dim
-                            break
-                
-                # 从维度配置中获取关联字段
-                if found_dim and isinstance(found_dim, dict):
-                    # 从 field 或 name 中获取关联字段
-                    actual_field = found_dim.get('field') or found_dim.get('name')
-                else:
-                    # 如果没有找到对应的维度配置，使用请求中的字段名
-                    actual_field = field_mapping.get(dim, dim)
-                
-                # 如果字段名包含表名前缀，提取纯字段名
-                if '.' in actual_field:
-                    actual_field = actual_field.split('.')[-1]
-                # 使用表别名前缀
-                field_with_alias = f"{first_table_alias}.{actual_field}"
-                dimension_fields.append(f"{field_with_alias} AS dataset_{dim.replace('.', '_')}")
-                group_by_fields.append(field_with_alias)
-            
-            # 构建度量字段
-            measure_fields = []
-            for meas in request.measures:
-                # 查找模型中对应的度量配置
-                found_meas = None
-                aggregation = 'SUM'
-                for meas_config in data_model.measures:
-                    if isinstance(meas_config, dict):
-                        meas_name = meas_config.get('name') or meas_config.get('field')
-                        if meas_name == meas:
-                            found_meas = meas_config
-                            aggregation = meas_config.get('aggregation', 'SUM')
-                            break
-                
-                # 从度量配置中获取关联字段
-                if found_meas and isinstance(found_meas, dict):
-                    # 从 field 或 name 中获取关联字段
-                    actual_field = found_meas.get('field') or found_meas.get('name')
-                else:
-                    # 如果没有找到对应的度量配置，使用请求中的字段名
-                    actual_field = field_mapping.get(meas, meas)
-                
-                # 如果字段名包含表名前缀，提取纯字段名
-                if '.' in actual_field:
-                    actual_field = actual_field.split('.')[-1]
-                # 使用表别名前缀
-                field_with_alias = f"{first_table_alias}.{actual_field}"
-                measure_fields.append(f"{aggregation}({field_with_alias}) AS dataset_{meas.replace('.', '_')}")
-            
-            # 组合所有字段
-            dataset_fields = dimension_fields + measure_fields
-            
-            dataset_sql_parts.append(", ".join(dataset_fields))
-            
-            # 添加FROM子句和JOIN语句（数据集层）
-            if tables:
-                # 使用第一个表作为主表
-                main_table = tables[0]
-                dataset_sql_parts.append(f"FROM {main_table}")
-                
-                # 添加其他表的JOIN语句
-                if data_model.relationships:
-                    for rel in data_model.relationships:
-                        if isinstance(rel, dict):
-                            source_data_set = rel.get('source_data_set')
-                            source_field = rel.get('source_field')
-                            target_data_set = rel.get('target_data_set')
-                            target_field = rel.get('target_field')
-                            join_type = rel.get('join_type', 'inner').upper()
-                            
-                            if source_data_set and source_field and target_data_set and target_field:
-                                source_table = table_mapping.get(source_data_set)
-                                target_table = table_mapping.get(target_data_set)
-                                if source_table and target_table:
-                                    # 查找目标表的完整定义
-                                    target_table_def = None
-                                    for table in tables:
-                                        if target_table in table:
-                                            target_table_def = table
-                                            break
-                                    
-                                    if target_table_def:
-                                        # 提取纯字段名
-                                        pure_source_field = source_field.split('.')[-1] if '.' in source_field else source_field
-                                        pure_target_field = target_field.split('.')[-1] if '.' in target_field else target_field
-                                        
-                                        # 添加JOIN语句
-                                        dataset_sql_parts.append(f"{join_type} JOIN {target_table_def} ON {source_table}.{pure_source_field} = {target_table}.{pure_target_field}")
-            
-            # 添加WHERE子句（筛选条件）
-            if request.filters and len(request.filters) > 0:
-                where_conditions = []
-                for filter_item in request.filters:
-                    field = filter_item.get('field', '')
-                    operator = filter_item.get('operator', '=')
-                    value = filter_item.get('value', '')
-                    
-                    # 根据操作符生成条件
-                    if operator == 'like':
-                        where_conditions.append(f"{field} LIKE '%{value}%'")
-                    elif operator == '=':
-                        where_conditions.append(f"{field} = '{value}'")
-                    elif operator == '!=':
-                        where_conditions.append(f"{field} != '{value}'")
-                    elif operator == '>':
-                        where_conditions.append(f"{field} > '{value}'")
-                    elif operator == '<':
-                        where_conditions.append(f"{field} < '{value}'")
-                    elif operator == '>=':
-                        where_conditions.append(f"{field} >= '{value}'")
-                    elif operator == '<=':
-                        where_conditions.append(f"{field} <= '{value}'")
-                
-                if where_conditions:
-                    dataset_sql_parts.append("WHERE " + " AND ".join(where_conditions))
-            
-            # 添加GROUP BY子句（维度）
-            if request.dimensions and len(request.dimensions) > 0:
-                # 使用之前构建的group_by_fields，确保与SELECT子句中的字段名保持一致
-                if group_by_fields:
-                    dataset_sql_parts.append("GROUP BY " + ", ".join(group_by_fields))
-            
-            # 组合数据集层SQL
-            dataset_sql = " ".join(dataset_sql_parts)
-            
-            # 构建模型层SQL（中间层）
-            model_field_mappings = []
-            for dim in request.dimensions:
-                model_field_mappings.append(f"dataset_query.dataset_{dim.replace('.', '_')} AS model_{dim.replace('.', '_')}")
-            for meas in request.measures:
-                model_field_mappings.append(f"dataset_query.dataset_{meas.replace('.', '_')} AS model_{meas.replace('.', '_')}")
-            
-            model_sql = f"SELECT {', '.join(model_field_mappings)} FROM ({dataset_sql}) AS dataset_query"
-            
-            # 构建透视层SQL（最外层）
-            pivot_field_mappings = []
-            for dim in request.dimensions:
-                pivot_field_mappings.append(f"model_query.model_{dim.replace('.', '_')} AS pivot_{dim.replace('.', '_')}")
-            for meas in request.measures:
-                pivot_field_mappings.append(f"model_query.model_{meas.replace('.', '_')} AS pivot_{meas.replace('.', '_')}")
-            
-            # 构建最终的三层嵌套SQL
-            model_sql_parts = []
-            model_sql_parts.append(f"SELECT {', '.join(pivot_field_mappings)}")
-            model_sql_parts.append(f"FROM ({model_sql}) AS model_query")
-            
-            # 添加最终ORDER BY子句（排序）
-            if request.sort_by:
-                sort_order = request.sort_order.upper() if request.sort_order else 'ASC'
-                model_sql_parts.append(f"ORDER BY pivot_{request.sort_by.replace('.', '_')} {sort_order}")
-            
-            # 组合完整SQL
-            model_sql = " ".join(model_sql_parts)
-            
-            # 执行SQL查询（使用真实数据库连接）
-            columns = request.dimensions + request.measures
-            data = []
-
-            # 从第一个数据集获取数据源信息，用于建立数据库连接
-            first_data_set_id = None
-            if data_model.data_sets and len(data_model.data_sets) > 0:
-                first_data_set_id = data_model.data_sets[0].get('data_set_id') if isinstance(data_model.data_sets[0], dict) else data_model.data_sets[0].data_set_id
-            
-            if first_data_set_id:
-                # 获取数据集信息
-                first_data_set = db.query(DataSet).filter(DataSet.id == first_data_set_id).first()
-                if first_data_set:
-                    # 获取数据源信息
-                    data_source = db.query(DataSource).filter(DataSource.id == first_data_set.data_source_id).first()
-                    if data_source:
-                        try:
-                            # 使用SQLAlchemy执行生成的SQL查询
-                            # 注意：这里使用原始SQL查询，因为生成的SQL可能包含复杂的嵌套结构
-                            from sqlalchemy import text
-                            
-                            # 根据数据源配置创建数据库连接
-                            from sqlalchemy import create_engine
-                            
-                            # 构建数据库连接URL
-                            if data_source.db_type == 'mysql':
-                                db_url = f"mysql+mysqlconnector://{data_source.username}:{data_source.password}@{data_source.host}:{data_source.port}/{data_source.database}"
-                            elif data_source.db_type == 'postgresql':
-                                db_url = f"postgresql://{data_source.username}:{data_source.password}@{data_source.host}:{data_source.port}/{data_source.database}"
-                            elif data_source.db_type == 'oracle':
-                                db_url = f"oracle://{data_source.username}:{data_source.password}@{data_source.host}:{data_source.port}/{data_source.database}"
-                            else:
-                                # 默认为SQLite
-                                db_url = "sqlite:///app.db"
-                            
-                            # 创建引擎
-                            engine = create_engine(db_url)
-                            
-                            # 执行模型SQL查询
-                            with engine.connect() as conn:
-                                result = conn.execute(text(model_sql))
-                                # 在连接关闭之前获取所有的查询结果
-                                rows = result.fetchall()
-                                # 获取结果的列名
-                                columns = result.keys()
-                            
-                            # 转换查询结果为字典列表
-                            for row in rows:
-                                row_dict = {}
-                                # 遍历结果行，将字段值映射到对应的列名
-                                for i, col in enumerate(columns):
-                                    row_dict[col] = row[i]
-                                data.append(row_dict)
-                            
-                            # 如果查询结果为空，直接返回空列表，不生成模拟数据
-                            # 空就是空，这是专业的做法
-                            
-                        except Exception as e:
-                            # 如果数据库查询失败，返回错误信息
-                            raise Exception(f"数据库查询失败: {str(e)}")
-                    else:
-                        # 数据源不存在，返回错误信息
-                        raise Exception(f"数据源不存在: {first_data_set.data_source_id}")
+                actual_field = field
+            select_fields.append(f"{quote}{actual_field}{quote}")
+
+        # 添加筛选条件，筛选值作为绑定参数传递
+        where_conditions = []
+        params = {}
+        if request.filters and len(request.filters) > 0:
+            for index, filter_item in enumerate(request.filters):
+                field = filter_item.get('field', '')
+                operator = filter_item.get('operator', '=')
+                value = filter_item.get('value', '')
+                if operator not in FILTER_OPERATORS:
+                    raise Exception(f"不支持的筛选操作符: {operator}")
+
+                # 处理字段名，去掉表名前缀
+                actual_field = check_identifier(field.split('.')[-1])
+
+                param = f"filter_{index}"
+                if operator == 'is null':
+                    where_conditions.append(f"{quote}{actual_field}{quote} IS NULL")
+                elif operator == 'like':
+                    where_conditions.append(f"{quote}{actual_field}{quote} LIKE :{param}")
+                    params[param] = f"%{value}%"
                 else:
-                    # 数据集不存在，返回错误信息
-                    raise Exception(f"数据集不存在: {first_data_set_id}")
-            else:
-                # 没有数据集，返回错误信息
-                raise Exception("数据模型中没有配置数据集")
+                    where_conditions.append(f"{quote}{actual_field}{quote} {operator} :{param}")
+                    params[param] = value
 
-            return PivotAnalysisResponse(
-                success=True,
-                data=data,
-                columns=columns,
-                sql=sql,
-                model_sql=model_sql,
-                message="透视分析成功"
-            )
-        finally:
-            db.close()
+        # 添加排序
+        sort_order = check_sort_order(request.sort_order)
+        order_by = []
+        for sort_field in (request.sort_by, getattr(request, 'key_field', None)):
+            if not sort_field:
+                continue
+            # 处理字段名，去掉表名前缀
+            actual_sort_field = f"{quote}{check_identifier(sort_field.split('.')[-1])}{quote}"
+            if actual_sort_field not in [column for column, _ in order_by]:
+                order_by.append((actual_sort_field, sort_order))
+
+        from_clause = local_source.table_for(data_set.id) if local_source is not None else f"`{table_name}`"
+        query = SelectQuery(select_fields, from_clause, where_conditions, order_by, params)
+        return data_set, data_source, query
 
     async def adhoc_query(self, request: AdhocQueryRequest) -> AdhocQueryResponse:
+        result = await self.adhoc_result(request)
+        return AdhocQueryResponse(
+            success=True,
+            data=result.records(),
+            total=result.total,
+            next_cursor=result.next_cursor,
+            message=result.message
+        )
+
+    async def adhoc_stream(self, request: AdhocStreamRequest):
+        """流式即席查询：返回列名和按批次产出结果行的异步迭代器，内存占用与结果集大小无关"""
         db = SessionLocal()
         try:
-            # 验证数据集是否存在
-            data_set = db.query(DataSet).filter(DataSet.id == request.data_set_id).first()
-            if not data_set:
-                raise Exception(f"数据集不存在: {request.data_set_id}")
-
-            # 获取数据源信息
-            data_source = db.query(DataSource).filter(DataSource.id == data_set.data_source_id).first()
-            if not data_source:
-                raise Exception(f"数据源不存在: {data_set.data_source_id}")
-
-            # 验证字段是否存在于数据集中
-            field_names = []
-            for field in data_set.fields:
-                if isinstance(field, dict):
-                    if 'name' in field:
-                        field_names.append(field['name'])
-                    elif 'field' in field:
-                        field_names.append(field['field'])
-                    else:
-                        field_names.append(str(field))
-                else:
-                    try:
-                        field_names.append(field.name)
-                    except AttributeError:
-                        field_names.append(str(field))
+            data_set, data_source, query = self._build_adhoc_query(db, request)
+        finally:
+            db.close()
+
+        sql_query = query.to_sql(limit=request.limit, offset=request.offset)
+        batch_size = max(1, request.batch_size)
+        self._check_available(data_source)
+        batches = query_executor.stream(data_source, self._stream_query, data_source, sql_query, query.params, batch_size)
+        # 先取出列名，查询错误在开始输出响应之前抛出
+        columns = await batches.__anext__()
+        return columns, batches
 
-            for field in request.fields:
-                if field not in field_names:
-                    raise Exception(f"字段不存在: {field}")
+    async def adhoc_result(self, request: AdhocQueryRequest) -> QueryResult:
+        """执行即席查询，返回未转换格式的查询结果"""
+        db = SessionLocal()
+        try:
+            data_set, data_source, query = self._build_adhoc_query(db, request)
+            ttl = self._cache_ttl([data_set.refresh_interval, data_source.refresh_interval])
+            tags = [("source", data_source.id), ("data_set", data_set.id)]
 
-            # 构建SQL查询
             if data_set.creation_mode == 'sql':
-                # SQL模式：直接使用用户提供的SQL查询
-                sql_query = data_set.sql_query
-                
-                # 添加字段选择（如果用户指定了字段）
-                if request.fields and len(request.fields) > 0:
-                    # 这里需要解析SQL并替换SELECT子句
-                    # 为了简化，我们假设用户提供的SQL已经包含了正确的字段
-                    # 实际项目中可能需要更复杂的SQL解析
-                    pass
+                # SQL模式不分页，总数即为结果行数，相同查询优先从缓存读取
+                columns, rows, _ = await self._cached_query(data_source, query.to_sql(), query.params, ttl, tags)
+                result = QueryResult(columns, rows, total=len(rows), sql=query.to_sql())
             else:
-                # 可视化模式：根据visual_config生成SQL查询
-                if not data_set.visual_config:
-                    raise Exception("数据集配置不完整")
-                
-                # 获取表名
-                tables = data_set.visual_config.get('tables', [])
-                if not tables:
-                    raise Exception("数据集配置中缺少表信息")
-                
-                table_name = tables[0]
-                
-                # 构建SELECT子句
-                # 处理字段名，去掉表名前缀（例如：sys_oper_log.title -> title）
-                select_fields = []
-                for field in request.fields:
-                    # 如果字段名包含表名前缀，提取纯字段名
-                    if '.' in field:
-                        actual_field = field.split('.')[-1]
-                    else:
-                        actual_field = field
-                    select_fields.append(f"`{actual_field}`")
-                
-                select_fields_str = ', '.join(select_fields)
-                
-                # 构建基础SQL查询
-                sql_query = f"SELECT {select_fields_str} FROM `{table_name}`"
-                
-                # 添加筛选条件
-                if request.filters and len(request.filters) > 0:
-                    where_conditions = []
-                    for filter_item in request.filters:
-                        field = filter_item.field
-                        operator = filter_item.operator
-                        value = filter_item.value
-                        
-                        # 处理字段名，去掉表名前缀
-                        if '.' in field:
-                            actual_field = field.split('.')[-1]
-                        else:
-                            actual_field = field
-                        
-                        if operator == 'like':
-                            where_conditions.append(f"`{actual_field}` LIKE '%{value}%'")
-                        else:
-                            where_conditions.append(f"`{actual_field}` {operator} '{value}'")
-                    
-                    if where_conditions:
-                        sql_query += " WHERE " + " AND ".join(where_conditions)
-                
-                # 添加排序
-                if request.sort_by:
-                    # 处理字段名，去掉表名前缀
-                    if '.' in request.sort_by:
-                        actual_sort_field = request.sort_by.split('.')[-1]
-                    else:
-                        actual_sort_field = request.sort_by
-                    
-                    sort_order = request.sort_order.upper() if request.sort_order else 'ASC'
-                    sql_query += f" ORDER BY `{actual_sort_field}` {sort_order}"
-                
-                # 添加分页
-                limit = request.limit or 1000
-                offset = request.offset or 0
-                sql_query += f" LIMIT {limit} OFFSET {offset}"
+                if request.pagination not in ("offset", "keyset"):
+                    raise Exception(f"不支持的分页方式: {request.pagination}")
+                if request.pagination == "keyset" and not request.key_field:
+                    # 只按排序字段定位时，排序值相同的行在页边界处会被跳过
+                    raise Exception("键集分页需要指定唯一键字段(key_field)")
+                result = await self._fetch_page(
+                    data_source, query, request.limit or 1000, request.offset or 0, ttl, tags,
+                    pagination=request.pagination, cursor=request.cursor
+                )
 
-            # 根据数据源配置创建数据库连接
-            from sqlalchemy import create_engine, text
-            
-            # 构建数据库连接URL
-            if data_source.db_type == 'mysql':
-                db_url = f"mysql+mysqlconnector://{data_source.username}:{data_source.password}@{data_source.host}:{data_source.port}/{data_source.database}"
-            elif data_source.db_type == 'postgresql':
-                db_url = f"postgresql://{data_source.username}:{data_source.password}@{data_source.host}:{data_source.port}/{data_source.database}"
-            elif data_source.db_type == 'oracle':
-                db_url = f"oracle://{data_source.username}:{data_source.password}@{data_source.host}:{data_source.port}/{data_source.database}"
-            else:
-                # 默认为SQLite
-                db_url = "sqlite:///app.db"
-            
-            # 创建引擎
-            engine = create_engine(db_url)
-            
-            # 执行SQL查询
-            with engine.connect() as conn:
-                # 先执行COUNT查询获取总数
-                count_query = f"SELECT COUNT(*) as total FROM ({sql_query}) as count_query"
-                count_result = conn.execute(text(count_query)).fetchone()
-                total = count_result[0] if count_result else 0
-                
-                # 执行主查询
-                result = conn.execute(text(sql_query))
-                # 在连接关闭之前获取所有的查询结果
-                rows = result.fetchall()
-                # 获取结果的列名
-                columns = result.keys()
-            
-            # 转换查询结果为字典列表
-            data = []
-            for row in rows:
-                row_dict = {}
-                # 遍历结果行，将字段值映射到对应的列名
-                for i, col in enumerate(columns):
-                    row_dict[col] = row[i]
-                data.append(row_dict)
-
-            return AdhocQueryResponse(
-                success=True,
-                data=data,
-                total=total,
-                message="即席查询成功"
-            )
+            result.message = "即席查询成功"
+            return result
         except Exception as e:
             raise Exception(f"即席查询失败: {str(e)}")
         finally:
             db.close()
 
+    def _is_summary_field(self, field_name: str) -> bool:
+        """根据字段名判断是否需要在汇总行中求和"""
+        return any(keyword in str(field_name).lower() for keyword in SUMMARY_KEYWORDS)
+
+    def _build_spreadsheet_query(self, db: Session, request: SpreadsheetRequest):
+        """生成电子表格的查询，包含数据集全部字段，筛选和排序条件与即席查询一致"""
+        # 验证数据集是否存在
+        data_set = db.query(DataSet).filter(DataSet.id == request.data_set_id).first()
+        if not data_set:
+            raise Exception(f"数据集不存在: {request.data_set_id}")
+
+        # 获取数据集字段
+        # 处理不同格式的字段数据
+        field_names = []
+        for field in data_set.fields:
+            if isinstance(field, dict):
+                if 'name' in field:
+                    field_names.append(field['name'])
+                elif 'field' in field:
+                    field_names.append(field['field'])
+                else:
+                    field_names.append(str(field))
+            else:
+                try:
+                    field_names.append(field.name)
+                except AttributeError:
+                    field_names.append(str(field))
+
+        parameters = request.parameters or {}
+        query_request = AdhocQueryRequest(
+            data_set_id=request.data_set_id,
+            fields=field_names,
+            filters=parameters.get('filters'),
+            sort_by=parameters.get('sort_by'),
+            sort_order=parameters.get('sort_order', 'ASC')
+        )
+        data_set, data_source, query = self._build_adhoc_query(db, query_request)
+        return data_set, data_source, field_names, query
+
     async def spreadsheet(self, request: SpreadsheetRequest) -> SpreadsheetResponse:
         db = SessionLocal()
         try:
-            # 验证数据集是否存在
-            data_set = db.query(DataSet).filter(DataSet.id == request.data_set_id).first()
-            if not data_set:
-                raise Exception(f"数据集不存在: {request.data_set_id}")
-
-            # 获取数据源信息
-            data_source = db.query(DataSource).filter(DataSource.id == data_set.data_source_id).first()
-            if not data_source:
-                raise Exception(f"数据源不存在: {data_set.data_source_id}")
-
-            # 获取数据集字段
-            # 处理不同格式的字段数据
-            field_names = []
-            for field in data_set.fields:
-                if isinstance(field, dict):
-                    if 'name' in field:
-                        field_names.append(field['name'])
-                    elif 'field' in field:
-                        field_names.append(field['field'])
-                    else:
-                        field_names.append(str(field))
-                else:
-                    try:
-                        field_names.append(field.name)
-                    except AttributeError:
-                        field_names.append(str(field))
+            data_set, data_source, field_names, query = self._build_spreadsheet_query(db, request)
 
-            # 构建SQL查询
-            if data_set.creation_mode == 'sql':
-                # SQL模式：直接使用用户提供的SQL查询
-                sql_query = data_set.sql_query
-            else:
-                # 可视化模式：根据visual_config生成SQL查询
-                if not data_set.visual_config:
-                    raise Exception("数据集配置不完整")
-                
-                # 获取表名
-                tables = data_set.visual_config.get('tables', [])
-                if not tables:
-                    raise Exception("数据集配置中缺少表信息")
-                
-                table_name = tables[0]
-                
-                # 构建SELECT子句
-                # 处理字段名，去掉表名前缀
-                select_fields = []
-                for field in field_names:
-                    if '.' in field:
-                        actual_field = field.split('.')[-1]
-                    else:
-                        actual_field = field
-                    select_fields.append(f"`{actual_field}`")
-                
-                select_fields_str = ', '.join(select_fields)
-                
-                # 构建基础SQL查询
-            sql_query = f"SELECT {select_fields_str} FROM `{table_name}`"
-            
-            # 添加排序
-            if request.parameters and 'sort_by' in request.parameters:
-                sort_field = request.parameters['sort_by']
-                sort_order = request.parameters.get('sort_order', 'ASC').upper()
-                
-                # 处理字段名，去掉表名前缀
-                if '.' in sort_field:
-                    actual_sort_field = sort_field.split('.')[-1]
-                else:
-                    actual_sort_field = sort_field
-                
-                sql_query += f" ORDER BY `{actual_sort_field}` {sort_order}"
-            
-            # 构建计数查询
-            count_query = f"SELECT COUNT(*) as total FROM `{table_name}`"
-            
             # 计算偏移量
             offset = (request.page - 1) * request.page_size
-            
-            # 添加分页
-            sql_query += f" LIMIT {request.page_size} OFFSET {offset}"
 
-            # 根据数据源配置创建数据库连接
-            from sqlalchemy import create_engine, text
-            
-            # 构建数据库连接URL
-            if data_source.db_type == 'mysql':
-                db_url = f"mysql+mysqlconnector://{data_source.username}:{data_source.password}@{data_source.host}:{data_source.port}/{data_source.database}"
-            elif data_source.db_type == 'postgresql':
-                db_url = f"postgresql://{data_source.username}:{data_source.password}@{data_source.host}:{data_source.port}/{data_source.database}"
-            elif data_source.db_type == 'oracle':
-                db_url = f"oracle://{data_source.username}:{data_source.password}@{data_source.host}:{data_source.port}/{data_source.database}"
-            else:
-                # 默认为SQLite
-                db_url = "sqlite:///app.db"
-            
-            # 创建引擎
-            engine = create_engine(db_url)
-            
-            # 执行SQL查询
-            with engine.connect() as conn:
-                # 执行主查询
-                result = conn.execute(text(sql_query))
-                # 在连接关闭之前获取所有的查询结果
-                rows = result.fetchall()
-                # 获取结果的列名
-                columns = result.keys()
-                
-                # 执行计数查询
-                count_result = conn.execute(text(count_query))
-                total = count_result.scalar() or 0
+            # 执行分页查询，总数按筛选条件计算
+            result = await self._fetch_page(
+                data_source, query, request.page_size, offset,
+                ttl=self._cache_ttl([data_set.refresh_interval, data_source.refresh_interval]),
+                tags=[("source", data_source.id), ("data_set", data_set.id)]
+            )
+            columns, rows, row_total = result.columns, result.rows, result.total
             
             # 转换查询结果为字典列表
-            data_rows = []
-            for row in rows:
-                row_dict = {}
-                # 遍历结果行，将字段值映射到对应的列名
-                for i, col in enumerate(columns):
-                    row_dict[col] = row[i]
-                data_rows.append(row_dict)
+            data_rows = QueryResult(columns, rows).records()
 
             # 创建Excel工作簿
             workbook = openpyxl.Workbook()
@@ -829,7 +656,7 @@ class VisualizationService:
                 else:
                     actual_field = field_name
                 
-                if any(keyword in str(actual_field).lower() for keyword in ['amount', '金额', '销售', '利润', 'count', '数量', 'price', '价格']):
+                if self._is_summary_field(actual_field):
                     cell = worksheet.cell(row=summary_row, column=col_idx)
                     # 添加SUM公式
                     cell.value = f"=SUM({openpyxl.utils.get_column_letter(col_idx)}2:{openpyxl.utils.get_column_letter(col_idx)}{len(data_rows) + 1})"
@@ -872,7 +699,7 @@ class VisualizationService:
                 else:
                     actual_field = field_name
                 
-                if any(keyword in str(actual_field).lower() for keyword in ['amount', '金额', '销售', '利润', 'count', '数量', 'price', '价格']):
+                if self._is_summary_field(actual_field):
                     cell_key = f"{openpyxl.utils.get_column_letter(col_idx)}{summary_row}"
                     # 计算汇总值
                     total = sum(row_data.get(actual_field, 0) or 0 for row_data in data_rows)
@@ -889,7 +716,7 @@ class VisualizationService:
                 "workbook_base64": workbook_base64,
                 "file_name": f"数据集_{request.data_set_id}_导出.xlsx",
                 "cells": cells,
-                "total": total
+                "total": row_total
             }
 
             return SpreadsheetResponse(
@@ -900,4 +727,83 @@ class VisualizationService:
         finally:
             db.close()
 
+    def _write_workbook(self, data_source: DataSource, sql: str, params: Optional[Dict[str, Any]], path: str) -> int:
+        """在执行器线程中通过服务端游标逐批读取数据，以只写模式写入工作簿文件，返回数据行数"""
+        workbook = openpyxl.Workbook(write_only=True)
+        worksheet = workbook.create_sheet("数据")
+        batches = self._stream_query(data_source, sql, params, settings.SPREADSHEET_EXPORT_BATCH_SIZE)
+        try:
+            # 处理字段名，去掉表名前缀
+            headers = [column.split('.')[-1] for column in next(batches)]
+
+            # 只写模式下列宽需要在写入数据之前设置
+            for col_idx, header in enumerate(headers, 1):
+                worksheet.column_dimensions[get_column_letter(col_idx)].width = max(15, len(str(header)) + 2)
+
+            # 添加表头
+            header_cells = []
+            for header in headers:
+                cell = WriteOnlyCell(worksheet, value=header)
+                # 设置表头样式
+                cell.font = Font(bold=True)
+                cell.alignment = Alignment(horizontal='center', vertical='center')
+                header_cells.append(cell)
+            worksheet.append(header_cells)
+
+            # 添加数据行
+            row_count = 0
+            for rows in batches:
+                for row in rows:
+                    worksheet.append(list(row))
+                row_count += len(rows)
+        finally:
+            batches.close()
+
+        # 添加汇总行
+        summary_cells = []
+        for col_idx, header in enumerate(headers, 1):
+            cell = WriteOnlyCell(worksheet)
+            if col_idx == 1:
+                cell.value = "总计"
+            elif self._is_summary_field(header):
+                # 添加SUM公式
+                column_letter = get_column_letter(col_idx)
+                cell.value = f"=SUM({column_letter}2:{column_letter}{row_count + 1})"
+            cell.font = Font(bold=True)
+            summary_cells.append(cell)
+        worksheet.append(summary_cells)
+
+        workbook.save(path)
+        return row_count
+
+    def _read_and_remove(self, path: str, chunk_size: int = 64 * 1024):
+        """分块读取导出文件，读取完成或客户端断开后删除临时文件"""
+        try:
+            with open(path, "rb") as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+        finally:
+            os.remove(path)
+
+    async def export_spreadsheet(self, request: SpreadsheetRequest):
+        """导出数据集全部数据为xlsx文件，返回文件名和按块读取文件内容的迭代器"""
+        db = SessionLocal()
+        try:
+            data_set, data_source, field_names, query = self._build_spreadsheet_query(db, request)
+        finally:
+            db.close()
+
+        self._check_available(data_source)
+        fd, path = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+        try:
+            await query_executor.run(data_source, self._write_workbook, data_source, query.to_sql(), query.params, path)
+        except Exception:
+            os.remove(path)
+            raise
+        return f"数据集_{request.data_set_id}_导出.xlsx", self._read_and_remove(path)
+
 visualization_service = VisualizationService()
\ No newline at end of file